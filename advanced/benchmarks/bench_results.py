@@ -0,0 +1,83 @@
+"""
+Benchmark of the columnar log parser against the per-line parsing of the original open_results_csv.
+
+Usage: python benchmarks/bench_results.py [--lines N ...]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from plant_population_simulator_plugin.results import read_log, row_count
+
+SAMPLE_LOGS = [
+    os.path.join(ROOT, "log_file", "map_log.csv"),
+    os.path.join(ROOT, "..", "basic", "log_files", "grid_log.csv"),
+]
+
+def legacy_parse(csv_path):
+    """The per-line parsing open_results_csv did before the columnar parser (without the QGIS features)."""
+    rows = []
+    with open(csv_path, "r") as file:
+        line_count = 0
+        for line in file:
+            if line_count < 2:
+                line_count += 1
+                continue
+            parts = line.strip().split(";")
+            if len(parts) < 5:
+                continue
+            time_step = int(parts[0])
+            coords = parts[2].strip("()").replace(",", "_").split("_")
+            values = parts[4].strip("<>").split(",")
+            rows.append((time_step, float(coords[0]), float(coords[1]), int(values[4])))
+    return rows
+
+def synthetic_log(path, lines, sample):
+    """Write a log of about `lines` rows by repeating the rows of a sample log with shifted times."""
+    with open(sample, "r") as f:
+        header = [f.readline(), f.readline()]
+        rows = f.readlines()
+    last_time = int(rows[-1].split(";", 1)[0]) + 1
+    with open(path, "w") as f:
+        f.writelines(header)
+        written, repeat = 0, 0
+        while written < lines:
+            offset = repeat * last_time
+            for row in rows[:lines - written]:
+                time_step, rest = row.split(";", 1)
+                f.write(f"{int(time_step) + offset};{rest}")
+            written += min(len(rows), lines - written)
+            repeat += 1
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", nargs="*", type=int, default=[100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"{'log':>24} {'lines':>10} {'loop [s]':>10} {'columns [s]':>12} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        logs = list(SAMPLE_LOGS)
+        for lines in args.lines:
+            path = os.path.join(directory, f"synthetic_{lines}.csv")
+            synthetic_log(path, lines, SAMPLE_LOGS[0])
+            logs.append(path)
+
+        for path in logs:
+            rows, loop_time = timed(legacy_parse, path)
+            columns, columns_time = timed(read_log, path, True)
+            if row_count(columns) != len(rows):
+                sys.exit(f"Row count mismatch for {path}")
+            print(f"{os.path.basename(path):>24} {len(rows):>10} {loop_time:>10.3f} {columns_time:>12.3f} {loop_time / columns_time:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmark of the scenario builder and writer against the original per-cell loop and json.dump of dump_json.
+
+Usage: python benchmarks/bench_scenario.py [SIZE ...] [--resolution N] [--workers N ...]
+"""
+import argparse
+import filecmp
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from plant_population_simulator_plugin.scenario import FUELS, build_cell_grid, build_scenario, write_scenario
+from plant_population_simulator_plugin.tiles import write_tiled_scenario
+
+def synthetic_rasters(size, seed=0):
+    """Return a DTM, a landcover and an initial pine raster of size x size pixels."""
+    rng = numpy.random.default_rng(seed)
+    dtm = rng.uniform(-20, 400, (size, size)).astype(numpy.float32)
+    # No water (18): the legacy loop predates Water cells
+    landcover = rng.choice([0, 1, 5, 8, 14, 16, 20], (size, size)).astype(numpy.float32)
+    pine = numpy.zeros((size, size), dtype=numpy.uint8)
+    pine[size // 4:size // 2, size // 4:size // 2] = 1
+    transform = from_origin(480000.0, 5095000.0, 1.0, 1.0)
+    return dtm, landcover, pine, transform
+
+def legacy_build_scenario(dtm_data, landcover_data, initial_pine_data, elevation_transform, resolution):
+    """The per-cell loop dump_json used before the vectorized builder."""
+    height, width = initial_pine_data.shape
+    data = {"cells": {"default": {"delay": "inertial", "model": "plant_population", "state": {
+        "current_resources": {"water": 0, "sunlight": 0, "nitrogen": 0, "potassium": 0},
+        "soil_type": 0, "elevation": 0, "tree_height": 0, "tree_type": 0}}}}
+    for row in range(0, height, resolution):
+        for col in range(0, width, resolution):
+            dtm_value = dtm_data[row][col]
+            landcover_value = landcover_data[row][col]
+            initial_pine_value = initial_pine_data[row][col]
+            x, y = elevation_transform * (col, row)
+            cell_name = f"{int(x)}_{int(y)}"
+            try:
+                fuel = FUELS[int(landcover_value)]
+            except KeyError:
+                continue
+            if (dtm_value < 0):
+                continue
+            tree_type = 1 if bool(initial_pine_value) else 0
+            data["cells"][cell_name] = {
+                "state": {
+                    "current_resources": {"water": 0, "sunlight": 0, "nitrogen": 0, "potassium": 0},
+                    "soil_type": 0, "elevation": int(dtm_value), "tree_height": 0, "tree_type": int(tree_type)},
+                "neighborhood": {}
+            }
+            for neighbor in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+                c = col + (neighbor[0] * resolution)
+                r = row + (neighbor[1] * resolution)
+                if c < 0 or r < 0 or c >= width or r >= height:
+                    continue
+                try:
+                    fuel = FUELS[int(landcover_data[r][c])]
+                except KeyError:
+                    continue
+                if (dtm_data[r][c] < 0):
+                    continue
+                neighbor_x, neighbor_y = elevation_transform * (c, r)
+                data["cells"][cell_name]["neighborhood"][f"{int(neighbor_x)}_{int(neighbor_y)}"] = resolution
+    return data
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def traced(function, *args):
+    """Return the run time and the peak traced Python memory of a call."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def dump_in_memory(rasters, resolution, path):
+    with open(path, "w") as f:
+        json.dump(legacy_build_scenario(*rasters, resolution), f, indent=4)
+
+def dump_streaming(rasters, resolution, path):
+    write_scenario(build_cell_grid(*rasters, resolution), path)
+
+def dump_tiled(rasters, resolution, path, workers):
+    write_tiled_scenario(*rasters, resolution, path, workers=workers)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=[500, 1000, 2000])
+    parser.add_argument("--resolution", type=int, default=5)
+    parser.add_argument("--workers", nargs="*", type=int, default=[1, 2, 4], help="processes of the tiled writer")
+    args = parser.parse_args()
+
+    # "grid" is the vectorized cell/neighbour computation alone, "scenario" includes building the JSON objects
+    print(f"{'pixels':>12} {'cells':>10} {'loop [s]':>10} {'grid [s]':>10} {'scenario [s]':>12} {'speedup':>8}")
+    for size in args.sizes:
+        rasters = synthetic_rasters(size)
+        expected, loop_time = timed(legacy_build_scenario, *rasters, args.resolution)
+        _, grid_time = timed(build_cell_grid, *rasters, args.resolution)
+        actual, numpy_time = timed(build_scenario, *rasters, args.resolution)
+        if actual != expected:
+            sys.exit(f"Output mismatch for size {size}")
+        cells = len(actual["cells"]) - 1
+        print(f"{size * size:>12} {cells:>10} {loop_time:>10.3f} {grid_time:>10.3f} {numpy_time:>12.3f} {loop_time / numpy_time:>7.1f}x")
+
+    # Whole dump_json write path: in-memory dictionary + json.dump(indent=4) against the streaming writer
+    print()
+    print(f"{'pixels':>12} {'dump [s]':>10} {'dump peak':>12} {'stream [s]':>10} {'stream peak':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "map.json")
+        for size in args.sizes:
+            rasters = synthetic_rasters(size)
+            dump_time, dump_peak = traced(dump_in_memory, rasters, args.resolution, path)
+            stream_time, stream_peak = traced(dump_streaming, rasters, args.resolution, path)
+            print(f"{size * size:>12} {dump_time:>10.3f} {dump_peak / 2**20:>9.1f} MB {stream_time:>10.3f} {stream_peak / 2**20:>9.1f} MB")
+
+    # Tiled writer against the streaming writer, by number of worker processes
+    print()
+    print(f"{'pixels':>12} {'stream [s]':>10}" + "".join(f" {f'{workers} proc [s]':>12}" for workers in args.workers))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "map.json")
+        tiled_path = os.path.join(directory, "tiled.json")
+        for size in args.sizes:
+            rasters = synthetic_rasters(size)
+            _, stream_time = timed(dump_streaming, rasters, args.resolution, path)
+            line = f"{size * size:>12} {stream_time:>10.3f}"
+            for workers in args.workers:
+                _, tiled_time = timed(dump_tiled, rasters, args.resolution, tiled_path, workers)
+                if not filecmp.cmp(path, tiled_path, shallow=False):
+                    sys.exit(f"Tiled output mismatch for size {size} with {workers} processes")
+                line += f" {tiled_time:>12.3f}"
+            print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Check the NumPy reference engine against Cadmium logs: runs the engine on a scenario for the
+duration of its log and prints, per state field, the number of steps and cell states that differ.
+
+Usage: python benchmarks/check_engine.py [--scenario CONFIG LOG ...]
+
+The rules of the basic or advanced model (see engine.MODELS) are picked from the scenario.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from plant_population_simulator_plugin.engine import compare_with_log, load_scenario, scenario_model, simulate
+from plant_population_simulator_plugin.results import read_log
+from plant_population_simulator_plugin.scenario import STATE_FIELDS
+
+# Scenario and log of the shipped models
+SCENARIOS = [
+    (os.path.join(ROOT, "config", "map.json"), os.path.join(ROOT, "log_file", "map_log.csv")),
+    (os.path.join(ROOT, "..", "basic", "config", "plant_population_config.json"),
+     os.path.join(ROOT, "..", "basic", "log_files", "grid_log.csv")),
+]
+
+def check(config_path, log_path):
+    model = scenario_model(config_path)
+    grid, default = load_scenario(config_path)
+    columns = read_log(log_path, outputs=True)
+    steps = int(columns["time"].max())
+
+    start = time.perf_counter()
+    history = simulate(grid, default, steps, model)
+    seconds = time.perf_counter() - start
+
+    mismatches = compare_with_log(grid, history, columns)
+    print(f"{os.path.relpath(config_path, ROOT)} ({model} model): {len(grid)} cells, {steps} steps in {seconds:.3f} s")
+    print(f"{'field':>12} {'steps':>8} {'states':>8}")
+    for field in STATE_FIELDS:
+        counts = [step[field] for step in mismatches]
+        print(f"{field:>12} {sum(1 for count in counts if count):>8} {sum(counts):>8}")
+    matching = next((t for t, step in enumerate(mismatches) if any(step.values())), len(mismatches))
+    print(f"Identical to the log for the first {matching} of {len(mismatches)} steps")
+    return matching == len(mismatches)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", nargs=2, action="append", metavar=("CONFIG", "LOG"))
+    args = parser.parse_args()
+
+    results = [check(*scenario) for scenario in args.scenario or SCENARIOS]
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Benchmark suite of the scenario preparation and results ingestion pipelines, with a JSON report.
+
+Synthetic GeoTIFF DTM and landcover rasters and Cadmium logs are generated at several sizes, then
+every stage of prepare_scenario (clip, align, seed, cells, write: what dump_json, clip_initial_pine_region
+and convert_to_json did) and of the results loading (parse, store, timeline, frames: what
+open_results_csv did, without the QGIS layer) is timed with its peak traced memory. Every case runs
+in a fresh process, which also gives its peak RSS. Reports of two commits are compared with --compare.
+
+Usage: python benchmarks/suite.py [--pixels N ...] [--lines N ...] [--output REPORT] [--compare BASE]
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from plant_population_simulator_plugin.pipeline import peak_rss, prepare_scenario
+from plant_population_simulator_plugin.results import read_log, row_count
+from plant_population_simulator_plugin.scenario import FUELS, TREE_SPECIES
+from plant_population_simulator_plugin.store import build_store, open_store
+from plant_population_simulator_plugin.timeline import CellTimeline
+
+REPORT_FORMAT = "plant_population_benchmark"
+REPORT_VERSION = 1
+
+# Synthetic rasters: projected CRS, origin and landcover classes (FUELS classes plus unknown ones)
+CRS = "EPSG:2959"
+ORIGIN = (480000.0, 5100000.0)
+LANDCOVER_CLASSES = [0, 20] + sorted(FUELS)
+LANDCOVER_BLOCK = 16
+
+# Rows of raster written at a time, and frames shown by the results case
+BAND_ROWS = 1024
+FRAMES = 100
+
+# Stages shorter than this are never reported as slower, their timing is mostly noise
+NOISE_SECONDS = 0.05
+
+# Cells of the synthetic logs and the fraction of them changing at every step
+LOG_SIDE = 300
+LOG_CHANGING = 0.1
+
+#########################
+# SYNTHETIC DATA
+#########################
+
+def write_rasters(directory, size, seed=0):
+    """
+    Write a size x size pixel DTM (smooth relief, negative in one corner) and landcover (random
+    classes by blocks of pixels) as tiled GeoTIFFs, a band of rows at a time. Returns their paths.
+    """
+    rng = numpy.random.default_rng(seed)
+    transform = from_origin(ORIGIN[0], ORIGIN[1], 1.0, 1.0)
+    profile = {"driver": "GTiff", "width": size, "height": size, "count": 1, "crs": CRS, "transform": transform,
+               "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "deflate"}
+    blocks = rng.choice(LANDCOVER_CLASSES, (math.ceil(size / LANDCOVER_BLOCK),) * 2).astype(numpy.uint8)
+
+    paths = {"dtm": os.path.join(directory, f"dtm_{size}.tif"), "land": os.path.join(directory, f"land_{size}.tif")}
+    with rasterio.open(paths["dtm"], "w", dtype="float32", nodata=-9999, **profile) as dtm, \
+            rasterio.open(paths["land"], "w", dtype="uint8", **profile) as land:
+        cols = numpy.arange(size)
+        for start in range(0, size, BAND_ROWS):
+            rows = numpy.arange(start, min(start + BAND_ROWS, size))[:, None]
+            window = Window(0, start, size, len(rows))
+            relief = 200 + 80 * numpy.sin(cols / 97.0) * numpy.cos(rows / 131.0) + 300 * (rows + cols) / (2 * size)
+            relief = numpy.where((rows + cols) < size // 10, -5.0, relief)
+            dtm.write(relief.astype(numpy.float32), 1, window=window)
+            land.write(blocks[rows // LANDCOVER_BLOCK, cols // LANDCOVER_BLOCK], 1, window=window)
+    return paths
+
+def region_polygon(size, inset=0.05):
+    """Return an octagon inside a synthetic raster, as a GeoJSON polygon in its CRS."""
+    left, top = ORIGIN
+    a, b = size * inset, size * (1 - inset)
+    c, d = size * 0.3, size * 0.7
+    ring = [(a, c), (c, a), (d, a), (b, c), (b, d), (d, b), (c, b), (a, d), (a, c)]
+    return {"type": "Polygon", "coordinates": [[(left + x, top - y) for x, y in ring]]}
+
+def seeding_polygons(size):
+    """Return one square initial tree area of every seedable species along the diagonal of a raster."""
+    seedings = []
+    for i, species in enumerate(("Locust", "Pine", "Oak")):
+        x, y = size * (0.25 + 0.2 * i), size * (0.25 + 0.2 * i)
+        half = size * 0.08
+        square = {"type": "Polygon", "coordinates": [[
+            (ORIGIN[0] + x - half, ORIGIN[1] - y + half), (ORIGIN[0] + x + half, ORIGIN[1] - y + half),
+            (ORIGIN[0] + x + half, ORIGIN[1] - y - half), (ORIGIN[0] + x - half, ORIGIN[1] - y - half),
+            (ORIGIN[0] + x - half, ORIGIN[1] - y + half)]]}
+        seedings.append((square, TREE_SPECIES[species]))
+    return seedings
+
+def write_log(path, lines, side=LOG_SIDE, seed=0):
+    """
+    Write a Cadmium log of about `lines` rows over side x side "x_y" cells: every cell logs its state
+    and output at time 0, then a random LOG_CHANGING of them at every later step.
+    """
+    rng = numpy.random.default_rng(seed)
+    cells = side * side
+    x, y = numpy.meshgrid(480000 + 50 * numpy.arange(side), 5094000 + 50 * numpy.arange(side))
+    names = [f"{a}_{b}" for a, b in zip(x.ravel().tolist(), y.ravel().tolist())]
+    changing = max(1, int(cells * LOG_CHANGING))
+
+    with open(path, "w") as f:
+        f.write("sep=;\ntime;model_id;model_name;port_name;data\n")
+        written, t = 0, 0
+        while written < lines:
+            count = min(cells if t == 0 else changing, max(1, (lines - written) // 2))
+            chosen = numpy.arange(count) if t == 0 else rng.choice(cells, count, replace=False)
+            chosen.sort()
+            resources = rng.integers(0, 31, (count, 4))
+            height, soil = rng.integers(0, 71, count), rng.integers(0, 3, count)
+            elevation, species = rng.integers(200, 400, count), rng.integers(0, 5, count)
+            rows = []
+            for i, cell in enumerate(chosen.tolist()):
+                state = ",".join(map(str, resources[i].tolist() + [height[i], soil[i], elevation[i], species[i]]))
+                rows.append(f"{t};{cell + 1};{names[cell]};;<{state}>\n")
+                rows.append(f"{t};{cell + 1};{names[cell]};outputNeighborhood;<{state}>\n")
+            f.writelines(rows)
+            written += len(rows)
+            t += 1
+
+#########################
+# CASES
+#########################
+
+class StageRecorder:
+    """Times stages and records the peak traced memory of each, resetting the peak between them."""
+
+    def __init__(self):
+        self.stages = {}
+        self.current = None
+        self.start = None
+
+    def enter(self, name):
+        self.close()
+        self.current = name
+        tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+
+    def close(self):
+        if self.current is not None:
+            seconds = time.perf_counter() - self.start
+            self.stages[self.current] = {"seconds": round(seconds, 6), "peak_bytes": tracemalloc.get_traced_memory()[1]}
+            self.current = None
+
+def prepare_case(size, resolution, workers, directory):
+    """Prepare the scenario of a synthetic raster of size x size pixels, timing every stage."""
+    paths = write_rasters(directory, size)
+    paths["json"] = os.path.join(directory, f"map_{size}.json")
+    recorder = StageRecorder()
+
+    def progress(stage, percent):
+        if stage != recorder.current:
+            recorder.enter(stage)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    timer = prepare_scenario(paths, region_polygon(size), seeding_polygons(size), None, resolution,
+                             progress=progress, workers=workers)
+    recorder.close()
+    for name, counts in timer.counts.items():
+        recorder.stages[name].update(counts)
+    total = time.perf_counter() - start
+    tracemalloc.stop()
+    return {
+        "name": f"prepare-{size * size}",
+        "kind": "prepare",
+        "pixels": size * size,
+        "resolution": resolution,
+        "workers": workers,
+        "output_bytes": os.path.getsize(paths["json"]),
+        "seconds": round(total, 6),
+        "stages": recorder.stages,
+        "max_rss_bytes": peak_rss(),
+    }
+
+def results_case(lines, directory):
+    """Load a synthetic log of about `lines` rows the way the plugin shows results, timing every stage."""
+    log_path = os.path.join(directory, f"log_{lines}.csv")
+    write_log(log_path, lines)
+    recorder = StageRecorder()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    recorder.enter("parse")
+    columns = read_log(log_path, True)
+    recorder.enter("store")
+    build_store(log_path)
+    recorder.enter("timeline")
+    timeline = CellTimeline.from_store(open_store(log_path))
+    recorder.enter("frames")
+    for time_step in timeline.times[::max(1, len(timeline.times) // FRAMES)]:
+        timeline.state_at(time_step)
+    recorder.close()
+    total = time.perf_counter() - start
+    tracemalloc.stop()
+    return {
+        "name": f"results-{lines}",
+        "kind": "results",
+        "log_rows": row_count(columns),
+        "cells": len(timeline),
+        "changes": timeline.change_count(),
+        "log_bytes": os.path.getsize(log_path),
+        "seconds": round(total, 6),
+        "stages": recorder.stages,
+        "max_rss_bytes": peak_rss(),
+    }
+
+def run_isolated(function, *args):
+    """Run a case in a new process, so that its peak RSS is its own."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+#########################
+# REPORT
+#########################
+
+def environment():
+    """Return what a report was measured on: commit, interpreter, libraries and machine."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "rasterio": rasterio.__version__,
+        "gdal": rasterio.__gdal_version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def compare(base, report, threshold):
+    """Print the stage times of a report against a base report; return the stages slower than threshold times."""
+    base_cases = {case["name"]: case for case in base["cases"]}
+    print(f"Against {base['environment'].get('commit') or 'base'}:")
+    print(f"{'case':>20} {'stage':>10} {'base [s]':>10} {'now [s]':>10} {'ratio':>8}")
+    regressions = []
+    for case in report["cases"]:
+        base_case = base_cases.get(case["name"])
+        if base_case is None:
+            continue
+        for stage, measure in case["stages"].items():
+            base_measure = base_case["stages"].get(stage)
+            if base_measure is None:
+                continue
+            ratio = measure["seconds"] / max(base_measure["seconds"], 1e-9)
+            slower = ratio > threshold and measure["seconds"] >= NOISE_SECONDS
+            if slower:
+                regressions.append((case["name"], stage))
+            print(f"{case['name']:>20} {stage:>10} {base_measure['seconds']:>10.3f} {measure['seconds']:>10.3f} "
+                  f"{ratio:>7.2f}x{' slower' if slower else ''}")
+    return regressions
+
+def print_case(case):
+    stages = ", ".join(
+        f"{name}: {measure['seconds']:.3f} s / {measure['peak_bytes'] / 2**20:.1f} MB"
+        for name, measure in case["stages"].items()
+    )
+    rss = f", peak RSS {case['max_rss_bytes'] / 2**20:.0f} MB" if case["max_rss_bytes"] else ""
+    print(f"{case['name']}: {case['seconds']:.3f} s ({stages}){rss}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pixels", nargs="*", type=float, default=[1e4, 1e6], help="raster sizes, up to about 1e8")
+    parser.add_argument("--lines", nargs="*", type=float, default=[1e5, 1e6], help="log sizes")
+    parser.add_argument("--resolution", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1, help="processes generating the scenario (see tiles)")
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--compare", metavar="BASE", help="report to compare the stage times with")
+    parser.add_argument("--threshold", type=float, default=1.2, help="ratio over which a stage counts as slower")
+    args = parser.parse_args()
+
+    report = {"format": REPORT_FORMAT, "version": REPORT_VERSION, "environment": environment(), "cases": []}
+    with tempfile.TemporaryDirectory() as directory:
+        for pixels in args.pixels:
+            size = int(round(math.sqrt(pixels)))
+            report["cases"].append(run_isolated(prepare_case, size, args.resolution, args.workers, directory))
+            print_case(report["cases"][-1])
+        for lines in args.lines:
+            report["cases"].append(run_isolated(results_case, int(lines), directory))
+            print_case(report["cases"][-1])
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            base = json.load(f)
+        if base.get("format") != REPORT_FORMAT:
+            sys.exit(f"{args.compare} is not a benchmark report")
+        if compare(base, report, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from .plugin import PPSPlugin
-
 def classFactory(iface):
+    # Imported here so the scenario modules can be used without loading QGIS
+    from .plugin import PPSPlugin
     return PPSPlugin(iface)
@@ -0,0 +1,76 @@
+"""
+Out-of-core scenario generation for regions whose rasters do not fit in memory.
+
+The rasters of the region are never held whole: the sampled grid is split into blocks of rows sized
+so that the arrays and cells of a block fit in a memory budget. Every block reads the rows of its
+cells and of their one-row halo from the source rasters (DTM, landcover, soil and seedings, see
+rasters), builds their cells and writes their scenario entries, like the tiles of
+tiles.write_tiled_scenario, so the output is the same as the one of the whole rasters.
+"""
+import os
+
+import rasterio
+
+from .rasters import align_region, read_region, region_grid, seed_region
+from .scenario import HEX_ROW_SPACING, sampled_shape
+from .tiles import HALO, halo_tiles, tile_band, write_fragments, write_tile
+
+# Bytes used per array element of a block: the rasters read (DTM, landcover, sand and clay means,
+# species, region and soil type) and the cells built on them (coordinates, layers, neighbour links)
+BLOCK_BYTES_PER_ELEMENT = 256
+
+# Share of the budget of a block given to the GDAL raster block cache
+GDAL_CACHE_SHARE = 0.25
+
+def block_rows(width, stride, memory_budget, layout="square"):
+    """
+    Return the sampled rows of the blocks of a grid `width` array elements wide, so that the array
+    rows of a block and of its halo fit in memory_budget bytes (at least one row).
+    """
+    array_rows = stride * HEX_ROW_SPACING if layout == "hex" else stride
+    rows = int(memory_budget / (BLOCK_BYTES_PER_ELEMENT * width * array_rows))
+    return max(rows - 2 * HALO, 1)
+
+def write_block(task):
+    """
+    Read the rows of one block and of its halo from the source rasters, and write the scenario
+    entries of its cells to a fragment file (see tiles.write_tile). Returns the number of cells and
+    neighbour links written.
+    """
+    (paths, region, seedings, geometry_crs, read_step, elevation_resampling, band, transform, resolution, stride,
+     first_row, start, stop, indent, default, layout, cache_bytes, path) = task
+    with rasterio.Env(GDAL_CACHEMAX=cache_bytes):
+        rasters = read_region(paths["dtm"], region, geometry_crs, read_step, elevation_resampling, band)
+        align_region(rasters, paths["land"], paths.get("sand"), paths.get("clay"))
+        seed_region(rasters, seedings, geometry_crs)
+    arrays = (rasters.dtm, rasters.landcover, rasters.initial_species)
+    layers = {"soil_type": rasters.soil_type} if rasters.soil_type is not None else {}
+    return write_tile((arrays, layers, transform, resolution, stride, first_row, start, stop, indent, default, layout,
+                       path))
+
+def write_block_scenario(paths, region, seedings, geometry_crs, resolution, file_path, memory_budget, read_step=None,
+                         elevation_resampling="mean", workers=1, indent=None, default=None, progress=None,
+                         layout="square"):
+    """
+    Write the scenario of the selected region (see pipeline.prepare_scenario for paths, region,
+    seedings and geometry_crs) to a JSON file block by block, the rasters being read at read_step
+    DTM pixels per element (resolution by default). At most `workers` processes (see
+    tiles.write_fragments) each hold one block of memory_budget / workers bytes. Returns the number
+    of cells, neighbour links and blocks written.
+    """
+    read_step = resolution if read_step is None else read_step
+    stride = round(resolution / read_step)
+    shape, transform = region_grid(paths["dtm"], region, geometry_crs, read_step)
+    rows = sampled_shape(shape, stride, layout)[0]
+
+    budget = memory_budget / (workers or os.cpu_count() or 1)
+    tile_rows = block_rows(shape[1], stride, budget * (1 - GDAL_CACHE_SHARE), layout)
+    cache_bytes = max(int(budget * GDAL_CACHE_SHARE), 2**20)
+
+    tasks = []
+    for (first_row, end_row), (start, stop) in halo_tiles(rows, tile_rows):
+        band = tile_band(first_row, end_row, rows, shape[0], stride, layout)
+        tasks.append((paths, region, seedings, geometry_crs, read_step, elevation_resampling, band, transform,
+                      resolution, stride, first_row, start, stop, indent, default, layout, cache_bytes))
+    cells, links = write_fragments(file_path, write_block, tasks, workers, indent, default, progress)
+    return cells, links, len(tasks)
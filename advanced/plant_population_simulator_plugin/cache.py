@@ -0,0 +1,158 @@
+"""
+Content-addressed disk cache for the stages of a scenario preparation.
+
+An entry is a directory named after the hash of everything its content depends on (source raster
+identities, polygons, CRS, resolution, the key of the stage it was derived from). Entries are
+written to a temporary directory and renamed into place, so a reader never sees a partial entry.
+When the cache grows over max_bytes, the least recently used entries are removed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy
+
+# Default size bound of a cache directory
+DEFAULT_MAX_BYTES = 2 * 2**30
+
+# Bumped whenever a cached stage changes what it produces
+CACHE_VERSION = 5
+
+# Arrays of AlignedRasters saved in an entry (missing ones are None)
+RASTER_LAYERS = ("dtm", "landcover", "initial_species", "region", "soil_type")
+
+# File touched whenever an entry is used, its modification time orders the entries for eviction
+LAST_USED = "last_used"
+
+def source_identity(path):
+    """Identity of a source file: its absolute path, size and modification time."""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+class DiskCache:
+    """Directory of cache entries bounded to max_bytes, evicted least recently used first."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """Return the key of an entry depending on JSON-serializable parts."""
+        text = json.dumps([CACHE_VERSION] + list(parts), sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return the directory of an entry (marking it as used), or None when it is not cached."""
+        path = self.entry_path(key)
+        if not os.path.isdir(path):
+            return None
+        with open(os.path.join(path, LAST_USED), "w"):
+            pass
+        return path
+
+    def put(self, key, write):
+        """Create an entry by calling write(directory) on a temporary directory, and return its directory."""
+        temporary = tempfile.mkdtemp(prefix=".partial-", dir=self.directory)
+        try:
+            write(temporary)
+            with open(os.path.join(temporary, LAST_USED), "w"):
+                pass
+            os.replace(temporary, self.entry_path(key))
+        except OSError:
+            # Another preparation stored the same entry first
+            shutil.rmtree(temporary, ignore_errors=True)
+            if not os.path.isdir(self.entry_path(key)):
+                raise
+        except BaseException:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+        return self.entry_path(key)
+
+    def entries(self):
+        """Return (last use, size in bytes, key) of every entry."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self.entry_path(name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            marker = os.path.join(path, LAST_USED)
+            last_used = os.path.getmtime(marker) if os.path.exists(marker) else 0
+            entries.append((last_used, size, name))
+        return entries
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self.entry_path(name), ignore_errors=True)
+            total -= size
+
+#########################
+# STAGE ENTRIES
+#########################
+
+def save_rasters(rasters, directory):
+    """Write the arrays and georeferencing of AlignedRasters into a cache entry directory."""
+    arrays = {name: getattr(rasters, name) for name in RASTER_LAYERS}
+    numpy.savez(os.path.join(directory, "rasters.npz"), **{name: a for name, a in arrays.items() if a is not None})
+    meta = {"transform": list(rasters.transform)[:6], "crs": rasters.crs.to_wkt(), "step": rasters.step}
+    with open(os.path.join(directory, "rasters.json"), "w") as f:
+        json.dump(meta, f)
+
+def load_rasters(directory):
+    """Read AlignedRasters saved by save_rasters."""
+    from affine import Affine
+    from rasterio.crs import CRS
+
+    from .rasters import AlignedRasters
+
+    with open(os.path.join(directory, "rasters.json"), "r") as f:
+        meta = json.load(f)
+    with numpy.load(os.path.join(directory, "rasters.npz")) as arrays:
+        layers = {name: arrays[name] if name in arrays.files else None for name in RASTER_LAYERS}
+    return AlignedRasters(layers["dtm"], layers["landcover"], layers["initial_species"], layers["region"],
+                          Affine(*meta["transform"]), CRS.from_wkt(meta["crs"]), meta["step"], layers["soil_type"])
+
+def save_base(directory, scenario_path, seedings, initial_species, cell_rows, cell_cols, tree_type, offsets):
+    """
+    Write the base of the incremental scenario updates of a cell topology into a cache entry
+    directory: the scenario file, the seedings and initial species layer it was built from, and the
+    sampled element, tree_type and tree_type byte offset (see scenario.tree_type_offsets) of every cell.
+    """
+    shutil.copyfile(scenario_path, os.path.join(directory, "scenario.json"))
+    with open(os.path.join(directory, "seedings.json"), "w") as f:
+        json.dump(seedings, f)
+    numpy.savez(os.path.join(directory, "cells.npz"), initial_species=initial_species, rows=cell_rows, cols=cell_cols,
+                tree_type=tree_type, offsets=offsets)
+
+def load_base(directory):
+    """Read a base saved by save_base as (seedings, initial species, rows, cols, tree_type, offsets)."""
+    with open(os.path.join(directory, "seedings.json"), "r") as f:
+        seedings = json.load(f)
+    with numpy.load(os.path.join(directory, "cells.npz")) as arrays:
+        return (seedings,) + tuple(arrays[name] for name in ("initial_species", "rows", "cols", "tree_type", "offsets"))
+
+def save_files(files, directory):
+    """Copy files (entry name -> path) into a cache entry directory."""
+    for name, path in files.items():
+        shutil.copyfile(path, os.path.join(directory, name))
+
+def restore_file(directory, name, path):
+    """Copy a cached file to path, replacing it only once the copy is complete."""
+    partial_path = path + ".partial"
+    shutil.copyfile(os.path.join(directory, name), partial_path)
+    os.replace(partial_path, path)
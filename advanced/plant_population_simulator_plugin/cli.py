@@ -0,0 +1,241 @@
+"""
+Command line interface of the scenario preparation, simulation and results pipeline, without QGIS.
+
+    python -m plant_population_simulator_plugin prepare --dtm DTM --landcover LAND --region REGION.geojson
+        [--seed SPECIES AREAS.geojson ...] [--crs CRS] [--resolution 50] [--layout square|hex] [--workers N]
+        [--memory-budget MB] [--cache DIR] OUTPUT.json
+    python -m plant_population_simulator_plugin run SCENARIO.json [--sim-time 200] [--executable SIMULATOR]
+    python -m plant_population_simulator_plugin summary LOG.csv
+    python -m plant_population_simulator_plugin export LOG.csv --dtm DTM [--resolution 50] [--layout square|hex]
+        [--format gtiff|netcdf|frames] [--every N] DIRECTORY
+    python -m plant_population_simulator_plugin levels LOG.csv [--every N] [--threshold T]
+    python -m plant_population_simulator_plugin compact SCENARIO.json OUTPUT.npz
+    python -m plant_population_simulator_plugin expand SCENARIO.npz OUTPUT.json [--indent N]
+
+Nothing depends on QGIS, and each command only imports the modules it needs (rasterio and GDAL
+only for prepare), so batch jobs start fast.
+"""
+import argparse
+import json
+import os
+import sys
+
+# Simulator shipped with the plugin, used unless --executable is given
+DEFAULT_EXECUTABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plant_population.exe")
+
+#########################
+# GEOJSON INPUT
+#########################
+
+def read_geometries(path):
+    """Return the geometries of a GeoJSON file (a geometry, a feature or a feature collection)."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    if data.get("type") == "FeatureCollection":
+        return [feature["geometry"] for feature in data["features"] if feature.get("geometry")]
+    if data.get("type") == "Feature":
+        return [data["geometry"]] if data.get("geometry") else []
+    return [data]
+
+def read_region(path):
+    """Return the polygons of a GeoJSON file as the single (multi)polygon of a simulation region."""
+    geometries = read_geometries(path)
+    if len(geometries) == 1:
+        return geometries[0]
+    polygons = []
+    for geometry in geometries:
+        if geometry["type"] == "Polygon":
+            polygons.append(geometry["coordinates"])
+        elif geometry["type"] == "MultiPolygon":
+            polygons.extend(geometry["coordinates"])
+        else:
+            raise ValueError(f"{path} holds a {geometry['type']}, the region must be made of polygons")
+    if not polygons:
+        raise ValueError(f"{path} holds no polygon")
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+#########################
+# COMMANDS
+#########################
+
+def prepare(args):
+    from .cache import DiskCache
+    from .pipeline import prepare_scenario, report_path_for
+    from .scenario import SEEDABLE_SPECIES, TREE_SPECIES
+
+    seedings = []
+    for species, path in args.seed or []:
+        if species not in SEEDABLE_SPECIES:
+            raise SystemExit(f"Unknown tree species {species}")
+        seedings += [(geometry, TREE_SPECIES[species]) for geometry in read_geometries(path)]
+    paths = {"dtm": args.dtm, "land": args.landcover, "json": args.output, "report": report_path_for(args.output)}
+    if args.clay:
+        paths["clay"] = args.clay
+    if args.sand:
+        paths["sand"] = args.sand
+    if args.compact:
+        paths["compact"] = args.compact
+    if args.profile:
+        paths["profile"] = args.profile
+
+    reported = set()
+
+    def progress(stage, percent):
+        # One line every 10%
+        step = (stage, int(percent // 10))
+        if not args.quiet and step not in reported:
+            reported.add(step)
+            print(f"{stage}: {percent:.0f}%", file=sys.stderr)
+
+    try:
+        timer = prepare_scenario(
+            paths, read_region(args.region), seedings, args.crs, args.resolution, args.resampling,
+            progress=progress, cache=DiskCache(args.cache) if args.cache else None, workers=args.workers,
+            warm_start=args.warm_start, layout=args.layout,
+            memory_budget=args.memory_budget * 2**20 if args.memory_budget else None
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"Scenario saved to {args.output} ({timer.summary()})")
+    for line in timer.details():
+        print(line)
+    return 0
+
+def run(args):
+    from .runner import SimulationRun
+    from .store import build_store
+
+    work_dir = args.work_dir or os.path.dirname(os.path.abspath(args.scenario))
+    simulation = SimulationRun(args.executable, args.scenario, args.sim_time, work_dir).start()
+    try:
+        returncode = simulation.process.wait()
+    except KeyboardInterrupt:
+        simulation.stop()
+        raise
+    if returncode != 0:
+        print(f"Simulation ended with exit code {returncode}, see {simulation.output_path}", file=sys.stderr)
+        return returncode
+    build_store(simulation.log_path)
+    print(f"Simulation finished, results logged to {simulation.log_path}")
+    return 0
+
+def summary(args):
+    from .sweep import summarize_log
+
+    print(json.dumps(summarize_log(args.log), indent=4))
+    return 0
+
+def export(args):
+    from .export import export_results
+    from .store import open_store
+
+    paths = export_results(open_store(args.log), args.dtm, args.resolution, args.output, args.layout, args.format,
+                           every=args.every)
+    print(f"{len(paths)} rasters exported to {args.output}")
+    return 0
+
+def levels(args):
+    from .levels import LEVEL_FACTORS, open_levels
+    from .store import open_store
+
+    stores = open_levels(open_store(args.log), every=args.every, threshold=args.threshold)
+    for factor, store in zip(LEVEL_FACTORS, stores):
+        print(f"{factor}x{factor} cells: {len(store)} rows, {len(store.cells)} blocks, {len(store.times)} times")
+    return 0
+
+def compact(args):
+    from .compact import json_to_compact
+
+    try:
+        json_to_compact(args.scenario, args.output)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"Compact scenario written to {args.output} ({os.path.getsize(args.output)} bytes, "
+          f"{os.path.getsize(args.scenario)} as JSON)")
+    return 0
+
+def expand(args):
+    from .compact import compact_to_json
+
+    try:
+        compact_to_json(args.scenario, args.output, args.indent)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"Scenario written to {args.output}")
+    return 0
+
+def build_parser():
+    from .export import EXPORT_FORMATS
+    from .scenario import ELEVATION_RESAMPLING, LAYOUTS, SEEDABLE_SPECIES
+
+    parser = argparse.ArgumentParser(prog="plant_population_simulator_plugin", description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("prepare", help="build the scenario of a region from the DTM and landcover rasters")
+    command.add_argument("output", help="scenario JSON file to write (its run report is written next to it)")
+    command.add_argument("--dtm", required=True, help="elevation raster")
+    command.add_argument("--landcover", required=True, help="landcover classification raster")
+    command.add_argument("--region", required=True, help="GeoJSON polygons of the simulated region")
+    command.add_argument("--sand", help="sand percentage raster, refining the soil types (needs --clay)")
+    command.add_argument("--clay", help="clay percentage raster the soil types are classified from")
+    command.add_argument("--seed", nargs=2, action="append", metavar=("SPECIES", "GEOJSON"),
+                         help=f"initial tree areas of a species ({', '.join(SEEDABLE_SPECIES)}), repeatable")
+    command.add_argument("--crs", help="CRS of the GeoJSON coordinates (default: the one of the DTM)")
+    command.add_argument("--resolution", type=int, default=50, help="DTM pixels per cell side")
+    command.add_argument("--layout", choices=LAYOUTS, default="square", help="square or hexagonal cells")
+    command.add_argument("--resampling", choices=ELEVATION_RESAMPLING, default="mean", help="elevation resampling")
+    command.add_argument("--workers", type=int, default=1, help="processes generating the scenario (0: one per core)")
+    command.add_argument("--memory-budget", type=int, help="MB of rasters and cells held at a time (read block by block)")
+    command.add_argument("--warm-start", action="store_true", help="start the cells with settled resources")
+    command.add_argument("--cache", help="directory caching the preparation stages")
+    command.add_argument("--compact", help="also write the compact scenario to this file")
+    command.add_argument("--profile", help="save a cProfile of the preparation to this file")
+    command.add_argument("--quiet", action="store_true", help="do not print the progress")
+    command.set_defaults(function=prepare)
+
+    command = commands.add_parser("run", help="simulate a scenario and convert its log for loading")
+    command.add_argument("scenario", help="scenario JSON file")
+    command.add_argument("--sim-time", type=int, default=200, help="simulated time")
+    command.add_argument("--executable", default=DEFAULT_EXECUTABLE, help="Cadmium simulator")
+    command.add_argument("--work-dir", help="directory of the log_files output (default: the scenario's)")
+    command.set_defaults(function=run)
+
+    command = commands.add_parser("summary", help="print the final population of a simulation log as JSON")
+    command.add_argument("log", help="Cadmium CSV log")
+    command.set_defaults(function=summary)
+
+    command = commands.add_parser("export", help="write the grid states of a simulation log as raster time series")
+    command.add_argument("log", help="Cadmium CSV log")
+    command.add_argument("output", help="directory of the rasters")
+    command.add_argument("--dtm", required=True, help="elevation raster the scenario was prepared from")
+    command.add_argument("--resolution", type=int, default=50, help="DTM pixels per cell side of the scenario")
+    command.add_argument("--layout", choices=LAYOUTS, default="square", help="cell layout of the scenario")
+    command.add_argument("--format", choices=EXPORT_FORMATS, default="gtiff",
+                         help="gtiff or netcdf: a stack per field (a band per time), frames: a GeoTIFF per time")
+    command.add_argument("--every", type=int, default=1, help="export every N-th logged time (and the last one)")
+    command.set_defaults(function=export)
+
+    command = commands.add_parser("levels", help="reduce a simulation log into the levels of detail shown by the plugin")
+    command.add_argument("log", help="Cadmium CSV log")
+    command.add_argument("--every", type=int, default=1, help="keep every N-th logged time (and the last one)")
+    command.add_argument("--threshold", type=int, default=0,
+                         help="drop the height and resource changes that stay within the same multiple of T")
+    command.set_defaults(function=levels)
+
+    command = commands.add_parser("compact", help="convert a scenario JSON file of square cells into a compact scenario")
+    command.add_argument("scenario", help="scenario JSON file")
+    command.add_argument("output", help="compact scenario (.npz) to write")
+    command.set_defaults(function=compact)
+
+    command = commands.add_parser("expand", help="expand a compact scenario into the scenario JSON the simulator reads")
+    command.add_argument("scenario", help="compact scenario (.npz)")
+    command.add_argument("output", help="scenario JSON file to write")
+    command.add_argument("--indent", type=int, help="indent the JSON by this many spaces")
+    command.set_defaults(function=expand)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args, "workers", None) == 0:
+        args.workers = None
+    return args.function(args)
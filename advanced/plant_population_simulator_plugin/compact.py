@@ -0,0 +1,82 @@
+"""
+Compact scenario format.
+
+A compact scenario is a NumPy .npz archive holding a JSON header (grid origin, pixel size,
+sampling step, width, height, neighbour distance, default cell and neighbourhood rule), the mask
+of valid cells and one dense array per overridden state field (e.g. elevation, tree_type) over the
+sampled grid. Neighbour links are not stored: every valid cell is linked to its valid von Neumann
+(or hexagonal) neighbours, exactly as in the scenarios written by scenario.write_scenario.
+"""
+import json
+
+import numpy
+from affine import Affine
+
+from .scenario import STATE_FIELDS, default_cell, grid_from_mask, read_scenario, write_scenario
+
+COMPACT_FORMAT = "plant_population_compact"
+COMPACT_VERSION = 1
+
+# Neighbourhood rule of the header for every cell layout
+NEIGHBORHOOD_RULES = {
+    "square": {"type": "von_neumann", "range": 1},
+    "hex": {"type": "hexagonal", "range": 1},
+}
+
+def write_compact(grid, file_path, default=None):
+    """Write a cell grid to a compact scenario file."""
+    transform = grid.transform
+    if transform.b != 0 or transform.d != 0:
+        raise ValueError("The compact scenario format only supports north-up grids")
+
+    header = {
+        "format": COMPACT_FORMAT,
+        "version": COMPACT_VERSION,
+        "origin": [transform.c, transform.f],
+        "pixel_size": [transform.a, transform.e],
+        "step": grid.step,
+        "width": grid.shape[1],
+        "height": grid.shape[0],
+        "distance": grid.resolution,
+        "neighborhood": NEIGHBORHOOD_RULES[grid.layout],
+        "default": default or default_cell(),
+    }
+
+    arrays = {"valid": grid.valid}
+    for field, values in grid.layers.items():
+        dense = numpy.zeros(grid.shape, dtype=numpy.int32)
+        dense[grid.rows, grid.cols] = values
+        arrays[field] = dense
+
+    with open(file_path, "wb") as f:
+        numpy.savez_compressed(f, header=numpy.array(json.dumps(header)), **arrays)
+
+def read_compact(file_path):
+    """Read a compact scenario file back into a cell grid and its default cell."""
+    with numpy.load(file_path) as archive:
+        header = json.loads(str(archive["header"]))
+        if header.get("format") != COMPACT_FORMAT or header.get("version") != COMPACT_VERSION:
+            raise ValueError(f"{file_path} is not a version {COMPACT_VERSION} compact scenario")
+        layouts = [layout for layout, rule in NEIGHBORHOOD_RULES.items() if rule == header["neighborhood"]]
+        if not layouts:
+            raise ValueError(f"Unsupported neighbourhood {header['neighborhood']} in {file_path}")
+
+        valid = archive["valid"]
+        layers = {field: archive[field].astype(numpy.int64) for field in STATE_FIELDS if field in archive.files}
+
+    if valid.shape != (header["height"], header["width"]):
+        raise ValueError(f"The cell mask of {file_path} does not match its header")
+
+    transform = Affine(header["pixel_size"][0], 0, header["origin"][0], 0, header["pixel_size"][1], header["origin"][1])
+    grid = grid_from_mask(valid, layers, transform, header["step"], header["distance"], layout=layouts[0])
+    return grid, header["default"]
+
+def json_to_compact(json_path, compact_path):
+    """Convert a scenario JSON file into the compact scenario format."""
+    grid, default = read_scenario(json_path)
+    write_compact(grid, compact_path, default)
+
+def compact_to_json(compact_path, json_path, indent=None):
+    """Expand a compact scenario file into the scenario JSON read by Cadmium and the viewers."""
+    grid, default = read_compact(compact_path)
+    write_scenario(grid, json_path, indent, default)
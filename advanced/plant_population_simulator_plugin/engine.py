@@ -0,0 +1,345 @@
+"""
+NumPy reference engine of the plantPopulation cell rule (main/include/plantPopulationCell.hpp) of
+the advanced and basic models (see MODELS).
+
+Every cell applies the rule at every step to the states of the previous step, as whole-array
+operations over the cells of a CellGrid, so a scenario is previewed without the simulator.
+The resources are uint32 in the model and are kept modulo 2**32 here, like the C++ arithmetic.
+"""
+import numpy
+
+from .scenario import (STATE_FIELDS, RESOURCE_FIELDS, SOIL_TYPES, TREE_SPECIES, read_grid_scenario, read_scenario,
+                       state_fields)
+
+#########################
+# SPECIES
+#########################
+
+# treeSpecies and soilType values
+NONE, LOCUST, PINE, OAK, WATER = (TREE_SPECIES[name] for name in ("None", "Locust", "Pine", "Oak", "Water"))
+DRY, CLAY, WATER_SOIL = (SOIL_TYPES[name] for name in ("Dry", "Clay", "Water"))
+
+def species_table(*rows):
+    return numpy.array(rows, dtype=numpy.int64)
+
+# speciesInfoMap (main/include/plantSpeciesInfo.hpp) of the advanced and basic models, indexed by
+# species, with the resources in RESOURCE_FIELDS order, and the elevation the seeds are spread by:
+# "absolute" from the lowest neighbour, "difference" from the neighbour closest in elevation
+MODELS = {
+    "advanced": {
+        "max_resources": species_table(*[(30, 30, 15, 15)] * 4, (30, 0, 0, 0)),
+        "produced_resources": species_table(*[(5, 5, 3, 2)] * 4, (10, 0, 0, 0)),
+        "req_to_survive": species_table(*[(3, 3, 2, 1)] * 4, (0, 0, 0, 0)),
+        "req_to_grow": species_table(*[(8, 7, 4, 3)] * 4, (0, 0, 0, 0)),
+        "seed_elevation": "absolute",
+    },
+    "basic": {
+        "max_resources": species_table(*[(30, 30, 15, 15)] * 4, (30, 0, 0, 0)),
+        "produced_resources": species_table((8, 8, 8, 8), (6, 6, 6, 6), (5, 5, 5, 5), (4, 4, 4, 4), (10, 0, 0, 0)),
+        "req_to_survive": species_table((0, 0, 0, 0), (2, 2, 1, 1), (2, 2, 2, 2), (3, 3, 2, 2), (0, 0, 0, 0)),
+        "req_to_grow": species_table((0, 0, 0, 0), (8, 8, 7, 7), (7, 7, 7, 7), (9, 9, 8, 8), (0, 0, 0, 0)),
+        "seed_elevation": "difference",
+    },
+}
+
+# growable_soil of every species, indexed by [species, soil type]
+GROWABLE_SOIL = numpy.array([
+    (True, True, False),    # None
+    (True, False, False),   # Locust
+    (True, True, False),    # Pine
+    (False, True, False),   # Oak
+    (False, False, False),  # Water
+])
+
+# Height from which a species spreads its seeds, and the height it stops growing at
+SPREAD_HEIGHT = numpy.array([0, 8, 12, 20, 0], dtype=numpy.int64)
+MAX_HEIGHT = numpy.array([0, 40, 55, 70, 0], dtype=numpy.int64)
+
+UINT32 = 2**32
+
+#########################
+# NEIGHBOURHOOD ORDER
+#########################
+
+# The simulator visits the neighbours of a cell in the order of the std::unordered_map of its
+# neighbourhood, which matters as resources wrap around in uint32. The maps are small (at most
+# MAP_BUCKETS keys), so libstdc++ keeps them in MAP_BUCKETS buckets and never rehashes them.
+MAP_BUCKETS = 13
+
+# libstdc++ std::hash<std::string> (std::_Hash_bytes, 64-bit) constants
+HASH_MUL = (0xc6a4a793 << 32) + 0x5bd1e995
+HASH_SEED = 0xc70f6907
+
+# von Neumann offsets of the grid cells of the basic model, in the order Cadmium generates them
+# (first coordinate fastest); the neighbourhood of a grid cell includes the cell itself
+GRID_OFFSETS = numpy.array([(0, -1), (-1, 0), (0, 0), (1, 0), (0, 1)], dtype=numpy.int64)
+
+def shift_mix(values):
+    return values ^ (values >> numpy.uint64(47))
+
+def string_hashes(names):
+    """Return the libstdc++ std::hash of every string of names (the ids of the asymmetric cells)."""
+    encoded = numpy.array([name.encode() for name in names], dtype=bytes)
+    lengths = numpy.char.str_len(encoded) if len(encoded) else numpy.zeros(0, dtype=numpy.int64)
+    hashes = numpy.zeros(len(encoded), dtype=numpy.uint64)
+    for length in numpy.unique(lengths).tolist():
+        rows = numpy.flatnonzero(lengths == length)
+        # Little-endian 8-byte words, the last one padded with zeros as it is loaded byte by byte
+        data = numpy.zeros((len(rows), -(-length // 8) * 8), dtype=numpy.uint8)
+        data[:, :length] = encoded[rows].view(numpy.uint8).reshape(len(rows), -1)[:, :length]
+        words = data.view("<u8")
+        mul = numpy.uint64(HASH_MUL)
+        value = numpy.full(len(rows), (HASH_SEED ^ length * HASH_MUL) % 2**64, dtype=numpy.uint64)
+        for i in range(length // 8):
+            value = (value ^ (shift_mix(words[:, i] * mul) * mul)) * mul
+        if length % 8:
+            value = (value ^ words[:, -1]) * mul
+        hashes[rows] = shift_mix(shift_mix(value) * mul)
+    return hashes
+
+def coordinates_hashes(coordinates):
+    """Return the Cadmium hash of the (cells, dimensions) coordinates of grid cells (boost::hash_combine)."""
+    coordinates = numpy.asarray(coordinates, dtype=numpy.int64)
+    seed = numpy.full(len(coordinates), coordinates.shape[1], dtype=numpy.uint64)
+    for value in coordinates.T:
+        # The coordinate is added to the constant as a 32-bit unsigned int
+        combined = ((value + 0x9e3779b9) & 0xffffffff).astype(numpy.uint64)
+        seed ^= combined + (seed << numpy.uint64(6)) + (seed >> numpy.uint64(2))
+    return seed
+
+def unordered_order(hashes, present):
+    """
+    Return, for every row of keys inserted in column order into a libstdc++ std::unordered_map, the
+    columns in the order the map iterates over them (absent keys last): a key goes before the keys
+    of its bucket, or at the front of the map when its bucket is empty.
+    """
+    keys = hashes.shape[1]
+    columns = numpy.arange(keys)
+    bucket = numpy.where(present, hashes % numpy.uint64(MAP_BUCKETS), MAP_BUCKETS + columns).astype(numpy.int64)
+    first = numpy.argmax(bucket[:, :, None] == bucket[:, None, :], axis=2)
+    rank = numpy.where(present, first * keys + columns, -1)
+    return numpy.argsort(-rank, axis=1, kind="stable")
+
+def simulator_neighbors(grid, model="advanced"):
+    """
+    Return the neighbour indices of every cell of a grid in the order the simulator of a model of
+    MODELS visits them (-1 when absent, last). Asymmetric cells (advanced model) insert their
+    neighbours sorted by id, as read from the scenario JSON; grid cells (basic model) insert the
+    cells at GRID_OFFSETS, themselves iterated from a map of offsets.
+    """
+    if model == "basic":
+        coordinates = numpy.stack((grid.x, grid.y), axis=1).astype(numpy.int64)
+        index = {cell: i for i, cell in enumerate(map(tuple, coordinates.tolist()))}
+        offsets = GRID_OFFSETS[unordered_order(coordinates_hashes(GRID_OFFSETS)[None], numpy.ones((1, 5), bool))[0]]
+        neighbors = numpy.array([[index.get((x + dx, y + dy), -1) for dx, dy in offsets.tolist()]
+                                 for x, y in coordinates.tolist()], dtype=numpy.int64).reshape(-1, len(offsets))
+        hashes = coordinates_hashes(coordinates)
+    else:
+        names = numpy.array(grid.names() + [""])
+        order = numpy.argsort(names[grid.neighbors], axis=1)
+        neighbors = numpy.take_along_axis(grid.neighbors, order, axis=1)
+        hashes = string_hashes(names[:-1].tolist())
+    present = neighbors >= 0
+    order = unordered_order(numpy.where(present, hashes[neighbors], 0), present)
+    return numpy.take_along_axis(neighbors, order, axis=1)
+
+#########################
+# CELL RULE
+#########################
+
+def initial_state(grid, default):
+    """Return the STATE_FIELDS arrays of the cells of a grid, from its layers and default cell."""
+    base = state_fields(default["state"])
+    state = {}
+    for field in STATE_FIELDS:
+        if field in grid.layers:
+            state[field] = numpy.asarray(grid.layers[field], dtype=numpy.int64).copy()
+        else:
+            state[field] = numpy.full(len(grid), base[field], dtype=numpy.int64)
+    return state
+
+def step(state, neighbors, model="advanced"):
+    """
+    Apply the cell rule of a model of MODELS once to every cell and return the new state arrays.
+    neighbors holds the neighbour indices of every cell (-1 when absent), in visiting order.
+    The "species_info" array holds the species whose speciesInfoMap entry a cell last loaded
+    (-1 before its first computation).
+    """
+    rules = MODELS[model]
+    tree_type = state["tree_type"]
+    tree_height = state["tree_height"]
+    soil_type = state["soil_type"]
+    elevation = state["elevation"]
+    previous = numpy.stack([state[field] for field in RESOURCE_FIELDS], axis=1)
+    resources = previous.copy()
+    is_water = tree_type == WATER
+
+    # Diffusion: 0.25 of the difference with the previous state of every neighbour in turn,
+    # water only next to water cells
+    for k in range(neighbors.shape[1]):
+        neighbor = neighbors[:, k]
+        present = neighbor >= 0
+        other = previous[numpy.where(present, neighbor, 0)]
+        difference = (other - resources) % UINT32
+        updated = (resources + difference // 4) % UINT32
+        exchange = numpy.repeat(present[:, None], len(RESOURCE_FIELDS), axis=1)
+        exchange[:, 1:] &= ~(is_water | is_water[numpy.where(present, neighbor, 0)])[:, None]
+        resources = numpy.where(exchange, updated, resources)
+
+    # Seeds: the species of the spreading neighbour with the lowest elevation (or difference),
+    # the stronger species on a tie
+    best_score = numpy.full(len(tree_type), numpy.iinfo(numpy.int64).max)
+    for k in range(neighbors.shape[1]):
+        neighbor = numpy.where(neighbors[:, k] >= 0, neighbors[:, k], 0)
+        species = tree_type[neighbor]
+        spreads = (neighbors[:, k] >= 0) & (species >= LOCUST) & (species <= OAK)
+        spreads &= tree_height[neighbor] >= SPREAD_HEIGHT[species]
+        spreads &= GROWABLE_SOIL[species, soil_type]
+        if rules["seed_elevation"] == "absolute":
+            key = elevation[neighbor]
+        else:
+            key = numpy.abs(elevation[neighbor] - elevation)
+        score = numpy.where(spreads, key * 8 + (OAK - species), best_score)
+        best_score = numpy.minimum(best_score, score)
+    seeded = best_score != numpy.iinfo(numpy.int64).max
+    best_seed = numpy.where(seeded, OAK - best_score % 8, NONE)
+
+    # Production, capped at the species maximum
+    resources = numpy.minimum((resources + rules["produced_resources"][tree_type]) % UINT32,
+                              rules["max_resources"][tree_type])
+
+    new_type = tree_type.copy()
+    new_height = tree_height.copy()
+    empty = tree_type == NONE
+    new_type[empty] = best_seed[empty]
+
+    # Trees die without enough of any resource, else grow up to the species height, else survive
+    tree = ~empty & ~is_water
+    req_to_survive, req_to_grow = rules["req_to_survive"][tree_type], rules["req_to_grow"][tree_type]
+    dies = tree & (resources < req_to_survive).any(axis=1)
+    growing = tree & ~dies & (tree_height < MAX_HEIGHT[tree_type])
+    grows = growing & (resources >= req_to_grow).all(axis=1)
+    survives = tree & ~dies & ~growing
+
+    new_type[dies] = NONE
+    new_height[dies] = 0
+    new_height[grows] += 1
+    resources = numpy.where(grows[:, None], resources - req_to_grow, resources)
+    resources = numpy.where(survives[:, None], resources - req_to_survive, resources)
+
+    new_state = dict(state)
+    new_state.update({field: resources[:, i] for i, field in enumerate(RESOURCE_FIELDS)})
+    new_state["tree_type"] = new_type
+    new_state["tree_height"] = new_height
+    new_state["species_info"] = tree_type.copy()
+    return new_state
+
+def simulate(grid, default, steps, model="advanced", neighbors=None):
+    """
+    Run the cell rule of a model of MODELS for a number of steps from the initial state of a grid.
+    As in the simulator, a cell only applies the rule at a step when one of its neighbours changed
+    at the previous one (every cell sends its initial state). neighbors defaults to
+    simulator_neighbors(grid, model). Returns, for every field of STATE_FIELDS, a (steps + 1, cells)
+    array of the state at every step.
+    """
+    neighbors = simulator_neighbors(grid, model) if neighbors is None else neighbors
+    state = initial_state(grid, default)
+    state["species_info"] = numpy.full(len(grid), -1, dtype=numpy.int64)
+    changed = numpy.ones(len(grid), dtype=bool)
+    padded = numpy.append(changed, False)
+
+    history = {field: numpy.empty((steps + 1, len(grid)), dtype=numpy.int64) for field in STATE_FIELDS}
+    for t in range(steps + 1):
+        if t:
+            padded[:-1] = changed
+            active = padded[neighbors].any(axis=1)
+            computed = step(state, neighbors, model)
+            changed = numpy.zeros(len(grid), dtype=bool)
+            for field, values in computed.items():
+                values = numpy.where(active, values, state[field])
+                changed |= values != state[field]
+                state[field] = values
+        for field in STATE_FIELDS:
+            history[field][t] = state[field]
+    return history
+
+def scenario_model(file_path):
+    """Return the model of MODELS a scenario JSON file is for: "basic" for grid scenarios, else "advanced"."""
+    with open(file_path, "r") as f:
+        return "basic" if '"shape"' in f.read(4096) else "advanced"
+
+def load_scenario(file_path):
+    """Read a scenario JSON file, grid (basic model) or asymmetric (plugin), into a grid and its default cell."""
+    if scenario_model(file_path) == "basic":
+        return read_grid_scenario(file_path)
+    return read_scenario(file_path)
+
+def to_raster(grid, values, fill=0):
+    """Place per-cell values on the sampled grid of a CellGrid, as a 2D array."""
+    raster = numpy.full(grid.shape, fill, dtype=numpy.asarray(values).dtype)
+    raster[grid.rows, grid.cols] = values
+    return raster
+
+#########################
+# WARM START
+#########################
+
+# Fraction of the cells whose resources may still change once they count as settled, and the
+# iteration limit of the warm start
+WARM_TOLERANCE = 0.01
+WARM_ITERATIONS = 200
+
+def warm_resources(grid, default, tolerance=WARM_TOLERANCE, iterations=WARM_ITERATIONS, neighbors=None):
+    """
+    Return the approximate equilibrium of the resources over the initial landscape of a grid: the
+    cell rule is applied to every cell with the species and heights kept as they are (water cells
+    acting as water sources) until the resources of at most `tolerance` of the cells still change, or
+    for `iterations` steps. A few cells can cycle forever as the resources wrap around in uint32.
+    Returns the RESOURCE_FIELDS arrays and the number of iterations run.
+    """
+    neighbors = simulator_neighbors(grid) if neighbors is None else neighbors
+    state = initial_state(grid, default)
+    iteration = 0
+    for iteration in range(1, iterations + 1):
+        computed = step(state, neighbors)
+        changed = numpy.zeros(len(grid), dtype=bool)
+        for field in RESOURCE_FIELDS:
+            changed |= computed[field] != state[field]
+            state[field] = computed[field]
+        if numpy.count_nonzero(changed) <= tolerance * len(grid):
+            break
+    return {field: state[field] for field in RESOURCE_FIELDS}, iteration
+
+#########################
+# LOG COMPARISON
+#########################
+
+def compare_with_log(grid, history, columns):
+    """
+    Compare an engine history with parsed Cadmium log columns (see results.read_log with outputs).
+    The state a cell sends on its output port at time t is the engine state at step t; logs
+    without output rows are compared on their state rows. Returns, for every step of the history
+    covered by the log, the number of cells with a different state in each field of STATE_FIELDS.
+    """
+    from .results import select_rows
+    from .timeline import CellTimeline
+
+    if columns["output"].any():
+        columns = select_rows(columns, columns["output"] == 1)
+    timeline = CellTimeline.from_columns(columns, STATE_FIELDS)
+
+    # Engine index of every cell of the log
+    index = {cell: i for i, cell in enumerate(zip(grid.x.tolist(), grid.y.tolist()))}
+    cells = numpy.array([index.get(cell, -1) for cell in map(tuple, timeline.cells.astype(numpy.int64).tolist())])
+    if (cells < 0).any():
+        raise ValueError("The log has cells that are not in the scenario")
+
+    steps = next(iter(history.values())).shape[0]
+    mismatches = []
+    for t in range(min(steps, int(timeline.times.max()) + 1 if len(timeline.times) else 0)):
+        present, state = timeline.state_at(t)
+        mismatches.append({
+            field: int(numpy.count_nonzero(present & (state[field] != history[field][t][cells])))
+            for field in STATE_FIELDS
+        })
+    return mismatches
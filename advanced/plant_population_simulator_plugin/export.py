@@ -0,0 +1,201 @@
+"""
+Raster time-series export of simulation results.
+
+The state of the grid is rebuilt at every logged time from the rows of the results store (see
+store.ResultsStore), applying the changes of each time step to the last state of every cell, and
+rasterized on the grid of the scenario's cells: one pixel per square cell, aligned to the DTM, and
+two pixels per hexagon (half a cell wide, one row of hexagons high). Pixels of cells not logged yet
+are nodata. The frames are written as tiled, compressed rasters, either one multi-band GeoTIFF per
+frame (a band per field) or one stack per field (a band per frame) in GeoTIFF or NetCDF, so a
+temporal raster layer plays them back at the cost of a raster redraw.
+"""
+import os
+import tempfile
+
+import numpy
+from affine import Affine
+
+from .scenario import HEX_ROW_SPACING
+
+# State fields written to the frames, in band order
+FRAME_FIELDS = ("tree_height", "tree_type", "water", "sunlight", "nitrogen", "potassium")
+
+# Frame values: small integers (heights and resources are capped well below the int16 range, larger
+# values, such as wrapped-around resources, are saturated), -1 where no cell is logged yet
+FRAME_DTYPE = numpy.int16
+FRAME_NODATA = -1
+
+# GDAL driver and file extension of the per-field stacks
+STACK_FORMATS = {"gtiff": ("GTiff", ".tif"), "netcdf": ("netCDF", ".nc")}
+
+# Export formats: a stack per field, or a GeoTIFF per frame
+EXPORT_FORMATS = tuple(STACK_FORMATS) + ("frames",)
+
+# Tiled, compressed GeoTIFF creation options, and the largest tile size (tiles are shrunk to small
+# grids, in multiples of 16 pixels, so the many bands of a stack do not each compress a large tile)
+GTIFF_OPTIONS = {"tiled": True, "compress": "deflate", "predictor": 2}
+GTIFF_TILE_SIZE = 256
+
+# NetCDF-4 classic model, deflated, with the frames along an extra "time" dimension (see write_stacks)
+NETCDF_OPTIONS = {"FORMAT": "NC4C", "COMPRESS": "DEFLATE"}
+NETCDF_DOUBLE = 6
+
+class FrameGrid:
+    """Raster grid of the cells of a result: the pixel row and first column of every cell, and its pixel span."""
+
+    def __init__(self, shape, transform, rows, cols, span):
+        self.shape = shape
+        self.transform = transform
+        self.rows = rows
+        self.cols = cols
+        self.span = span
+
+    def render(self, state):
+        """Rasterize the (fields, cells) state of the cells into a (fields, height, width) frame."""
+        frame = numpy.full((len(state),) + self.shape, FRAME_NODATA, dtype=FRAME_DTYPE)
+        for offset in range(self.span):
+            frame[:, self.rows, self.cols + offset] = state
+        return frame
+
+def frame_grid(cells, dtm_transform, resolution, layout="square"):
+    """
+    Return the FrameGrid of (x, y) cells named after the top-left corner of the DTM pixel they sample
+    (see scenario.grid_from_mask), `resolution` DTM pixels apart.
+    """
+    cells = numpy.asarray(cells, dtype=numpy.float64).reshape(-1, 2)
+    cell_width = abs(dtm_transform.a) * resolution
+    cell_height = abs(dtm_transform.e) * resolution
+    if layout == "hex":
+        pixel_width, pixel_height, span = cell_width / 2, cell_height * HEX_ROW_SPACING, 2
+    else:
+        pixel_width, pixel_height, span = cell_width, cell_height, 1
+
+    # Origin on the DTM pixel lines at the north-west cell, which the truncated names may be just off
+    x, y = cells[:, 0], cells[:, 1]
+    west = dtm_transform.c + round((x.min() - dtm_transform.c) / dtm_transform.a) * dtm_transform.a if len(x) else 0
+    north = dtm_transform.f + round((y.max() - dtm_transform.f) / dtm_transform.e) * dtm_transform.e if len(y) else 0
+    cols = numpy.round((x - west) / pixel_width).astype(numpy.int64)
+    rows = numpy.round((north - y) / pixel_height).astype(numpy.int64)
+
+    shape = (int(rows.max()) + 1, int(cols.max()) + span) if len(cells) else (1, 1)
+    transform = Affine(pixel_width, 0, west, 0, -pixel_height, north)
+    return FrameGrid(shape, transform, rows, cols, span)
+
+def frame_indices(times, every=1):
+    """Return the indices of the rendered times: every `every`-th distinct time, and always the last one."""
+    indices = numpy.arange(0, len(times), max(int(every), 1))
+    if len(times) and indices[-1] != len(times) - 1:
+        indices = numpy.append(indices, len(times) - 1)
+    return indices
+
+def iter_frames(store, grid, fields=FRAME_FIELDS, every=1):
+    """
+    Yield the (time, frame) of the rendered times (see frame_indices) of a results store, rebuilding
+    the state of the cells one time step at a time, so every log row is read once.
+    """
+    state = numpy.full((len(fields), len(grid.rows)), FRAME_NODATA, dtype=FRAME_DTYPE)
+    limit = numpy.iinfo(FRAME_DTYPE).max
+    rendered = set(frame_indices(store.times, every).tolist())
+    for index, time in enumerate(store.times):
+        start, stop = int(store.time_offsets[index]), int(store.time_offsets[index + 1])
+        # The last row of every cell changed at this time
+        reversed_cells = numpy.asarray(store.cell[start:stop])[::-1]
+        changed, last = numpy.unique(reversed_cells, return_index=True)
+        last = stop - start - 1 - last
+        for i, name in enumerate(fields):
+            state[i, changed] = numpy.clip(numpy.asarray(store.columns[name][start:stop])[last], 0, limit)
+        if index in rendered:
+            yield float(time), grid.render(state)
+
+def write_frames(store, grid, directory, crs, fields=FRAME_FIELDS, every=1, progress=None):
+    """
+    Write one tiled, compressed GeoTIFF per rendered time to a directory, with a band per field.
+    progress is called with the fraction of frames written. Returns the paths of the frames.
+    """
+    import rasterio
+
+    os.makedirs(directory, exist_ok=True)
+    profile = frame_profile(grid, crs, len(fields))
+    count = len(frame_indices(store.times, every))
+    paths = []
+    for i, (time, frame) in enumerate(iter_frames(store, grid, fields, every)):
+        path = os.path.join(directory, f"frame_{i:05d}.tif")
+        with rasterio.open(path, "w", **profile) as dst:
+            dst.write(frame)
+            dst.descriptions = tuple(fields)
+            dst.update_tags(time=str(time))
+        paths.append(path)
+        if progress:
+            progress((i + 1) / count)
+    return paths
+
+def write_stacks(store, grid, directory, crs, fields=FRAME_FIELDS, every=1, format="gtiff", progress=None):
+    """
+    Write one raster per field to a directory, named after the field, with a band per rendered time
+    in the given STACK_FORMATS format. The bands are described as "time=<time>"; NetCDF stacks hold
+    each field as a variable along a "time" dimension. progress is called with the fraction of frames
+    written. Returns the paths of the stacks.
+    """
+    import rasterio
+    import rasterio.shutil
+
+    driver, extension = STACK_FORMATS[format]
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, name + extension) for name in fields]
+    times = [float(store.times[i]) for i in frame_indices(store.times, every)]
+    profile = frame_profile(grid, crs, len(times))
+
+    # The stacks are written as GeoTIFFs frame by frame, and converted to NetCDF at the end
+    staging = tempfile.mkdtemp(prefix=".frames-", dir=directory) if driver != "GTiff" else None
+    stacks = [os.path.join(staging, name + ".tif") for name in fields] if staging else paths
+    datasets = [rasterio.open(path, "w", **profile) for path in stacks]
+    try:
+        for band, (time, frame) in enumerate(iter_frames(store, grid, fields, every), 1):
+            for name, dst, values in zip(fields, datasets, frame):
+                dst.write(values, band)
+                dst.set_band_description(band, f"time={time:g}")
+                if staging:
+                    dst.update_tags(band, NETCDF_VARNAME=name, NETCDF_DIM_time=f"{time:g}")
+            if progress:
+                progress(band / len(times))
+        if staging:
+            for dst in datasets:
+                dst.update_tags(NETCDF_DIM_EXTRA="{time}", NETCDF_DIM_time_DEF=f"{{{len(times)},{NETCDF_DOUBLE}}}",
+                                NETCDF_DIM_time_VALUES="{" + ",".join(f"{time:g}" for time in times) + "}")
+    finally:
+        for dst in datasets:
+            dst.close()
+
+    if staging:
+        try:
+            for stack, path in zip(stacks, paths):
+                rasterio.shutil.copy(stack, path, driver=driver, **NETCDF_OPTIONS)
+        finally:
+            for stack in stacks:
+                if os.path.exists(stack):
+                    os.remove(stack)
+            os.rmdir(staging)
+    return paths
+
+def frame_profile(grid, crs, count):
+    profile = {"driver": "GTiff", "width": grid.shape[1], "height": grid.shape[0], "count": count,
+               "dtype": FRAME_DTYPE.__name__, "nodata": FRAME_NODATA, "crs": crs, "transform": grid.transform}
+    profile.update(GTIFF_OPTIONS)
+    profile["blockysize"], profile["blockxsize"] = (min(GTIFF_TILE_SIZE, -(-size // 16) * 16) for size in grid.shape)
+    return profile
+
+def export_results(store, dtm_path, resolution, directory, layout="square", format="gtiff", fields=FRAME_FIELDS,
+                   every=1, progress=None):
+    """
+    Export the frames of a results store on the grid of the scenario cells, prepared at `resolution`
+    pixels of the DTM with the given layout, to a directory: a stack per field (see write_stacks) or,
+    with the "frames" format, a GeoTIFF per frame (see write_frames). Returns the paths written.
+    """
+    import rasterio
+
+    with rasterio.open(dtm_path) as src:
+        dtm_transform, crs = src.transform, src.crs
+    grid = frame_grid(store.cells, dtm_transform, resolution, layout)
+    if format == "frames":
+        return write_frames(store, grid, directory, crs, fields, every, progress)
+    return write_stacks(store, grid, directory, crs, fields, every, format, progress)
@@ -0,0 +1,232 @@
+"""
+Level-of-detail reduction of simulation results.
+
+A log holds every change of every cell, far more than a map shows at a glance. The results store of
+a log (see store) is reduced once into zoom levels, each saved as a results store of its own so it
+is viewed like the full results:
+
+- temporal decimation keeps the state of the cells at every k-th logged time (see decimate_steps)
+  and drops the changes smaller than a threshold (see drop_small_changes);
+- spatial aggregation merges the cells into blocks of factor x factor cells (see aggregate_cells),
+  whose state is the dominant species and soil type and the mean height, resources and elevation
+  of their cells logged so far.
+
+The viewer loads the level whose blocks still cover a few screen pixels at the map scale (see
+level_for_scale), so overview maps load few rows and the full detail only when zoomed in.
+"""
+import json
+import os
+
+import numpy
+
+from .results import LOG_COLUMNS, STATE_LOG_FIELDS, select_rows
+from .store import STORE_VERSION, ResultsStore, write_store
+
+# Cells per side of the blocks of every level, from full detail to overview
+LEVEL_FACTORS = (1, 4, 16, 64)
+
+# Fields aggregated as the most frequent value among the cells of a block, counting values from
+# the given one (empty cells do not hide the trees of a block); the other fields are averaged
+DOMINANT_FIELDS = {"tree_type": 1, "soil_type": 0}
+
+# Smallest size of the cells shown on screen, in pixels
+MIN_CELL_PIXELS = 4
+
+# Fields compared against the change threshold; the other fields are kept on any change
+THRESHOLD_FIELDS = ("water", "sunlight", "nitrogen", "potassium", "tree_height")
+
+def level_path_for(store_path, factor):
+    """Return the path of the store of a level (see build_levels) of a results store."""
+    return os.path.join(store_path, "levels", str(factor))
+
+def store_rows(store):
+    """Return every row of a store in time order, as columns, with the cell of every row under "cell"."""
+    columns = store.all_rows()
+    columns["cell"] = numpy.asarray(store.cell)
+    return columns
+
+def previous_rows(cell):
+    """Return the previous row of the same cell of every row (in time order), -1 for the first ones."""
+    rows = numpy.argsort(cell, kind="stable")
+    same = cell[rows[1:]] == cell[rows[:-1]]
+    previous = numpy.full(len(cell), -1, dtype=numpy.int64)
+    previous[rows[1:][same]] = rows[:-1][same]
+    return previous
+
+def last_rows(keys):
+    """Return the rows of time-ordered rows that are the last of their key, in row order."""
+    _, last = numpy.unique(keys[::-1], return_index=True)
+    return numpy.sort(len(keys) - 1 - last)
+
+def decimate_steps(columns, times, every):
+    """
+    Keep the state of the cells at every `every`-th of the distinct times (from the first one, and
+    the last one): the changes after a kept time up to the next one become one change at the next
+    kept time, with the last state.
+    """
+    if every <= 1 or not len(times):
+        return columns
+    kept = times[numpy.arange(0, len(times), every)]
+    if kept[-1] != times[-1]:
+        kept = numpy.append(kept, times[-1])
+    step = numpy.searchsorted(kept, columns["time"])
+    keys = step * (int(columns["cell"].max()) + 1) + columns["cell"]
+    return select_rows(dict(columns, time=kept[step]), last_rows(keys))
+
+def drop_small_changes(columns, threshold):
+    """
+    Drop the changes of a cell that move none of THRESHOLD_FIELDS to another multiple of threshold
+    and change no other field, keeping the first state of every cell.
+    """
+    if threshold <= 0:
+        return columns
+    previous = previous_rows(columns["cell"])
+    first = previous < 0
+    keep = first.copy()
+    for name in STATE_LOG_FIELDS:
+        values = columns[name]
+        if name in THRESHOLD_FIELDS:
+            values = values // threshold
+        keep |= ~first & (values != values[previous])
+    return select_rows(columns, numpy.flatnonzero(keep))
+
+def block_sums(block, deltas):
+    """
+    Return the running sum of the deltas of time-ordered rows within their block: the value of every
+    row is the sum of its delta and of the deltas of the earlier rows of the same block.
+    """
+    rows = numpy.argsort(block, kind="stable")
+    sums = numpy.cumsum(deltas[rows], axis=0)
+    starts = numpy.flatnonzero(numpy.r_[True, block[rows][1:] != block[rows][:-1]])
+    lengths = numpy.diff(numpy.r_[starts, len(rows)])
+    before = numpy.repeat(sums[starts] - deltas[rows][starts], lengths, axis=0)
+    running = numpy.empty_like(sums)
+    running[rows] = sums - before
+    return running
+
+def aggregate_cells(columns, cells, factor, spacing):
+    """
+    Merge cells into blocks of factor x factor cells `spacing` (x, y) map units apart, named after
+    the north-west corner of the block. After every time step, each block whose state changed in it
+    gets one row with the dominant value of DOMINANT_FIELDS and the rounded mean of the other fields
+    over the cells of the block logged so far. columns are cell state rows in time order, with their
+    cell in "cell" (an index of cells).
+    """
+    # Column and row of every cell on the grid of its spacing, rounded as the cell names are truncated
+    x0, y0 = cells[:, 0].min(), cells[:, 1].max()
+    width, height = spacing[0] * factor, spacing[1] * factor
+    block_x = numpy.round((cells[:, 0] - x0) / spacing[0]) // factor
+    block_y = numpy.round((y0 - cells[:, 1]) / spacing[1]) // factor
+    blocks, cell_block = numpy.unique(numpy.stack((block_x, block_y), axis=1), axis=0, return_inverse=True)
+    block = cell_block.reshape(-1)[columns["cell"]]
+
+    # Change of the cell counts, sums and category counts of the block of every row
+    previous = previous_rows(columns["cell"])
+    first = previous < 0
+    deltas = [first.astype(numpy.int64)]
+    averaged = [name for name in STATE_LOG_FIELDS if name not in DOMINANT_FIELDS]
+    for name in averaged:
+        values = columns[name]
+        deltas.append(values - numpy.where(first, 0, values[previous]))
+    categories = {}
+    for name, smallest in DOMINANT_FIELDS.items():
+        values = columns[name]
+        categories[name] = numpy.arange(smallest, max(int(values.max(initial=0)), smallest) + 1)
+        for category in categories[name]:
+            deltas.append((values == category).astype(numpy.int64)
+                          - (~first & (values[previous] == category)).astype(numpy.int64))
+    totals = block_sums(block, numpy.stack(deltas, axis=1))
+
+    # The state of a block after a time step is the one of its last row of the step
+    times, step = numpy.unique(columns["time"], return_inverse=True)
+    rows = last_rows(block * len(times) + step.reshape(-1))
+    totals, block = totals[rows], block[rows]
+
+    count = numpy.maximum(totals[:, 0], 1)
+    aggregated = {
+        "time": columns["time"][rows],
+        "model_id": block + 1,
+        "x": x0 + blocks[block, 0] * width,
+        "y": y0 - blocks[block, 1] * height,
+        "output": numpy.zeros(len(rows), dtype=numpy.int64),
+    }
+    for i, name in enumerate(averaged, 1):
+        aggregated[name] = numpy.floor(totals[:, i] / count + 0.5).astype(numpy.int64)
+    column = 1 + len(averaged)
+    for name in DOMINANT_FIELDS:
+        counts = totals[:, column:column + len(categories[name])]
+        dominant = categories[name][numpy.argmax(counts, axis=1)]
+        aggregated[name] = numpy.where(counts.max(axis=1) > 0, dominant, 0)
+        column += len(categories[name])
+
+    # Blocks whose aggregated state did not change keep their previous row
+    previous = previous_rows(block)
+    changed = previous < 0
+    for name in STATE_LOG_FIELDS:
+        changed |= aggregated[name] != aggregated[name][previous]
+    return {name: aggregated[name][changed] for name in LOG_COLUMNS}
+
+def cell_spacing(cells):
+    """Return the smallest (x, y) distances between the distinct coordinates of cells (1 when there is one)."""
+    spacing = []
+    for values in (cells[:, 0], cells[:, 1]):
+        gaps = numpy.diff(numpy.unique(values))
+        spacing.append(float(gaps.min()) if len(gaps) else 1.0)
+    return tuple(spacing)
+
+def level_meta(store, factor, every, threshold):
+    with open(os.path.join(store.path, "meta.json"), "r") as f:
+        meta = json.load(f)
+    return {"log": meta.get("log"), "factor": factor, "every": every, "threshold": threshold}
+
+def build_levels(store, factors=LEVEL_FACTORS, every=1, threshold=0):
+    """
+    Reduce a results store into one store per factor of blocks (see aggregate_cells), after the
+    temporal decimation of its rows (see decimate_steps and drop_small_changes). The full-detail level
+    (factor 1) without decimation is the store itself. Returns the stores, in the order of factors.
+    """
+    columns = store_rows(store)
+    columns = drop_small_changes(decimate_steps(columns, numpy.asarray(store.times), every), threshold)
+    cells = numpy.asarray(store.cells)
+    spacing = cell_spacing(cells)
+
+    levels = []
+    for factor in factors:
+        if factor == 1 and every <= 1 and threshold <= 0:
+            levels.append(store)
+            continue
+        if factor == 1:
+            reduced = {name: columns[name] for name in LOG_COLUMNS}
+        else:
+            reduced = aggregate_cells(columns, cells, factor, spacing)
+        path = level_path_for(store.path, factor)
+        levels.append(write_store(reduced, path, level_meta(store, factor, every, threshold)))
+    return levels
+
+def open_levels(store, factors=LEVEL_FACTORS, every=1, threshold=0):
+    """Open the levels of a results store (see build_levels), reducing it again when a level is missing or stale."""
+    levels = []
+    for factor in factors:
+        if factor == 1 and every <= 1 and threshold <= 0:
+            levels.append(store)
+            continue
+        meta_path = os.path.join(level_path_for(store.path, factor), "meta.json")
+        if not os.path.exists(meta_path):
+            return build_levels(store, factors, every, threshold)
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        expected = dict(level_meta(store, factor, every, threshold), version=STORE_VERSION)
+        if any(meta.get(key) != value for key, value in expected.items()):
+            return build_levels(store, factors, every, threshold)
+        levels.append(ResultsStore(level_path_for(store.path, factor)))
+    return levels
+
+def level_for_scale(spacing, units_per_pixel, factors=LEVEL_FACTORS):
+    """
+    Return the index of the finest level whose blocks are at least MIN_CELL_PIXELS wide at a map
+    scale of units_per_pixel map units per screen pixel (the coarsest level beyond it).
+    """
+    for i, factor in enumerate(factors):
+        if spacing * factor / units_per_pixel >= MIN_CELL_PIXELS:
+            return i
+    return len(factors) - 1
@@ -0,0 +1,379 @@
+import cProfile
+import datetime
+import json
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy
+
+from .cache import load_base, load_rasters, restore_file, save_base, save_files, save_rasters, source_identity
+from .compact import write_compact
+from .engine import WARM_ITERATIONS, WARM_TOLERANCE, warm_resources
+from .scenario import (TREE_SPECIES, build_cell_grid, default_cell, patch_tree_types, sample_columns, sample_rows,
+                       tree_type_offsets, write_scenario)
+from .tiles import TILE_ROWS, write_tiled_scenario
+
+# Stages of a scenario preparation, in order
+STAGES = ("clip", "align", "seed", "cells", "warm", "write")
+
+# Suffix of the run report written next to a scenario (map.json -> map_report.json)
+REPORT_SUFFIX = "_report.json"
+
+class Canceled(Exception):
+    """Raised inside a scenario preparation when it has been canceled."""
+
+def peak_rss():
+    """Return the peak resident set size of the process in bytes, or None where it is unknown."""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # kilobytes on Linux
+
+def report_path_for(json_path):
+    """Return the path of the run report of a scenario file."""
+    return os.path.splitext(json_path)[0] + REPORT_SUFFIX
+
+class StageTimer:
+    """
+    Runs the stages of a preparation: times them, reports the overall progress (0-100) through
+    progress(stage, percent) and raises Canceled between and within stages once is_canceled() is true.
+    Every stage also records the peak RSS of the process when it ends and the counts given to count()
+    (pixels, cells, links, bytes...), which make up its run report.
+    """
+
+    def __init__(self, stages, progress=None, is_canceled=None):
+        self.stages = stages
+        self.progress = progress
+        self.is_canceled = is_canceled or (lambda: False)
+        self.timings = {}
+        self.cached = set()
+        self.counts = {}
+        self.peak_rss = {}
+        self.current = None
+
+    def check(self):
+        if self.is_canceled():
+            raise Canceled(f"Canceled during the {self.current} stage")
+
+    def report(self, fraction):
+        """Report the completed fraction of the current stage, and check for cancellation."""
+        self.check()
+        if self.progress:
+            index = self.stages.index(self.current)
+            self.progress(self.current, 100 * (index + fraction) / len(self.stages))
+
+    @contextmanager
+    def stage(self, name):
+        self.current = name
+        self.report(0)
+        start = time.perf_counter()
+        yield self
+        self.timings[name] = time.perf_counter() - start
+        self.peak_rss[name] = peak_rss()
+        self.report(1)
+
+    def count(self, **counts):
+        """Record counts of the current stage, such as its pixels, cells, links or output bytes."""
+        self.counts.setdefault(self.current, {}).update(
+            {name: int(value) for name, value in counts.items() if value is not None}
+        )
+
+    @contextmanager
+    def profiled(self, path):
+        """Capture a cProfile of the stages run within and save its statistics to path (nothing without a path)."""
+        if not path:
+            yield self
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield self
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+
+    def summary(self):
+        """Return the stage timings as a printable line."""
+        return ", ".join(
+            f"{name}: {seconds:.2f} s" + (" (cached)" if name in self.cached else "")
+            for name, seconds in self.timings.items()
+        )
+
+    def details(self):
+        """Return one printable line per stage with its time, peak RSS and counts."""
+        lines = []
+        for name, seconds in self.timings.items():
+            parts = [f"{seconds:.3f} s"]
+            if self.peak_rss.get(name):
+                parts.append(f"peak RSS {self.peak_rss[name] / 2**20:.0f} MB")
+            parts += [f"{key} {value}" for key, value in self.counts.get(name, {}).items()]
+            lines.append(f"{name}{' (cached)' if name in self.cached else ''}: " + ", ".join(parts))
+        return lines
+
+    def to_dict(self):
+        """Return the measures of every stage run, for a run report."""
+        return {
+            "seconds": round(sum(self.timings.values()), 6),
+            "stages": {
+                name: dict(seconds=round(seconds, 6), cached=name in self.cached,
+                           peak_rss_bytes=self.peak_rss.get(name), **self.counts.get(name, {}))
+                for name, seconds in self.timings.items()
+            },
+        }
+
+    def write_report(self, path, section, **info):
+        """
+        Save the measures of the run under `section` of the JSON run report at path, keeping the
+        other sections (e.g. the preparation and the results loading of the same scenario).
+        """
+        report = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    report = json.load(f)
+            except ValueError:
+                pass
+        report[section] = dict(finished=datetime.datetime.now().isoformat(timespec="seconds"), **info,
+                               **self.to_dict())
+        partial_path = path + ".partial"
+        with open(partial_path, "w") as f:
+            json.dump(report, f, indent=4)
+        os.replace(partial_path, path)
+
+@contextmanager
+def replacing(path):
+    """
+    Give the path of a partial file to write, which replaces path once complete. A canceled or failed
+    write removes it and leaves the previous file in place.
+    """
+    partial_path = path + ".partial"
+    try:
+        yield partial_path
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    os.replace(partial_path, path)
+
+def prepare_scenario(paths, region, seedings=None, geometry_crs=None, resolution=50,
+                     elevation_resampling="mean", progress=None, is_canceled=None, cache=None, workers=1,
+                     tile_rows=TILE_ROWS, warm_start=False, layout="square", memory_budget=None):
+    """
+    Build the scenario of the selected region and write it to paths["json"] (and paths["compact"]
+    when given). paths["dtm"] and paths["land"] are the source rasters, paths["sand"] and
+    paths["clay"] the optional soil percentage rasters, region a GeoJSON polygon and seedings a list
+    of (GeoJSON polygon, treeSpecies) pairs, all in geometry_crs. With a cache (see cache.DiskCache),
+    the clipped DTM, the aligned rasters and the scenario files are reused from earlier preparations
+    with the same inputs, and a change of seedings only patches the cells it changes in the first
+    scenario of the same cells (without warm start or compact scenario, see patch_base). With
+    workers other than 1, the scenario is generated in tiles of tile_rows cell rows by that many
+    processes (None for one per core, see tiles.write_tiled_scenario). With a memory_budget in
+    bytes, the rasters are never read whole: the "write" stage reads, builds and writes blocks of
+    rows that fit in the budget (see blocks.write_block_scenario), without warm start or compact
+    scenario. The measures of every stage are saved under "prepare" in the run report
+    paths["report"] and a cProfile of the preparation to paths["profile"], when given. With
+    warm_start, the "warm" stage starts the cells with the approximate equilibrium of their
+    resources (see engine.warm_resources) instead of none. layout is "square" or "hex" (see
+    scenario.LAYOUTS); hexagonal cells are sampled from rasters read at half the cell size. Returns
+    the StageTimer holding the measures of every stage.
+    """
+    if memory_budget and (warm_start or paths.get("compact")):
+        raise ValueError("A memory budget rules out the warm start and the compact scenario, which need the whole grid")
+    if memory_budget:
+        stages = ("write",)
+    else:
+        stages = STAGES if warm_start else tuple(stage for stage in STAGES if stage != "warm")
+    timer = StageTimer(stages, progress, is_canceled)
+    with timer.profiled(paths.get("profile")):
+        prepare_stages(timer, paths, region, seedings, geometry_crs, resolution, elevation_resampling, cache,
+                       workers, tile_rows, warm_start, layout, memory_budget)
+    if paths.get("report"):
+        inputs = {"resolution": resolution, "elevation_resampling": elevation_resampling, "workers": workers,
+                  "seedings": len(seedings or []), "warm_start": warm_start, "layout": layout,
+                  "memory_budget": memory_budget}
+        timer.write_report(paths["report"], "prepare", scenario=paths["json"], inputs=inputs)
+    return timer
+
+def prepare_stages(timer, paths, region, seedings, geometry_crs, resolution, elevation_resampling, cache,
+                   workers, tile_rows, warm_start, layout, memory_budget):
+    """Run the stages of prepare_scenario with a StageTimer."""
+    # Loaded here so that importing the pipeline does not load GDAL
+    from .rasters import align_region, read_region, seed_region
+
+    # Hexagonal cells fall on every other element of rasters read at half the cell size
+    read_step = resolution / 2 if layout == "hex" else resolution
+
+    files = {"scenario.json": paths["json"]}
+    if paths.get("compact"):
+        files["scenario.npz"] = paths["compact"]
+
+    # Every key depends on the inputs of its stage and on the key of the stage before it
+    base = None
+    new_base = False
+    if cache:
+        clip_key = cache.key("clip", source_identity(paths["dtm"]), region, geometry_crs, read_step, elevation_resampling)
+        soil_sources = [source_identity(paths[name]) if paths.get(name) else None for name in ("sand", "clay")]
+        align_key = cache.key("align", clip_key, source_identity(paths["land"]), soil_sources)
+        warm = [WARM_TOLERANCE, WARM_ITERATIONS] if warm_start else None
+        scenario_key = cache.key("scenario", align_key, seedings, geometry_crs, sorted(files), warm, resolution, layout)
+        scenario_entry = cache.get(scenario_key)
+        if scenario_entry:
+            with timer.stage("write"):
+                timer.cached.add("write")
+                for name, path in files.items():
+                    restore_file(scenario_entry, name, path)
+                timer.count(output_bytes=sum(os.path.getsize(path) for path in files.values()))
+            return
+
+        # The scenarios of the same cells only differ by the tree_type of the cells the seedings change,
+        # unless their resources are warmed up
+        base_key = cache.key("base", align_key, geometry_crs, resolution, layout)
+        if not warm_start and not memory_budget:
+            if not cache.get(base_key):
+                new_base = True
+            elif not paths.get("compact"):
+                base = load_base(cache.entry_path(base_key))
+
+    if memory_budget:
+        from .blocks import write_block_scenario
+
+        with timer.stage("write"):
+            # The blocks read their own rasters, only the scenario can be cached
+            with replacing(paths["json"]) as partial_path:
+                cells, links, blocks = write_block_scenario(
+                    paths, region, seedings, geometry_crs, resolution, partial_path, memory_budget, read_step,
+                    elevation_resampling, workers, progress=timer.report, layout=layout
+                )
+            timer.count(cells=cells, links=links, blocks=blocks, output_bytes=os.path.getsize(paths["json"]))
+            if cache:
+                cache.put(scenario_key, lambda directory: save_files(files, directory))
+        return
+
+    rasters = None
+    with timer.stage("clip"):
+        if cache and cache.get(align_key):
+            # The aligned rasters are cached, the DTM is not needed on its own
+            timer.cached.add("clip")
+        elif cache and cache.get(clip_key):
+            timer.cached.add("clip")
+            rasters = load_rasters(cache.entry_path(clip_key))
+        else:
+            rasters = read_region(paths["dtm"], region, geometry_crs, read_step, elevation_resampling)
+            if cache:
+                cache.put(clip_key, lambda directory: save_rasters(rasters, directory))
+        if rasters is not None:
+            timer.count(pixels=rasters.dtm.size, source_pixels=rasters.dtm.size * rasters.step**2,
+                        region_pixels=numpy.count_nonzero(rasters.region))
+
+    with timer.stage("align"):
+        if rasters is None:
+            timer.cached.add("align")
+            rasters = load_rasters(cache.entry_path(align_key))
+        else:
+            align_region(rasters, paths["land"], paths.get("sand"), paths.get("clay"))
+            if cache:
+                cache.put(align_key, lambda directory: save_rasters(rasters, directory))
+        timer.count(pixels=rasters.landcover.size,
+                    clay_pixels=None if rasters.soil_type is None else numpy.count_nonzero(rasters.soil_type))
+
+    with timer.stage("seed"):
+        # Against a base, only the window of the seedings that changed is rasterized
+        window = seed_region(rasters, seedings, geometry_crs, base[:2] if base else None)
+        timer.count(seeded_pixels=numpy.count_nonzero(rasters.initial_species),
+                    rasterized_pixels=0 if window is None else rasters.initial_species[window].size)
+
+    if base:
+        patch_base(timer, paths, rasters, window, base, cache.entry_path(base_key))
+        cache.put(scenario_key, lambda directory: save_files(files, directory))
+        return
+
+    # The rasters are read at the cell size, so every element is a cell candidate (every other one for hexagons)
+    sources = (rasters.dtm, rasters.landcover, rasters.initial_species, rasters.transform, resolution)
+    layers = {"soil_type": rasters.soil_type} if rasters.soil_type is not None else {}
+    stride = round(resolution / rasters.step)
+    tiled = workers != 1
+
+    with timer.stage("cells"):
+        # Tiles build their own cells, the whole grid is only needed for the compact scenario, the warm
+        # start and a new base
+        grid = None
+        if not tiled or paths.get("compact") or warm_start or new_base:
+            grid = build_cell_grid(*sources, stride, layers=layers, layout=layout)
+            timer.count(cells=len(grid), links=grid.link_count())
+
+    if warm_start:
+        with timer.stage("warm"):
+            resources, iterations = warm_resources(grid, default_cell())
+            grid.layers.update(resources)
+            for field, values in resources.items():
+                # The tiles read the resources over the pixels of the rasters, like the other layers
+                layers[field] = numpy.zeros(rasters.shape, dtype=numpy.int64)
+                rows = sample_rows(grid.rows, stride, layout)
+                layers[field][rows, sample_columns(grid.rows, grid.cols, stride, layout)] = values
+            timer.count(iterations=iterations)
+
+    with timer.stage("write"):
+        # Stream the cells to the JSON file instead of building the whole scenario in memory
+        with replacing(paths["json"]) as partial_path:
+            if tiled:
+                cells, links = write_tiled_scenario(*sources, partial_path, stride, workers, tile_rows,
+                                                    progress=timer.report, layers=layers, layout=layout)
+                timer.count(cells=cells, links=links)
+            else:
+                write_scenario(grid, partial_path, progress=timer.report)
+        if paths.get("compact"):
+            write_compact(grid, paths["compact"])
+        timer.count(output_bytes=sum(os.path.getsize(path) for path in files.values()))
+        if cache:
+            cache.put(scenario_key, lambda directory: save_files(files, directory))
+        if new_base:
+            rows, cols = sample_rows(grid.rows, stride, layout), sample_columns(grid.rows, grid.cols, stride, layout)
+            offsets = tree_type_offsets(paths["json"])
+            cache.put(base_key, lambda directory: save_base(directory, paths["json"], seedings or [],
+                                                             rasters.initial_species, rows, cols, grid.tree_type,
+                                                             offsets))
+
+def patch_base(timer, paths, rasters, window, base, base_directory):
+    """
+    Write the scenario of the seeded rasters as a copy of a base scenario of the same cells (see
+    cache.save_base), with the tree_type of the cells under the window of the changed seedings patched.
+    """
+    _, _, rows, cols, tree_type, offsets = base
+    with timer.stage("cells"):
+        # The cells under the window take the species seeded on their element, except the water cells
+        new_type = tree_type.copy()
+        if window is not None:
+            inside = ((rows >= window[0].start) & (rows < window[0].stop) &
+                      (cols >= window[1].start) & (cols < window[1].stop) & (tree_type != TREE_SPECIES["Water"]))
+            new_type[inside] = rasters.initial_species[rows[inside], cols[inside]]
+        changed = numpy.flatnonzero(new_type != tree_type)
+        timer.count(cells=len(tree_type), patched_cells=len(changed))
+
+    with timer.stage("write"):
+        with replacing(paths["json"]) as partial_path:
+            shutil.copyfile(os.path.join(base_directory, "scenario.json"), partial_path)
+            patch_tree_types(partial_path, offsets[changed], new_type[changed])
+        timer.count(output_bytes=os.path.getsize(paths["json"]))
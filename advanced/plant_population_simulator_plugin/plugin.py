@@ -5,13 +5,17 @@ from PyQt5.QtWidgets import (
     QPushButton,
     QWidget,
     QDockWidget,
-    QFileDialog,
     QAction,
     QSlider,
-    QMessageBox
+    QSpinBox,
+    QCheckBox
 )
 from PyQt5.QtCore import (
     Qt,
+    QDate,
+    QDateTime,
+    QTime,
+    QTimer,
     QVariant
 )
 from qgis.core import (
@@ -23,57 +27,45 @@ from qgis.core import (
     QgsGeometry,
     QgsWkbTypes,
     QgsFeature,
-    QgsProcessingFeedback,
-    QgsVectorLayerTemporalProperties,
-    QgsDataSourceUri,
-    QgsVectorLayer,
-    QgsFeature,
-    QgsGeometry,
     QgsPointXY,
-    QgsProject,
-    QgsCoordinateReferenceSystem,
     QgsCoordinateTransform,
+    QgsCsException,
+    QgsRectangle,
     QgsMessageLog,
     Qgis,
     QgsTemporalNavigationObject,
+    QgsApplication,
+    QgsTask,
+    QgsDateTimeRange,
+    QgsInterval,
+    QgsSingleBandGrayRenderer,
 )
-from qgis.gui import QgsMapToolIdentifyFeature
 from qgis.gui import QgsMapToolEmitPoint, QgsRubberBand
 from qgis.PyQt.QtGui import QColor
-from pathlib import Path
 import json
 import os
-import processing
-import rasterio
 import numpy
 import math
-import subprocess
-import threading
-import csv
 
-#########################
-# CONSTANTS
-#########################
+from .scenario import HEX_MIN_SPACING, SEEDABLE_SPECIES, TREE_SPECIES
+from .cache import DiskCache
+from .pipeline import Canceled, StageTimer, prepare_scenario, report_path_for
+from .runner import LOG_PATH, SimulationRun
+from .results import group_cells, row_count, state_rows
+from .levels import cell_spacing, level_for_scale, open_levels
+from .store import build_store, open_store
+from .timeline import CellTimeline
+
+# Stages of loading simulation results, in order
+RESULTS_STAGES = ("store", "levels", "timeline", "layer")
 
-FUELS = {
-    1: 10,   # temperate or sub-polar needleleaf forest -> FM10
-    2: 13,   # sub-polar taiga -> FM13
-    5: 9,    # temperate or sub-polar broadleaf deciduous forest -> FM9
-    6: 8,    # forest foliage temperate or sub-polar -> FM8
-    8: 141,  # temperate or sub-polar shrubland -> SH1
-    10: 101, # temperate or sub-polar grassland -> GR1
-    11: 93,  # sub-polar or polar shrubland-lichen-moss -> NB3
-    12: 103, # sub-polar or polar grassland-lichen-moss -> GR3
-    13: 99,  # sub-polar or polar barren-lichen-moss -> NB9
-    14: 94,  # wetland -> NB4
-    15: 93,  # cropland -> NB3
-    16: 99,  # barren lands -> NB9
-    17: 91,  # urban -> NB1
-    18: 98,  # water -> NB8
-    19: 92,  # snow and ice -> NB2
-}
-
-# TODO OP landcover map can be used to determine water features (check for 18)
+# Stages of exporting simulation results as raster stacks, and the fields loaded as temporal raster layers
+EXPORT_STAGES = ("store", "export", "layers")
+EXPORT_LAYER_FIELDS = ("tree_height", "tree_type")
+
+# First QGIS version whose temporal raster layers give every band its own time range; older ones
+# load the results as one layer per frame
+FIXED_RANGE_PER_BAND_VERSION = 33800
 
 #########################
 # PLUGIN CLASSES
@@ -86,7 +78,7 @@ class PPSPlugin:
         self.map_tool = None
         self.rubber_band = None
         self.selected_region = None
-        self.pine_region = None
+        self.seeding_regions = []  # (QgsGeometry in the project CRS, treeSpecies) of the initial tree areas
 
     def initGui(self):
         self.action = QAction('Plant Population Simulator', self.iface.mainWindow())
@@ -117,13 +109,13 @@ class PPSDockWidget(QDockWidget):
         self.plugin.rubber_band.setColor(QColor(Qt.green))
         self.plugin.rubber_band.setWidth(2)
 
-        self.plugin.pine_origin_rubber_band = QgsRubberBand(self.plugin.iface.mapCanvas(), QgsWkbTypes.PolygonGeometry)
-        self.plugin.pine_origin_rubber_band.setColor(QColor(Qt.red))
-        self.plugin.pine_origin_rubber_band.setWidth(2)
+        self.plugin.seeding_rubber_band = QgsRubberBand(self.plugin.iface.mapCanvas(), QgsWkbTypes.PolygonGeometry)
+        self.plugin.seeding_rubber_band.setColor(QColor(Qt.red))
+        self.plugin.seeding_rubber_band.setWidth(2)
 
         # Set up map selection tools
-        self.map_tool = RegionSelectionTool(self.iface, self, self.plugin.rubber_band, is_pine_region=False)
-        self.pine_origin_map_tool = RegionSelectionTool(self.iface, self, self.plugin.pine_origin_rubber_band, is_pine_region=True)
+        self.map_tool = RegionSelectionTool(self.iface, self, self.plugin.rubber_band, is_seeding_region=False)
+        self.seeding_map_tool = RegionSelectionTool(self.iface, self, self.plugin.seeding_rubber_band, is_seeding_region=True)
 
         self.layout = QVBoxLayout()
 
@@ -145,6 +137,19 @@ class PPSDockWidget(QDockWidget):
         self.populate_raster_layers(self.landcover_selector)
         self.layout.addWidget(self.landcover_selector)
 
+        # --- Optional soil percentage layers, classified into soil types ---
+        self.sand_label = QLabel("Select Sand Percentage Layer (optional):")
+        self.layout.addWidget(self.sand_label)
+        self.sand_selector = QComboBox()
+        self.populate_raster_layers(self.sand_selector, optional=True)
+        self.layout.addWidget(self.sand_selector)
+
+        self.clay_label = QLabel("Select Clay Percentage Layer (optional):")
+        self.layout.addWidget(self.clay_label)
+        self.clay_selector = QComboBox()
+        self.populate_raster_layers(self.clay_selector, optional=True)
+        self.layout.addWidget(self.clay_selector)
+
         # --- Buttons ---
         self.select_button = QPushButton("Select Simulation Area")
         self.select_button.clicked.connect(self.activate_selection)
@@ -154,17 +159,32 @@ class PPSDockWidget(QDockWidget):
         self.confirm_selection_button.clicked.connect(self.confirm_drawn_area)
         self.layout.addWidget(self.confirm_selection_button)
 
-        self.pine_origin_button = QPushButton("Select Initial Pine Area")
-        self.pine_origin_button.clicked.connect(self.activate_pine_origin_selection)
-        # self.pine_origin_button.setEnabled(False)  # Disabled by default
-        self.layout.addWidget(self.pine_origin_button)
-
-        self.confirm_pine_button = QPushButton("Confirm Initial Pine Area")
-        self.confirm_pine_button.clicked.connect(self.confirm_initial_pine_region)
-        # self.confirm_pine_button.setEnabled(False)  # Disabled by default
-        self.layout.addWidget(self.confirm_pine_button)
-
-        # TODO OP add buttons for other selecting other tree type regions
+        # --- Initial tree areas, seeded with the selected species ---
+        self.species_label = QLabel("Initial Tree Species:")
+        self.layout.addWidget(self.species_label)
+        self.species_selector = QComboBox()
+        for name in SEEDABLE_SPECIES:
+            self.species_selector.addItem(name, TREE_SPECIES[name])
+        self.species_selector.setCurrentText("Pine")
+        self.layout.addWidget(self.species_selector)
+
+        self.seeding_button = QPushButton("Select Initial Tree Area")
+        self.seeding_button.clicked.connect(self.activate_seeding_selection)
+        self.layout.addWidget(self.seeding_button)
+
+        self.confirm_seeding_button = QPushButton("Confirm Initial Tree Area")
+        self.confirm_seeding_button.clicked.connect(self.confirm_seeding_region)
+        self.layout.addWidget(self.confirm_seeding_button)
+
+        self.seeding_layer_label = QLabel("Initial Tree Areas Layer:")
+        self.layout.addWidget(self.seeding_layer_label)
+        self.seeding_layer_selector = QComboBox()
+        self.populate_polygon_layers(self.seeding_layer_selector)
+        self.layout.addWidget(self.seeding_layer_selector)
+
+        self.add_seeding_layer_button = QPushButton("Add Initial Tree Areas From Layer")
+        self.add_seeding_layer_button.clicked.connect(self.add_seeding_layer)
+        self.layout.addWidget(self.add_seeding_layer_button)
 
         self.clear_button = QPushButton("Clear Selected Areas")
         self.clear_button.clicked.connect(self.clear_selection)
@@ -180,14 +200,86 @@ class PPSDockWidget(QDockWidget):
         self.resolution_slider.valueChanged.connect(self.update_resolution)
         self.layout.addWidget(self.resolution_slider)
 
+        # --- Cell Layout ---
+        self.cell_layout_label = QLabel("Cell Layout:")
+        self.layout.addWidget(self.cell_layout_label)
+        self.cell_layout_selector = QComboBox()
+        self.cell_layout_selector.addItem("Square", "square")
+        self.cell_layout_selector.addItem("Hexagonal", "hex")
+        self.cell_layout_selector.currentIndexChanged.connect(self.update_cell_layout)
+        self.layout.addWidget(self.cell_layout_selector)
+
+        # --- Memory budget of the scenario preparation, 0 to read the rasters whole ---
+        self.memory_budget_label = QLabel("Memory Budget (MB, 0 for none):")
+        self.layout.addWidget(self.memory_budget_label)
+        self.memory_budget_input = QSpinBox()
+        self.memory_budget_input.setMinimum(0)
+        self.memory_budget_input.setMaximum(1000000)
+        self.memory_budget_input.setValue(0)
+        self.layout.addWidget(self.memory_budget_input)
+
         self.convert_button = QPushButton("Prepare Simulation Scenario")
         self.convert_button.clicked.connect(self.convert_to_json)
         self.layout.addWidget(self.convert_button)
 
+        self.cancel_convert_button = QPushButton("Cancel Scenario Preparation")
+        self.cancel_convert_button.clicked.connect(self.cancel_convert)
+        self.cancel_convert_button.setEnabled(False)
+        self.layout.addWidget(self.cancel_convert_button)
+        self.prepare_task = None
+
+        self.warm_start_checkbox = QCheckBox("Start From Settled Resources")
+        self.layout.addWidget(self.warm_start_checkbox)
+
+        self.profile_checkbox = QCheckBox("Profile Scenario Preparation")
+        self.layout.addWidget(self.profile_checkbox)
+
+        # --- Simulation run ---
+        self.sim_time_label = QLabel("Simulation Time:")
+        self.layout.addWidget(self.sim_time_label)
+        self.sim_time_input = QSpinBox()
+        self.sim_time_input.setMinimum(1)
+        self.sim_time_input.setMaximum(1000000)
+        self.sim_time_input.setValue(200)  # Same default as main.cpp
+        self.layout.addWidget(self.sim_time_input)
+
+        self.run_button = QPushButton("Run Simulation")
+        self.run_button.clicked.connect(self.run_simulation)
+        self.layout.addWidget(self.run_button)
+
+        self.stop_button = QPushButton("Stop Simulation")
+        self.stop_button.clicked.connect(self.stop_simulation)
+        self.stop_button.setEnabled(False)
+        self.layout.addWidget(self.stop_button)
+
+        self.simulation_run = None
+        self.last_log_path = None  # Log of the last simulation run, shown and exported as the results
+        self.live_layer = None
+        self.results_layer = None
+        self.results_levels = None
+        self.results_level = None
+        self.plugin.iface.mapCanvas().scaleChanged.connect(self.show_results_level)
+        self.run_timer = QTimer(self)
+        self.run_timer.setInterval(1000)  # Poll the simulator log every second
+        self.run_timer.timeout.connect(self.poll_simulation)
+
+        # --- Temporal decimation of the results shown, 1 to show every logged time ---
+        self.results_every_label = QLabel("Show Every N-th Logged Time:")
+        self.layout.addWidget(self.results_every_label)
+        self.results_every_input = QSpinBox()
+        self.results_every_input.setMinimum(1)
+        self.results_every_input.setMaximum(1000000)
+        self.results_every_input.setValue(1)
+        self.layout.addWidget(self.results_every_input)
+
         self.display_results_button = QPushButton("Visualize Results")
         self.display_results_button.clicked.connect(self.open_results_csv)
         self.layout.addWidget(self.display_results_button)
 
+        self.export_results_button = QPushButton("Export Results as Rasters")
+        self.export_results_button.clicked.connect(self.export_results_rasters)
+        self.layout.addWidget(self.export_results_button)
+
         container = QWidget()
         container.setLayout(self.layout)
         self.setWidget(container)
@@ -197,11 +289,15 @@ class PPSDockWidget(QDockWidget):
         self.landcover_selector.clear()
         self.populate_raster_layers(self.dtm_selector)
         self.populate_raster_layers(self.landcover_selector)
-        # TODO OP add selectors for clay and soil types
+        self.populate_raster_layers(self.sand_selector, optional=True)
+        self.populate_raster_layers(self.clay_selector, optional=True)
+        self.populate_polygon_layers(self.seeding_layer_selector)
 
-    def populate_raster_layers(self, selector):
-        """Populate the dropdown with GeoTIFF (raster) layers."""
+    def populate_raster_layers(self, selector, optional=False):
+        """Populate the dropdown with GeoTIFF (raster) layers, after a "None" entry when the layer is optional."""
         selector.clear()
+        if optional:
+            selector.addItem("None", None)
         layers = QgsProject.instance().mapLayers().values()
         for layer in layers:
             if isinstance(layer, QgsRasterLayer):
@@ -209,366 +305,611 @@ class PPSDockWidget(QDockWidget):
                 if ds.endswith('.tif') or ds.endswith('.tiff'):
                     selector.addItem(layer.name(), layer)
 
+    def populate_polygon_layers(self, selector):
+        """Populate the dropdown with polygon vector layers."""
+        selector.clear()
+        for layer in QgsProject.instance().mapLayers().values():
+            if isinstance(layer, QgsVectorLayer) and layer.geometryType() == QgsWkbTypes.PolygonGeometry:
+                selector.addItem(layer.name(), layer)
+
     def update_resolution(self, value):
         """Update the simulation resolution when the slider is moved."""
         self.resolution = value
         self.resolution_label.setText(f"Resolution: {self.resolution}m")
         print(f"Resolution updated to: {self.resolution}m")
 
+    def update_cell_layout(self, index):
+        """Keep hexagonal cells far enough apart to get distinct names, moving the slider if needed."""
+        hex_layout = self.cell_layout_selector.itemData(index) == "hex"
+        self.resolution_slider.setMinimum(HEX_MIN_SPACING if hex_layout else 1)
+
     def activate_selection(self):
         """Activate the polygon drawing tool."""
         self.plugin.iface.mapCanvas().setMapTool(self.map_tool)
         print("Draw tool activated. Draw a polygon on the map.")
 
-    def activate_pine_origin_selection(self):
-        """Activate the pine origin selection tool."""
+    def activate_seeding_selection(self):
+        """Activate the initial tree area selection tool."""
         if self.plugin.selected_region:
-            self.plugin.iface.mapCanvas().setMapTool(self.pine_origin_map_tool)
-            print("Pine origin drawing tool activated. Draw a polygon within the selected region.")
+            self.plugin.iface.mapCanvas().setMapTool(self.seeding_map_tool)
+            print("Initial tree area drawing tool activated. Draw a polygon within the selected region.")
         else:
             print("No selected region. Please draw a selected region first.")
 
-    # TODO OP will need new functions for other tree type regions (likely same as other functions)
-
     def confirm_drawn_area(self):
         """Confirm the drawn polygon and set it as the selected region."""
         if self.map_tool.points:
             self.plugin.selected_region = QgsGeometry.fromPolygonXY([self.map_tool.points])
             print("Selected region confirmed.")
-            # Enable the pine origin button since a selected region exists
-        #     self.pine_origin_button.setEnabled(True)
-        # else:
-        #     print("No polygon drawn. Please draw a polygon first.")
-        #     # Disable the pine origin button if no selected region exists
-        #     self.pine_origin_button.setEnabled(False)
-    
-    def confirm_initial_pine_region(self):
-        """Confirm the drawn polygon and set it as the initial pine region."""
-        if self.pine_origin_map_tool.points:
-            self.plugin.initial_pine_region = QgsGeometry.fromPolygonXY([self.pine_origin_map_tool.points])
-            print("Initial pine region confirmed.")
-            # self.confirm_pine_button.setEnabled(False)  # Disable the button after confirmation
+
+    def confirm_seeding_region(self):
+        """Add the polygon being drawn as an initial tree area of the selected species."""
+        if len(self.seeding_map_tool.points) > 2:
+            self.add_seeding_region(QgsGeometry.fromPolygonXY([self.seeding_map_tool.points]))
+            self.seeding_map_tool.points = []
+            self.seeding_map_tool.highlight_region()
         else:
             print("No polygon drawn. Please draw a polygon first.")
-    
-    # TODO OP is this duplicate of above? Need to take a closer look
-    def activate_pine_origin_selection(self):
-        """Activate the pine origin selection tool."""
-        if self.plugin.selected_region:
-            self.plugin.iface.mapCanvas().setMapTool(self.pine_origin_map_tool)
-            # self.confirm_pine_button.setEnabled(True)  # Enable the button
-            print("Pine origin drawing tool activated. Draw a polygon within the selected region.")
-        else:
-            print("No selected region. Please draw a selected region first.")
+
+    def add_seeding_region(self, geometry):
+        """Add a polygon (in the project CRS) as an initial tree area of the selected species."""
+        species = self.species_selector.currentData()
+        self.plugin.seeding_regions.append((geometry, species))
+        print(f"Initial {self.species_selector.currentText()} area added ({len(self.plugin.seeding_regions)} initial tree areas).")
+
+    def add_seeding_layer(self):
+        """Add every polygon of the selected vector layer as an initial tree area of the selected species."""
+        layer = self.seeding_layer_selector.currentData()
+        if not layer:
+            print("No polygon layer selected.")
+            return
+        to_project = QgsCoordinateTransform(layer.crs(), QgsProject.instance().crs(), QgsProject.instance())
+        species = self.species_selector.currentData()
+        count = 0
+        for feature in layer.getFeatures():
+            geometry = QgsGeometry(feature.geometry())
+            if geometry.isEmpty():
+                continue
+            geometry.transform(to_project)
+            self.plugin.seeding_regions.append((geometry, species))
+            count += 1
+        self.seeding_map_tool.highlight_region()
+        print(f"{count} initial {self.species_selector.currentText()} areas added from {layer.name()}.")
 
     def clear_selection(self):
         """Clear the current selection and rubber band."""
         if self.plugin.rubber_band:
             self.plugin.selected_region = None
             self.plugin.rubber_band.reset()
-            self.plugin.rubber_band = None
             self.plugin.iface.mapCanvas().refresh()
-        if self.plugin.pine_origin_rubber_band:
-            self.plugin.initial_pine_region = None
-            self.plugin.pine_origin_rubber_band.reset()
-            self.plugin.pine_origin_rubber_band = None
+        if self.plugin.seeding_rubber_band:
+            self.plugin.seeding_regions = []
+            self.plugin.seeding_rubber_band.reset()
             self.plugin.iface.mapCanvas().refresh()
         self.map_tool.points = []
-        self.pine_origin_map_tool.points = []
+        self.seeding_map_tool.points = []
         self.plugin.iface.mapCanvas().setMapTool(None)
-        # self.pine_origin_button.setEnabled(False)
-        # self.confirm_pine_button.setEnabled(False)  # Disable the button
         print("Selection cleared!")
 
-    def clip_initial_pine_region(self, json_file_path):
-        """Clip the initial pine region as a binary raster and resample it to match the slope raster."""
-        if not self.plugin.initial_pine_region:
-            print("No initial pine region to clip.")
-            return None
-
-        # Create an in-memory mask layer from the initial pine region polygon
-        mask_layer = createTemporaryPolygonLayer(self.plugin.initial_pine_region)
-
-        # Create a binary raster with the same dimensions as the slope raster
-        dtm_layer = self.dtm_selector.currentData()
-        if not dtm_layer:
-            print("No dtm layer selected.")
-            return None
-
-        # Determine output file path for the clipped initial pine region raster
-        
-        # TODO OP fix filepath names (should not be ignited)
-        initial_pine_raster_path_temp = os.path.splitext(json_file_path)[0] + f"_initial_pine_temp.tif"
-        initial_pine_raster_path = os.path.splitext(json_file_path)[0] + f"_initial_pine.tif"
-
-        # Use the GDAL Clip algorithm to clip the raster using the mask
-        params = {
-            "INPUT": dtm_layer.source(),
-            "MASK": mask_layer,
-            "CROP_TO_CUTLINE": True,
-            "OUTPUT": initial_pine_raster_path_temp
-        }
-
-        # Run the clip operation
-        processing.run("gdal:cliprasterbymasklayer", params)
-
-        # Open the slope raster to get its dimensions and transform
-        with rasterio.open(dtm_layer.source()) as elevation_src:
-            elevation_height = elevation_src.height
-            elevation_width = elevation_src.width
-            elevation_transform = elevation_src.transform
-            elevation_crs = elevation_src.crs
-
-        # Open the clipped ignited raster
-        with rasterio.open(initial_pine_raster_path_temp) as initial_pine_src:
-            initial_pine_data = initial_pine_src.read(1)
-            initial_pine_transform = initial_pine_src.transform
-            initial_pine_crs = initial_pine_src.crs
-
-            # Create an empty array for the resampled initial pine raster
-            resampled_initial_pine_data = numpy.zeros((elevation_height, elevation_width), dtype=numpy.uint8)
-
-            # Resample the ignited raster to match the slope raster
-            rasterio._warp._reproject(
-                source=initial_pine_data,
-                destination=resampled_initial_pine_data,
-                src_transform=initial_pine_transform,
-                src_crs=initial_pine_crs,
-                dst_transform=elevation_transform,
-                dst_crs=elevation_crs,
-                resampling=rasterio._warp.Resampling.nearest
-            )
-
-            # Save the resampled initial pine raster
-        with rasterio.open(initial_pine_raster_path_temp, 'w', driver='GTiff', height=elevation_height, width=elevation_width,
-                        count=1, dtype=resampled_initial_pine_data.dtype, crs=elevation_crs, transform=elevation_transform) as dst:
-            dst.write(resampled_initial_pine_data, 1)
-                
-        # Use the GDAL Clip algorithm to clip the raster using the mask
-        params = {
-            "INPUT": initial_pine_raster_path_temp,
-            "MASK": mask_layer,
-            "CROP_TO_CUTLINE": True,
-            "OUTPUT": initial_pine_raster_path
-        }
-
-        # Run the clip operation
-        processing.run("gdal:cliprasterbymasklayer", params)
-
-        return initial_pine_raster_path
-
     def convert_to_json(self):
-        """Clip the selected GeoTIFFs to the drawn area, process them, and output JSON."""
+        """Prepare the scenario of the selected area in a background task and output JSON."""
         dtm_layer = self.dtm_selector.currentData()
         landcover_layer = self.landcover_selector.currentData()
 
-        if dtm_layer and landcover_layer and self.plugin.selected_region and self.plugin.selected_region.isGeosValid():
-            # json_file_path, _ = QFileDialog.getSaveFileName(self, "Save JSON File", "", "JSON Files (*.json);;All Files (*)")
-            # if not json_file_path:
-            #     print("No JSON file path provided.")
-            #     return
+        if self.prepare_task:
+            print("A simulation scenario is already being prepared.")
+            return
 
-            # Create an in-memory mask layer from the drawn polygon
-            mask_layer = createTemporaryPolygonLayer(self.plugin.selected_region)
+        if dtm_layer and landcover_layer and self.plugin.selected_region and self.plugin.selected_region.isGeosValid():
+            # Hexagonal cells need HEX_MIN_SPACING map units between them, checked before the task starts
+            spacing = dtm_layer.rasterUnitsPerPixelX() * self.resolution
+            if self.cell_layout_selector.currentData() == "hex" and spacing < HEX_MIN_SPACING:
+                self.iface.messageBar().pushWarning(
+                    "Plant Population Simulator",
+                    f"Hexagonal cells must be at least {HEX_MIN_SPACING} map units apart, they are {spacing:g} "
+                    f"at this resolution. Increase the resolution or use square cells."
+                )
+                return
 
             root = os.path.dirname(os.path.abspath(__file__))
-            #slope_path = os.path.join(root, "slope.tif") # TODO OP remove?
-            #aspect_path = os.path.join(root, "aspect.tif") # TODO OP remove?
             json_file_path = os.path.join(root, "map.json")
 
-            # Determine output file paths for the clipped rasters
-            clipped_dtm_path = os.path.splitext(json_file_path)[0] + "_dtm.tif"
-            clipped_land_path = os.path.splitext(json_file_path)[0] + "_landcover.tif"
-
-            # Use the GDAL Clip algorithm to clip the rasters using the mask
-            params_dtm = {
-                "INPUT": dtm_layer.source(),
-                "MASK": mask_layer,
-                "CROP_TO_CUTLINE": True,
-                "OUTPUT": clipped_dtm_path
-            }
-            params_land = {
-                "INPUT": landcover_layer.source(),
-                "MASK": mask_layer,
-                "CROP_TO_CUTLINE": True,
-                "OUTPUT": clipped_land_path
-            }
-
-            processing.run("gdal:cliprasterbymasklayer", params_dtm)
-            processing.run("gdal:cliprasterbymasklayer", params_land)
-
-            # Clip the initial pine region as a binary raster
-            initial_pine_raster_path = self.clip_initial_pine_region(json_file_path)
-
-
-            # TODO OP remove calculation of slope/aspect, we only need elevation so no processing needed. Might 
-            # need some processing here for soil type from sand/clay percentages but should be straight forward.
-            """
-            # Calculate slope and aspect
-            feedback = QgsProcessingFeedback()
-            processing.run("qgis:slope", {
-                "INPUT": dtm_layer,
-                "Z_FACTOR": 1.0,
-                "OUTPUT": slope_path, 
-            }, feedback=feedback)
-            processing.run("qgis:aspect", {
-                "INPUT": dtm_layer,
-                "Z_FACTOR": 1.0,
-                "OUTPUT": aspect_path, 
-            }, feedback=feedback)
-
-            slope_layer = QgsRasterLayer(slope_path, "slope")
-            aspect_layer = QgsRasterLayer(aspect_path, "aspect")
-            if not slope_layer.isValid():
-                print("Failed to load slope layer!")
-                return
-            if not aspect_layer.isValid():
-                print("Failed to load slope layer!")
-                return
-            QgsProject.instance().addMapLayer(slope_layer, False)
-            QgsProject.instance().addMapLayer(aspect_layer, False)
-            """
-
-            # Prepare paths for further processing
             paths = {
-                #"aspect": aspect_path,
-                #"slope": slope_path,
-                "dtm": clipped_dtm_path,
-                "land": clipped_land_path,
-                "initial_pine": initial_pine_raster_path,
+                "dtm": dtm_layer.source(),
+                "land": landcover_layer.source(),
                 "json": json_file_path,
+                "report": report_path_for(json_file_path),
             }
-
-            # Resample and align the landcover raster to match the slope and aspect rasters
-            with rasterio.open(paths["dtm"]) as dtm_src:
-                elevation_transform = dtm_src.transform
-                elevation_crs = dtm_src.crs
-                elevation_width = dtm_src.width
-                elevation_height = dtm_src.height
-
-            with rasterio.open(paths["land"]) as land_src:
-                land_data = land_src.read(1)
-                land_transform = land_src.transform
-                land_crs = land_src.crs
-
-                # Resample landcover to match slope raster
-                resampled_land_data = numpy.empty((elevation_height, elevation_width), dtype=numpy.float32)
-                rasterio._warp._reproject(
-                    source=land_data,
-                    destination=resampled_land_data,
-                    src_transform=land_transform,
-                    src_crs=land_crs,
-                    dst_transform=elevation_transform,
-                    dst_crs=elevation_crs,
-                    resampling=rasterio._warp.Resampling.nearest
-                )
-
-                # Save the resampled landcover raster
-                resampled_land_path = os.path.splitext(json_file_path)[0] + "_landcover_resampled.tif"
-                with rasterio.open(resampled_land_path, 'w', driver='GTiff', height=elevation_height, width=elevation_width,
-                                count=1, dtype=resampled_land_data.dtype, crs=elevation_crs, transform=elevation_transform) as dst:
-                    dst.write(resampled_land_data, 1)
-
-                paths["land"] = resampled_land_path
-
-            dump_json(paths, self)
-            print("JSON conversion completed.")
+            # Soil types are classified from the clay percentages, and the sand ones when given
+            sand_layer = self.sand_selector.currentData()
+            clay_layer = self.clay_selector.currentData()
+            if clay_layer:
+                paths["clay"] = clay_layer.source()
+                if sand_layer:
+                    paths["sand"] = sand_layer.source()
+            elif sand_layer:
+                print("No clay percentage layer selected, the soil type is left dry.")
+            if self.profile_checkbox.isChecked():
+                # Statistics for pstats or snakeviz
+                paths["profile"] = os.path.join(root, "map_profile.prof")
+
+            # Everything the task needs is read from the GUI here, the task itself runs off the main thread
+            seedings = [(json.loads(geometry.asJson()), species) for geometry, species in self.plugin.seeding_regions]
+            if not seedings:
+                print("No initial tree area selected.")
+            self.prepare_task = PrepareScenarioTask(
+                paths,
+                json.loads(self.plugin.selected_region.asJson()),
+                seedings,
+                QgsProject.instance().crs().toWkt(),
+                self.resolution,
+                self.on_scenario_prepared,
+                DiskCache(os.path.join(root, "cache")),
+                self.warm_start_checkbox.isChecked(),
+                self.cell_layout_selector.currentData(),
+                self.memory_budget_input.value() * 2**20 or None
+            )
+            self.convert_button.setEnabled(False)
+            self.cancel_convert_button.setEnabled(True)
+            QgsApplication.taskManager().addTask(self.prepare_task)
         else:
             #print(self.plugin.selected_region.isGeosValid())
             print("No valid layers or selected region. Cannot convert to JSON.")
 
-    def open_results_csv(self):
-        # Path to the CSV file
-        root = os.path.dirname(os.path.abspath(__file__))
-        csv_path = os.path.join(root, "plant_population_out.csv")
-
-        # Define the vector layer with temporal properties
-        layer = QgsVectorLayer("Point?crs=EPSG:4326", "TemporalLayer", "memory")
-        provider = layer.dataProvider()
-
-        # Define fields: Time Step, Height
-        fields = QgsFields()
-        fields.append(QgsField("time_step", QVariant.Int))
-        fields.append(QgsField("height", QVariant.Int))
-
-        provider.addAttributes(fields)
-        layer.updateFields()
-
-        # Read and process the CSV
-        with open(csv_path, "r") as file:
-            line_count = 0
-            for line in file:
-                if line_count < 2:
-                    line_count += 1
-                    continue
-                parts = line.strip().split(";")
+    def cancel_convert(self):
+        """Cancel the scenario preparation in progress."""
+        if self.prepare_task:
+            self.prepare_task.cancel()
+
+    def on_scenario_prepared(self, task, result):
+        """Re-enable the scenario preparation once the background task is done."""
+        self.prepare_task = None
+        self.convert_button.setEnabled(True)
+        self.cancel_convert_button.setEnabled(False)
+        if result:
+            print("JSON conversion completed.")
 
-                if len(parts) < 5:
-                    continue  # Ensure correct formatting
+    def results_log_path(self):
+        """
+        Return the log of the last simulation run, or the one a run from the plugin folder writes
+        (see run_simulation), or None with a message when there is no log to show yet.
+        """
+        root = os.path.dirname(os.path.abspath(__file__))
+        csv_path = self.last_log_path or os.path.join(root, LOG_PATH)
+        if not os.path.exists(csv_path):
+            print(f"No simulation results at {csv_path}. Please run the simulation first.")
+            return None
+        return csv_path
 
-                # Extract time step
-                time_step = int(parts[0])
+    def open_results_csv(self):
+        root = os.path.dirname(os.path.abspath(__file__))
+        csv_path = self.results_log_path()
+        if not csv_path:
+            return
 
-                # Extract coordinates
-                coords = parts[2].split("_")
-                point = QgsPointXY(float(coords[0]), float(coords[1]))
+        # One feature per cell, showing the grid rebuilt from the change timeline of every cell at the
+        # current frame of the temporal controller. The timeline is read from the binary store of the log,
+        # or from one of its reduced levels of detail when the map is zoomed out (see show_results_level).
+        timer = StageTimer(RESULTS_STAGES)
+        with timer.stage("store"):
+            store = open_store(csv_path)
+            timer.count(log_bytes=os.path.getsize(csv_path), log_rows=len(store), cells=len(store.cells))
+        with timer.stage("levels"):
+            self.results_levels = open_levels(store, every=self.results_every_input.value())
+            self.results_timelines = {}
+            self.results_spacing = min(cell_spacing(numpy.asarray(store.cells))) if len(store.cells) else 1
+            timer.count(levels=len(self.results_levels), overview_rows=len(self.results_levels[-1]))
+        canvas = self.plugin.iface.mapCanvas()
+        with timer.stage("timeline"):
+            level = level_for_scale(self.results_spacing, self.results_units_per_pixel())
+            timeline = self.results_timeline(level)
+            timer.count(level=level, changes=timeline.change_count(), times=len(timeline.times))
+        with timer.stage("layer"):
+            # The frames of the temporal controller now show the new layer only
+            if self.results_layer:
+                self.results_layer.unfollow()
+            self.results_layer = CellResultsLayer("TemporalLayer", self.results_crs())
+            # Frames of the logged times kept at full detail
+            self.results_layer.set_timeline(timeline, numpy.asarray(self.results_levels[0].times))
+            self.results_layer.follow(canvas.temporalController())
+            self.results_level = level
+
+            # Add to QGIS project
+            QgsProject.instance().addMapLayer(self.results_layer.layer)
+            timer.count(features=self.results_layer.layer.featureCount())
+
+        logStageDetails("Results loaded", timer)
+        timer.write_report(report_path_for(os.path.join(root, "map.json")), "results", log=csv_path)
+
+    def results_timeline(self, level):
+        """Return the timeline of a level of detail of the results, reading its store once."""
+        if level not in self.results_timelines:
+            self.results_timelines[level] = CellTimeline.from_store(self.results_levels[level])
+        return self.results_timelines[level]
+
+    def results_units_per_pixel(self):
+        """
+        Return the map units per screen pixel at the centre of the map canvas in the CRS of the cell
+        coordinates (see results_crs), the one the cell spacing of the results is measured in.
+        """
+        canvas = self.plugin.iface.mapCanvas()
+        units_per_pixel = canvas.mapUnitsPerPixel()
+        dtm_layer = self.dtm_selector.currentData()
+        canvas_crs = canvas.mapSettings().destinationCrs()
+        if not dtm_layer or dtm_layer.crs() == canvas_crs:
+            return units_per_pixel
+
+        # Width of a one-pixel square of the canvas once transformed into the CRS of the cells
+        center = canvas.center()
+        pixel = QgsRectangle(center.x(), center.y(), center.x() + units_per_pixel, center.y() + units_per_pixel)
+        to_cells = QgsCoordinateTransform(canvas_crs, dtm_layer.crs(), QgsProject.instance())
+        try:
+            pixel = to_cells.transformBoundingBox(pixel)
+        except QgsCsException:
+            return units_per_pixel
+        return pixel.width() or units_per_pixel
+
+    def show_results_level(self, scale):
+        """Show the level of detail of the results fitting the map scale, when it is not the one shown."""
+        layer = self.results_layer
+        if not layer or not self.results_levels or QgsProject.instance().mapLayer(layer.layer_id) is None:
+            return
+        level = level_for_scale(self.results_spacing, self.results_units_per_pixel())
+        if level != self.results_level:
+            self.results_level = level
+            layer.set_timeline(self.results_timeline(level), layer.frame_times)
+
+    def export_results_rasters(self):
+        """
+        Export the results as a raster stack per field on the grid of the scenario (a band per logged
+        time, see export.write_stacks), and play the height and species stacks back as temporal raster
+        layers, each frame of the temporal controller showing the band of one time step. Before QGIS
+        3.38, the results are exported as a GeoTIFF per frame (see export.write_frames) instead, loaded
+        as a group of layers per field, each showing its frame over the range of its time step.
+        """
+        # Imported here, as it loads rasterio
+        from .export import FRAME_FIELDS, export_results
 
-                # Extract the fifth value inside "< >"
-                values = parts[4].strip("<>").split(",")
-                height = int(values[4])  # Index starts at 0
+        root = os.path.dirname(os.path.abspath(__file__))
+        csv_path = self.results_log_path()
+        if not csv_path:
+            return
+        dtm_layer = self.dtm_selector.currentData()
+        if not dtm_layer:
+            print("Please select the elevation layer the scenario was prepared from.")
+            return
 
-                # Create feature
-                feature = QgsFeature()
-                feature.setGeometry(QgsGeometry.fromPointXY(point))
-                feature.setAttributes([time_step, height])
+        # Grid of the prepared scenario, from its run report
+        report_path = report_path_for(os.path.join(root, "map.json"))
+        inputs = {}
+        if os.path.exists(report_path):
+            with open(report_path, "r") as f:
+                inputs = json.load(f).get("prepare", {}).get("inputs", {})
+
+        per_band = Qgis.QGIS_VERSION_INT >= FIXED_RANGE_PER_BAND_VERSION
+        timer = StageTimer(EXPORT_STAGES)
+        with timer.stage("store"):
+            store = open_store(csv_path)
+            timer.count(log_rows=len(store), cells=len(store.cells), times=len(store.times))
+        with timer.stage("export"):
+            directory = os.path.join(root, "results_rasters")
+            paths = export_results(store, dtm_layer.source(), inputs.get("resolution", self.resolution), directory,
+                                   inputs.get("layout", "square"), "gtiff" if per_band else "frames")
+            timer.count(output_bytes=sum(os.path.getsize(path) for path in paths))
+        with timer.stage("layers"):
+            start = QDateTime(QDate(2000, 1, 1), QTime(0, 0), Qt.UTC)
+            ranges = [QgsDateTimeRange(start.addSecs(i), start.addSecs(i + 1), True, False)
+                      for i in range(len(store.times))]
+            project = QgsProject.instance()
+            for name in EXPORT_LAYER_FIELDS:
+                if per_band:
+                    layer = QgsRasterLayer(os.path.join(directory, name + ".tif"), f"Results {name}")
+                    properties = layer.temporalProperties()
+                    properties.setMode(Qgis.RasterTemporalMode.FixedRangePerBand)
+                    properties.setFixedRangePerBand(dict(enumerate(ranges, 1)))
+                    properties.setIsActive(True)
+                    project.addMapLayer(layer)
+                    continue
+                group = project.layerTreeRoot().insertGroup(0, f"Results {name}")
+                for i, (path, time_range) in enumerate(zip(paths, ranges)):
+                    layer = QgsRasterLayer(path, f"{name} {i}")
+                    layer.setRenderer(QgsSingleBandGrayRenderer(layer.dataProvider(), FRAME_FIELDS.index(name) + 1))
+                    layer.setDefaultContrastEnhancement()
+                    properties = layer.temporalProperties()
+                    properties.setMode(Qgis.RasterTemporalMode.FixedTemporalRange)
+                    properties.setFixedTemporalRange(time_range)
+                    properties.setIsActive(True)
+                    project.addMapLayer(layer, False)
+                    group.addLayer(layer)
+
+            # Same frames as the point results layer: one second per logged time
+            navigation = self.plugin.iface.mapCanvas().temporalController()
+            navigation.setTemporalExtents(QgsDateTimeRange(start, start.addSecs(max(1, len(store.times)))))
+            navigation.setFrameDuration(QgsInterval(1))
+            navigation.setNavigationMode(QgsTemporalNavigationObject.Animated)
+
+        logStageDetails("Results exported", timer)
+        timer.write_report(report_path, "export", log=csv_path, directory=directory)
+
+    def results_crs(self):
+        """Return the CRS of the cell coordinates (the one of the selected elevation layer)."""
+        dtm_layer = self.dtm_selector.currentData()
+        return dtm_layer.crs().authid() if dtm_layer else "EPSG:4326"
 
-                # Add feature to layer
-                provider.addFeatures([feature])
+    def run_simulation(self):
+        """Launch the simulator on the prepared scenario and show its results while it runs."""
+        if self.simulation_run and self.simulation_run.is_running():
+            print("The simulation is already running.")
+            return
 
-        layer.updateExtents()
+        root = os.path.dirname(os.path.abspath(__file__))
+        json_file_path = os.path.join(root, "map.json")
+        if not os.path.exists(json_file_path):
+            print("No simulation scenario. Please prepare the simulation scenario first.")
+            return
 
-        # Enable temporal properties
-        layer.setTemporalPropertiesDefinition({
-            "startField": "time_step",
-            "endField": "time_step",
-            "mode": 0  # Discrete temporal mode
-        })
+        executable = os.path.join(root, "plant_population.exe")
+        self.simulation_run = SimulationRun(executable, json_file_path, self.sim_time_input.value(), root)
+        try:
+            self.simulation_run.start()
+        except OSError as e:
+            print(f"Failed to launch the simulator: {e}")
+            self.simulation_run = None
+            return
 
-        # Add to QGIS project
-        QgsProject.instance().addMapLayer(layer)
+        # This layer shows the latest state of every cell as the simulator logs them
+        self.live_layer = CellResultsLayer("SimulationResults", self.results_crs())
+        QgsProject.instance().addMapLayer(self.live_layer.layer)
+
+        self.run_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.run_timer.start()
+        print(f"Simulation started for {self.sim_time_input.value()} time units.")
+
+    def stop_simulation(self):
+        """Terminate the running simulation; the results logged so far are kept."""
+        if self.simulation_run:
+            self.simulation_run.stop()
+            self.poll_simulation()
+
+    def poll_simulation(self):
+        """Add the newly logged time steps to the results layer and detect the end of the run."""
+        run = self.simulation_run
+        if not run:
+            return
+        running = run.is_running()
+        columns = state_rows(run.read_rows())
+        if row_count(columns) and self.live_layer:
+            self.live_layer.apply_rows(columns)
+        if not running:
+            self.on_cadmium_finish_running(run.log_path)
 
     def on_cadmium_finish_running(self, csv_path):
-        uri = f"file:///{csv_path}?delimiter=,&xField=x&yField=y&crs=EPSG:2959"
-        # TODO OP load plant population output csv instead of "ignition"
-        layer = QgsVectorLayer(uri, "ignition", "delimitedtext")
-        if not layer.isValid():
-            print("Failed to load layer!")
-            return
-        QgsProject.instance().addMapLayer(layer)
-        props = layer.temporalProperties()
-        props.setIsActive(True)
-        props.setAccumulateFeatures(True)
-        props.setMode(QgsVectorLayerTemporalProperties.TemporalMode.ModeFeatureDateTimeInstantFromField)
-        props.setStartField("time")
+        """Finalize the results layer once the simulator has exited."""
+        self.run_timer.stop()
+        self.run_button.setEnabled(True)
+        self.stop_button.setEnabled(False)
+        returncode = self.simulation_run.returncode
+        self.simulation_run = None
+        self.last_log_path = csv_path
+        if self.live_layer:
+            self.live_layer.layer.updateExtents()
+            self.live_layer.layer.triggerRepaint()
+        if returncode == 0:
+            # Convert the log once so that displaying and analysing the results don't parse it again
+            build_store(csv_path)
+            message = f"Simulation finished, results logged to {csv_path}"
+            QgsMessageLog.logMessage(message, "Plant Population Simulator", Qgis.Info)
+        else:
+            message = f"Simulation ended with exit code {returncode}, see {csv_path}"
+            QgsMessageLog.logMessage(message, "Plant Population Simulator", Qgis.Warning)
+        print(message)
+
+class PrepareScenarioTask(QgsTask):
+    """Background task running the scenario preparation pipeline with per-stage progress."""
+
+    def __init__(self, paths, region, seedings, geometry_crs, resolution, on_finished, cache=None, warm_start=False,
+                 layout="square", memory_budget=None):
+        super(PrepareScenarioTask, self).__init__("Prepare simulation scenario", QgsTask.CanCancel)
+        self.paths = paths
+        self.region = region
+        self.seedings = seedings
+        self.geometry_crs = geometry_crs
+        self.resolution = resolution
+        self.on_finished = on_finished
+        self.cache = cache
+        self.warm_start = warm_start
+        self.cell_layout = layout
+        self.memory_budget = memory_budget
+        self.timer = None
+        self.exception = None
 
+    def run(self):
+        try:
+            self.timer = prepare_scenario(
+                self.paths,
+                self.region,
+                self.seedings,
+                self.geometry_crs,
+                self.resolution,
+                progress=self.report_progress,
+                is_canceled=self.isCanceled,
+                cache=self.cache,
+                warm_start=self.warm_start,
+                layout=self.cell_layout,
+                memory_budget=self.memory_budget
+            )
+        except Canceled:
+            return False
+        except Exception as e:
+            self.exception = e
+            return False
+        return True
+
+    def report_progress(self, stage, percent):
+        self.setDescription(f"Prepare simulation scenario ({stage})")
+        self.setProgress(percent)
+
+    def finished(self, result):
+        if result:
+            message = f"Scenario saved to {self.paths['json']} ({self.timer.summary()})"
+            QgsMessageLog.logMessage(message, "Plant Population Simulator", Qgis.Info)
+            logStageDetails("Scenario preparation", self.timer)
+        elif self.exception:
+            message = f"Scenario preparation failed: {self.exception}"
+            QgsMessageLog.logMessage(message, "Plant Population Simulator", Qgis.Critical)
+        else:
+            message = "Scenario preparation canceled."
+            QgsMessageLog.logMessage(message, "Plant Population Simulator", Qgis.Warning)
+        print(message)
+        self.on_finished(self, result)
 
+class CellResultsLayer:
+    """
+    Results layer with one point feature per cell. Its attributes show the state of the grid at one
+    time: the frame of the temporal controller it follows (see set_timeline and follow), or the
+    latest logged state while a simulation runs (see apply_rows). Only changed cells are updated.
+    """
+
+    def __init__(self, name, crs):
+        self.layer = createResultsLayer(name, crs)
+        self.layer_id = self.layer.id()  # Still known once the layer is deleted
+        self.feature_ids = {}  # (x, y) -> feature id
+        self.timeline = None
+        self.timeline_ids = None
+        self.frame_times = None
+        self.shown = None
+        self.navigation = None
+
+    def add_cells(self, cells):
+        """Add a feature for each (x, y) cell not in the layer yet, without attributes."""
+        keys = [cell for cell in map(tuple, cells.tolist()) if cell not in self.feature_ids]
+        features = []
+        for x, y in keys:
+            feature = QgsFeature(self.layer.fields())
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            features.append(feature)
+        if features:
+            # The provider sets the ids of the added features
+            _, added = self.layer.dataProvider().addFeatures(features)
+            for key, feature in zip(keys, added):
+                self.feature_ids[key] = feature.id()
+            self.layer.updateExtents()
+
+    def set_values(self, feature_ids, time_step, height, tree_type):
+        """Set the attributes of features (None for cells without a state at the time shown)."""
+        fields = self.layer.fields()
+        indices = [fields.indexOf(name) for name in ("time_step", "height", "tree_type")]
+        changes = {}
+        for fid, values in zip(feature_ids, zip(time_step, height, tree_type)):
+            changes[fid] = dict(zip(indices, values))
+        if changes:
+            self.layer.dataProvider().changeAttributeValues(changes)
+            self.layer.triggerRepaint()
+
+    def clear(self):
+        """Remove every feature."""
+        if self.feature_ids:
+            self.layer.dataProvider().deleteFeatures(list(self.feature_ids.values()))
+            self.feature_ids = {}
+            self.layer.updateExtents()
+
+    def set_timeline(self, timeline, frame_times=None):
+        """
+        Show the cells of a CellTimeline instead of the ones shown, at the current frame (the first
+        one before following a temporal controller). The frames show the times of frame_times, the
+        times of the timeline by default (see follow).
+        """
+        self.clear()
+        self.timeline = timeline
+        self.frame_times = timeline.times if frame_times is None else frame_times
+        self.add_cells(timeline.cells)
+        self.timeline_ids = [self.feature_ids[cell] for cell in map(tuple, timeline.cells.tolist())]
+        self.shown = None
+        if len(self.frame_times):
+            self.show_time(self.frame_times[self.current_frame()])
+
+    def show_time(self, time):
+        """Show the grid at a time, updating only the cells whose state differs from the one shown."""
+        present, state = self.timeline.state_at(time)
+        shown = numpy.stack((present, state["tree_height"], state["tree_type"]), axis=1)
+        changed = numpy.ones(len(shown), dtype=bool) if self.shown is None else (shown != self.shown).any(axis=1)
+        self.shown = shown
+        cells = numpy.flatnonzero(changed)
+        time_step = [int(time) if present[i] else None for i in cells]
+        height = [int(state["tree_height"][i]) if present[i] else None for i in cells]
+        tree_type = [int(state["tree_type"][i]) if present[i] else None for i in cells]
+        self.set_values([self.timeline_ids[i] for i in cells], time_step, height, tree_type)
+
+    def follow(self, navigation):
+        """
+        Make every frame of a temporal navigation object show one of the frame times (see set_timeline),
+        until unfollow is called or the layer is removed from the project.
+        """
+        self.unfollow()
+        self.navigation = navigation
+        start = QDateTime(QDate(2000, 1, 1), QTime(0, 0), Qt.UTC)
+        navigation.setTemporalExtents(QgsDateTimeRange(start, start.addSecs(max(1, len(self.frame_times)))))
+        navigation.setFrameDuration(QgsInterval(1))
+        navigation.setNavigationMode(QgsTemporalNavigationObject.Animated)
+        navigation.updateTemporalRange.connect(self.on_temporal_range)
+        self.layer.willBeDeleted.connect(self.unfollow)
+        QgsProject.instance().layerWillBeRemoved.connect(self.on_layer_removed)
+
+    def unfollow(self):
+        """Stop following the temporal navigation object followed, if any."""
+        if not self.navigation:
+            return
+        for signal, slot in ((self.navigation.updateTemporalRange, self.on_temporal_range),
+                             (QgsProject.instance().layerWillBeRemoved, self.on_layer_removed)):
+            try:
+                signal.disconnect(slot)
+            except TypeError:
+                pass  # Already disconnected
+        self.navigation = None
+
+    def on_layer_removed(self, layer_id):
+        if layer_id == self.layer_id:
+            self.unfollow()
+
+    def current_frame(self):
+        """Return the frame of the temporal controller followed (0 before following one)."""
+        if not self.navigation:
+            return 0
+        return min(max(self.navigation.currentFrameNumber(), 0), len(self.frame_times) - 1)
+
+    def on_temporal_range(self, temporal_range):
+        if not self.navigation or not len(self.frame_times):
+            return
+        self.show_time(self.frame_times[self.current_frame()])
+
+    def apply_rows(self, columns):
+        """Show the last state logged for each cell in parsed log columns holding cell state rows."""
+        cells, _, cell_rows, cell_offsets = group_cells(columns["x"], columns["y"])
+        self.add_cells(cells)
+        last = cell_rows[cell_offsets[1:] - 1]
+        self.set_values(
+            [self.feature_ids[cell] for cell in map(tuple, cells.tolist())],
+            columns["time"][last].astype(numpy.int64).tolist(),
+            columns["tree_height"][last].tolist(),
+            columns["tree_type"][last].tolist()
+        )
 
 class RegionSelectionTool(QgsMapToolEmitPoint):
-    def __init__(self, iface, plugin, rubber_band, is_pine_region=False):
+    def __init__(self, iface, plugin, rubber_band, is_seeding_region=False):
         super(RegionSelectionTool, self).__init__(iface.mapCanvas())
         self.points = []  # List to store clicked QgsPointXY objects
         self.plugin = plugin
         self.rubber_band = rubber_band
-        # TODO OP will likely need to change boolean flag to enum for tree types
-        self.is_pine_region = is_pine_region  # Flag to indicate if this is for the initial pine region
+        # Initial tree areas take the species selected in the dock widget when they are added
+        self.is_seeding_region = is_seeding_region  # Flag to indicate if this is for an initial tree area
 
     def canvasPressEvent(self, event):
         point = self.toMapCoordinates(event.pos())
 
 
-        # TODO will need to expand this if-state to check new enum for tree type regions
-        # If this is for the initial pine region, enforce the selected region constraint
-        if self.is_pine_region:
+        # If this is for an initial tree area, enforce the selected region constraint
+        if self.is_seeding_region:
             if not self.plugin.selected_region or not self.plugin.selected_region.contains(point):
                 print("Point is outside the selected region. Ignoring.")
                 return
@@ -576,11 +917,10 @@ class RegionSelectionTool(QgsMapToolEmitPoint):
         # Automatically close the polygon if the user clicks near the first point
         if len(self.points) > 2 and self.is_near_first_point(point):
             self.points.append(self.points[0])
-            # TODO can we check which region in a better way? If no then just change to tree type enum
-            if self.is_pine_region:
-                self.plugin.initial_pine_region = QgsGeometry.fromPolygonXY([self.points])
-                print("Polygon closed and initial pine region set.")
-                print(f"Initial pine region geometry: {self.plugin.initial_pine_region.asWkt()}")  # Debug print
+            if self.is_seeding_region:
+                self.plugin.add_seeding_region(QgsGeometry.fromPolygonXY([self.points]))
+                print("Polygon closed and initial tree area set.")
+                self.points = []
             else:
                 self.plugin.selected_region = QgsGeometry.fromPolygonXY([self.points])
                 print("Polygon closed and selected region set.")
@@ -598,10 +938,16 @@ class RegionSelectionTool(QgsMapToolEmitPoint):
         return dist <= tolerance
 
     def highlight_region(self):
-        """Highlight the drawn polygon on the map."""
-        self.rubber_band.reset()
+        """Highlight the drawn polygon on the map (and the initial tree areas already added)."""
+        self.rubber_band.reset(QgsWkbTypes.PolygonGeometry)
+        part = 0
+        if self.is_seeding_region:
+            for geometry, _ in self.plugin.plugin.seeding_regions:
+                self.rubber_band.addGeometry(geometry, None)
+            part = self.rubber_band.numberOfParts()
+        # The polygon being drawn is a new part after the added areas
         for p in self.points:
-            self.rubber_band.addPoint(p)
+            self.rubber_band.addPoint(p, True, part)
 
     def clear_highlight(self):
         """Clear the drawn polygon from the map."""
@@ -612,162 +958,22 @@ class RegionSelectionTool(QgsMapToolEmitPoint):
 # HELPER FUNCTIONS
 #########################
 
-def createTemporaryPolygonLayer(geometry):
-    """
-    Creates an in-memory vector layer (Polygon) with the given geometry.
-    This layer will be used as a mask for clipping.
-    """
-    crs = QgsProject.instance().crs().authid()
-    mem_layer = QgsVectorLayer(f"Polygon?crs={crs}", "mask", "memory")
-    prov = mem_layer.dataProvider()
-    feat = QgsFeature()
-    feat.setGeometry(geometry)
-    prov.addFeatures([feat])
-    mem_layer.updateExtents()
-    return mem_layer
-
-def read_raster(path):
-    """Read a raster file and return its data and metadata."""
-    with rasterio.open(path) as src:
-        data = src.read(1)  # Read the first band
-        transform = src.transform
-        crs = src.crs
-        return data, transform, crs
-
-def dump_json(paths, widget):
-    """Read raster data and populate the JSON file."""
-    # Read raster data
-    #slope_data, elevation_transform, _ = read_raster(paths['slope'])
-    #aspect_data, _, _ = read_raster(paths['aspect'])
-    dtm_data, elevation_transform, _ = read_raster(paths['dtm'])
-    landcover_data, _, _ = read_raster(paths['land'])
-    initial_pine_data, _, _ = read_raster(paths['initial_pine']) if paths.get('initial_pine') else (None, None, None)        
-
-    resolution = widget.resolution
-
-    # Get dimensions
-    height, width = initial_pine_data.shape
-    print(str(height) + " : " + str(width))
-
-    # Initialize JSON structure
-    data = {
-        "cells": {
-            "default": {
-                "delay": "inertial",
-                "model": "plant_population",
-                "state": { 
-                    "current_resources" : {
-                    "water" : 0,
-                    "sunlight" : 0,
-                    "nitrogen" : 0,
-                    "potassium" : 0
-                    },
-                    "soil_type": 0,
-                    "elevation": 0,
-                    "tree_height" : 0,
-                    "tree_type" : 0
-                }            
-            }
-        }
-    }
-
-    # TODO: hexagonal grid is broken
-
-    # shift = 0
-
-    # Iterate over each cell
-    # y_resolution = int(resolution / 2 * 1.1547)
-    # x_resolution = int(resolution * 2)
-    # for row in range(0, height, y_resolution):
-    #     for col in range(0, width, x_resolution):
-    for row in range(0, height, resolution):
-        for col in range(0, width, resolution):
-            # Get values from rasters
-            #slope_value = slope_data[row][col]
-            #aspect_value = aspect_data[row][col]
-            dtm_value = dtm_data[row][col]
-            landcover_value = landcover_data[row][col]
-            initial_pine_value = initial_pine_data[row][col] if initial_pine_data is not None else 0
-            
-            #print("row: " + str(row) + " ; col: " + str(col) + " ; ignited: " + str(initial_pine_value))
-
-            # Skip invalid values
-            #if slope_value <= -9999.0 or aspect_value <= -9999.0:
-            #    continue
-
-            # Get cell coordinates
-            x, y = elevation_transform * (col, row)
-            # if shift % 2:
-            #     x += int(x_resolution / 2)
-            cell_name = f"{int(x)}_{int(y)}"
-
-            # Map landcover value to fuel model
-            try:
-                fuel = FUELS[int(landcover_value)]
-            except KeyError:
-                continue
-
-            if (dtm_value < 0):
-                continue
-
-            # Set ignited to true or false based on the ignited raster
-            initial_pine = bool(initial_pine_value) if initial_pine_data is not None else False
-
-            tree_type = 1 if initial_pine else 0
-
-            # Add cell to JSON
-            data["cells"][cell_name] = {
-                "state": { 
-                    "current_resources" : {
-                        "water" : 0,
-                        "sunlight" : 0,
-                        "nitrogen" : 0,
-                        "potassium" : 0
-                    },
-                    "soil_type": 0,
-                    "elevation": int(dtm_value),
-                    "tree_height" : 0,
-                    "tree_type" : int(tree_type)
-                },
-                "neighborhood": {}
-            }
-        
-            # Add neighborhood logic (unchanged)
-            # if not shift % 2:
-            #     neighborhood = [(0, -2), (0, -1), (0, 1), (0, 2), (-1, -1), (-1, 1)]
-            # else:
-            #     neighborhood = [(0, -2), (0, -1), (0, 1), (0, 2), (1, -1), (1, 1)]
-            neighborhood = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-            for neighbor in neighborhood:
-                # c = col + neighbor[0] * x_resolution
-                # r = row + neighbor[1] * y_resolution
-                c = col + (neighbor[0] * resolution)
-                r = row + (neighbor[1] * resolution)
-
-                # Skip out-of-bounds neighbors
-                if c < 0 or r < 0 or c >= width or r >= height:
-                    continue
-
-                try:
-                    fuel = FUELS[int(landcover_data[r][c])]
-                except KeyError:
-                    continue
-
-                if (dtm_data[r][c] < 0):
-                    continue
-
-                # Get neighbor coordinates
-                neighbor_x, neighbor_y = elevation_transform * (c, r)
-                # if not shift % 2 and abs(neighbor[1]) == 1:
-                #     neighbor_x += int(x_resolution / 2)
-                neighbor_name = f"{int(neighbor_x)}_{int(neighbor_y)}"
-
-                # Add neighbor to neighborhood
-                data["cells"][cell_name]["neighborhood"][neighbor_name] = resolution
-        # shift += 1
-        
-
-    # Write JSON to file
-    with open(paths['json'], "w") as f:
-        json.dump(data, f, indent=4)
-    print(f"JSON file saved to: {paths['json']}")
+def createResultsLayer(name, crs):
+    """Create an in-memory point layer for simulation results (time step, tree height and tree type per cell)."""
+    layer = QgsVectorLayer(f"Point?crs={crs}", name, "memory")
+    provider = layer.dataProvider()
+
+    # Define fields: Time Step, Height, Tree Type
+    fields = QgsFields()
+    fields.append(QgsField("time_step", QVariant.Int))
+    fields.append(QgsField("height", QVariant.Int))
+    fields.append(QgsField("tree_type", QVariant.Int))
+
+    provider.addAttributes(fields)
+    layer.updateFields()
+    return layer
+
+def logStageDetails(title, timer):
+    """Log the time, peak RSS and counts of every stage of a StageTimer to the QGIS message log."""
+    for line in timer.details():
+        QgsMessageLog.logMessage(f"{title} - {line}", "Plant Population Simulator", Qgis.Info)
@@ -0,0 +1,205 @@
+import json
+import math
+
+import numpy
+import rasterio
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.features import bounds, geometry_window, rasterize
+from rasterio.warp import reproject, transform_geom
+from rasterio.windows import Window
+
+from .scenario import ELEVATION_RESAMPLING, classify_soil
+
+# Resampling policies for reading a raster at the cell size
+RESAMPLING = {name: Resampling[method] for name, method in ELEVATION_RESAMPLING.items()}
+
+# Landcover value given to pixels outside the selected region or without data (not a FUELS class)
+LANDCOVER_NODATA = 0
+
+#########################
+# ALIGNED EXTRACTION
+#########################
+
+class AlignedRasters:
+    """Rasters of the selected region on the DTM grid, held in memory."""
+
+    def __init__(self, dtm, landcover, initial_species, region, transform, crs, step=1, soil_type=None):
+        self.dtm = dtm                          # float32 elevation, NaN where the DTM has no data
+        self.landcover = landcover              # landcover class, LANDCOVER_NODATA outside the region
+        self.initial_species = initial_species  # uint8 treeSpecies seeded in every cell, 0 for none
+        self.soil_type = soil_type              # uint8 soilType of every cell, None without soil rasters
+        self.region = region                # bool, True inside the selected region
+        self.transform = transform          # transform of the DTM pixels of the region's window
+        self.crs = crs
+        self.step = step                    # DTM pixels covered by one array element along each axis
+
+    @property
+    def shape(self):
+        return self.dtm.shape
+
+    @property
+    def cell_transform(self):
+        """Transform of the array elements."""
+        return self.transform * Affine.scale(self.step)
+
+def to_raster_crs(geometry, geometry_crs, raster_crs):
+    """Return a GeoJSON geometry expressed in the CRS of the raster."""
+    if geometry_crs is None or rasterio.crs.CRS.from_user_input(geometry_crs) == raster_crs:
+        return geometry
+    return transform_geom(geometry_crs, raster_crs, geometry)
+
+def rasterize_species(seedings, shape, transform):
+    """
+    Burn (GeoJSON polygon, treeSpecies) seedings into one uint8 species array of the given grid in a
+    single pass, 0 outside every polygon. Where polygons overlap, the last one wins.
+    """
+    if not seedings:
+        return numpy.zeros(shape, dtype=numpy.uint8)
+    return rasterize(seedings, out_shape=shape, transform=transform, fill=0, dtype=numpy.uint8)
+
+def rasterize_mask(geometry, shape, transform):
+    """Burn a GeoJSON polygon into a bool mask of the given grid (pixel centres inside the polygon)."""
+    return rasterize([(geometry, 1)], out_shape=shape, transform=transform, fill=0, dtype=numpy.uint8).astype(bool)
+
+def read_resampled(src, destination, transform, crs, resampling, nodata):
+    """Warp the first band of an open raster onto the destination grid, reading only what the grid covers."""
+    reproject(
+        source=rasterio.band(src, 1),
+        destination=destination,
+        dst_transform=transform,
+        dst_crs=crs,
+        dst_nodata=nodata,
+        resampling=RESAMPLING[resampling]
+    )
+    return destination
+
+def region_window(dtm_src, region, resolution=1):
+    """
+    Return the window of an open DTM covering a region (in the DTM CRS), the transform of its pixels
+    and the shape of its grid of `resolution` x `resolution` DTM pixels.
+    """
+    window = geometry_window(dtm_src, [region])
+    # Cells are anchored on the upper-left DTM pixel they cover, like the strided sampling
+    shape = (math.ceil(window.height / resolution), math.ceil(window.width / resolution))
+    return window, dtm_src.window_transform(window), shape
+
+def region_grid(dtm_path, region, geometry_crs=None, resolution=1):
+    """Return the shape of the grid read_region reads a region on, and the transform of its DTM pixels, without reading it."""
+    with rasterio.open(dtm_path) as dtm_src:
+        _, transform, shape = region_window(dtm_src, to_raster_crs(region, geometry_crs, dtm_src.crs), resolution)
+    return shape, transform
+
+def read_region(dtm_path, region, geometry_crs=None, resolution=1, elevation_resampling="mean", rows=None):
+    """
+    Read the DTM over the bounding box of the selected region (a GeoJSON geometry, in geometry_crs or
+    the DTM CRS), decimated to one value per `resolution` x `resolution` DTM pixels with the
+    elevation_resampling policy (see RESAMPLING). Memory therefore scales with the number of cells,
+    not with the number of source pixels. With rows, a slice of the rows of that grid, only these
+    rows are read (see blocks). The landcover and initial species layers are left empty until
+    align_region and seed_region.
+    """
+    with rasterio.open(dtm_path) as dtm_src:
+        crs = dtm_src.crs
+        region = to_raster_crs(region, geometry_crs, crs)
+        window, transform, shape = region_window(dtm_src, region, resolution)
+        start, stop, _ = (slice(None) if rows is None else rows).indices(shape[0])
+        shape = (stop - start, shape[1])
+        transform = transform * Affine.translation(0, start * resolution)
+
+        cell_transform = transform * Affine.scale(resolution)
+        if resolution == 1:
+            window = Window(window.col_off, window.row_off + start, window.width, shape[0])
+            dtm = dtm_src.read(1, window=window, masked=True).astype(numpy.float32).filled(numpy.nan)
+        else:
+            dtm = numpy.full(shape, numpy.nan, dtype=numpy.float32)
+            read_resampled(dtm_src, dtm, cell_transform, crs, elevation_resampling, numpy.nan)
+
+    region_mask = rasterize_mask(region, shape, cell_transform)
+    return AlignedRasters(dtm, None, None, region_mask, transform, crs, resolution)
+
+def read_mean(path, rasters):
+    """Read a raster onto the cell grid of AlignedRasters as the float32 mean of every cell, NaN without data."""
+    with rasterio.open(path) as src:
+        values = numpy.full(rasters.shape, numpy.nan, dtype=numpy.float32)
+        return read_resampled(src, values, rasters.cell_transform, rasters.crs, "mean", numpy.nan)
+
+def align_region(rasters, landcover_path, sand_path=None, clay_path=None):
+    """
+    Warp the landcover (nearest) onto the grid of read_region. With the sand and clay percentage
+    rasters (the sand one is optional), the soil type of every cell is classified from their means
+    over the cell (see scenario.classify_soil).
+    """
+    with rasterio.open(landcover_path) as land_src:
+        landcover = numpy.full(rasters.shape, LANDCOVER_NODATA, dtype=land_src.dtypes[0])
+        read_resampled(land_src, landcover, rasters.cell_transform, rasters.crs, "nearest", LANDCOVER_NODATA)
+    landcover[~rasters.region] = LANDCOVER_NODATA
+    rasters.landcover = landcover
+
+    if clay_path:
+        clay = read_mean(clay_path, rasters)
+        sand = read_mean(sand_path, rasters) if sand_path else numpy.full(rasters.shape, numpy.nan, dtype=numpy.float32)
+        rasters.soil_type = classify_soil(sand, clay)
+    elif sand_path:
+        raise ValueError("The soil type is classified from the clay raster, which is missing")
+    return rasters
+
+def changed_window(seedings, base_seedings, rasters):
+    """
+    Return the (row slice, column slice) of the cell grid of AlignedRasters covering the polygons of
+    two seedings (in the raster CRS) that differ, position by position, or None when they are the
+    same or only differ off the grid. Outside of it, both seedings burn the same species.
+    """
+    texts, base_texts = ([json.dumps(pair, sort_keys=True) for pair in pairs] for pairs in (seedings, base_seedings))
+    changed = [pair for i, pair in enumerate(seedings) if i >= len(base_texts) or base_texts[i] != texts[i]]
+    changed += [pair for i, pair in enumerate(base_seedings) if i >= len(texts) or texts[i] != base_texts[i]]
+    if not changed:
+        return None
+    left, bottom, right, top = numpy.array([bounds(geometry) for geometry, _ in changed]).T
+    cols, rows = ~rasters.cell_transform * (numpy.array([left.min(), right.max()] * 2),
+                                            numpy.array([bottom.min()] * 2 + [top.max()] * 2))
+    # One more element on every side for the pixel centres on the edges
+    window = (slice(max(math.floor(rows.min()) - 1, 0), min(math.ceil(rows.max()) + 1, rasters.shape[0])),
+              slice(max(math.floor(cols.min()) - 1, 0), min(math.ceil(cols.max()) + 1, rasters.shape[1])))
+    if any(axis.start >= axis.stop for axis in window):
+        return None
+    return window
+
+def seed_region(rasters, seedings=None, geometry_crs=None, base=None):
+    """
+    Rasterize the seedings, a list of (GeoJSON polygon, treeSpecies) pairs, into the initial species
+    layer of AlignedRasters. base is an earlier (seedings, initial species) pair of the same rasters:
+    only the window where the two seedings differ (see changed_window) is rasterized again.
+    Returns the window rasterized, None when nothing changed.
+    """
+    seedings = [(to_raster_crs(geometry, geometry_crs, rasters.crs), species) for geometry, species in seedings or []]
+    if base is None:
+        window = (slice(0, rasters.shape[0]), slice(0, rasters.shape[1]))
+        initial_species = numpy.zeros(rasters.shape, dtype=numpy.uint8)
+    else:
+        base_seedings, base_species = base
+        base_seedings = [(to_raster_crs(geometry, geometry_crs, rasters.crs), species)
+                         for geometry, species in base_seedings]
+        window = changed_window(seedings, base_seedings, rasters)
+        initial_species = base_species.copy()
+
+    if window is not None:
+        rows, cols = window
+        shape = (rows.stop - rows.start, cols.stop - cols.start)
+        transform = rasters.cell_transform * Affine.translation(cols.start, rows.start)
+        initial_species[window] = rasterize_species(seedings, shape, transform)
+        initial_species[window][~rasters.region[window]] = 0
+    rasters.initial_species = initial_species
+    return window
+
+def extract_region(dtm_path, landcover_path, region, seedings=None, geometry_crs=None,
+                   resolution=1, elevation_resampling="mean", sand_path=None, clay_path=None):
+    """
+    Read the selected region of the DTM and landcover rasters in a single aligned pass, at the cell size.
+    Everything is read straight onto the DTM grid and the polygons are rasterized in memory, so no
+    intermediate raster is written to disk.
+    """
+    rasters = read_region(dtm_path, region, geometry_crs, resolution, elevation_resampling)
+    align_region(rasters, landcover_path, sand_path, clay_path)
+    seed_region(rasters, seedings, geometry_crs)
+    return rasters
@@ -0,0 +1,146 @@
+import warnings
+
+import numpy
+
+# State values in the "<...>" tuple of a log row, in the order of plantPopulationState's operator<<
+STATE_LOG_FIELDS = ("water", "sunlight", "nitrogen", "potassium", "tree_height", "soil_type", "elevation", "tree_type")
+
+# Columns of a parsed log, in token order: time;model_id;<cell x>_<cell y>;<port>;<state>
+# "output" is 1 for the rows logging an output port (e.g. outputNeighborhood) and 0 for cell states
+LOG_COLUMNS = ("time", "model_id", "x", "y", "output") + STATE_LOG_FIELDS
+
+# Lines before the first log row ("sep=;" and the column names)
+LOG_HEADER_LINES = 2
+
+# Bytes of log parsed at a time when reading a whole log (about 100000 rows)
+CHUNK_BYTES = 4 * 2**20
+
+# Every separator of a row becomes a space and letters (port names) are dropped, leaving only the numbers
+_SEPARATORS = bytes.maketrans(b";_,<>()\r", b"        ")
+_LETTERS = bytes(range(65, 91)) + bytes(range(97, 123))
+
+#########################
+# LOG PARSING
+#########################
+
+def empty_columns():
+    """Return log columns without any row."""
+    return {name: numpy.empty(0, dtype=column_dtype(name)) for name in LOG_COLUMNS}
+
+def column_dtype(name):
+    return numpy.float64 if name in ("time", "x", "y") else numpy.int64
+
+def to_columns(table, output=None):
+    """
+    Split a (rows, len(LOG_COLUMNS)) array into typed columns, or a table without the "output"
+    column and the output flags of its rows.
+    """
+    names = LOG_COLUMNS if output is None else [name for name in LOG_COLUMNS if name != "output"]
+    columns = {name: table[:, i].astype(column_dtype(name)) for i, name in enumerate(names)}
+    if output is not None:
+        columns["output"] = output.astype(column_dtype("output"))
+    return {name: columns[name] for name in LOG_COLUMNS}
+
+def parse_integers(text):
+    """
+    Parse the whitespace-separated integers of a text (bytes) with NumPy's C tokenizer.
+    Returns None when the text holds other numbers (decimals, exponents) or other characters.
+    """
+    if b"." in text or b"+" in text:
+        return None
+    with warnings.catch_warnings():
+        # Older NumPy versions warn and return the values read so far at the first unreadable token
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            return numpy.fromstring(text, dtype=numpy.int64, sep=" ")
+        except (ValueError, DeprecationWarning):
+            return None
+
+def parse_log_text(text):
+    """
+    Parse complete rows of the Cadmium CSV log (bytes, without the header lines) into typed columns.
+    Cells named "x_y" (asymmetric models) and "(x,y)" (grid models) are both supported.
+    """
+    width = len(LOG_COLUMNS)
+    rows = text.count(b"\n") + (not text.endswith(b"\n"))
+
+    # Output rows name their port in the field before the state: "...;outputNeighborhood;<...>"
+    chars = numpy.frombuffer(text, dtype=numpy.uint8)
+    state_starts = numpy.flatnonzero(chars == 60)  # "<"
+    if len(state_starts) == rows and (state_starts >= 2).all():
+        output = chars[state_starts - 2] != 59  # ";;<" for cell states
+        values = parse_integers(text.translate(_SEPARATORS, _LETTERS))
+        if values is not None and len(values) == (width - 1) * rows:
+            return to_columns(values.reshape(rows, width - 1), output)
+
+    # Decimal numbers or malformed rows: parse row by row, keeping only the rows with a full set of values
+    parsed = []
+    for line in text.splitlines():
+        fields = line.split(b";")
+        if len(fields) < 5:
+            continue
+        tokens = (b";".join(fields[:3]) + b";" + fields[4]).translate(_SEPARATORS).split()
+        if len(tokens) != width - 1:
+            continue
+        try:
+            numbers = [float(token) for token in tokens]
+        except ValueError:
+            continue
+        numbers.insert(LOG_COLUMNS.index("output"), 1.0 if fields[3] else 0.0)
+        parsed.append(numbers)
+    if not parsed:
+        return empty_columns()
+    return to_columns(numpy.array(parsed, dtype=numpy.float64))
+
+def concat_columns(parts):
+    """Concatenate the columns of several parsed log chunks."""
+    if not parts:
+        return empty_columns()
+    return {name: numpy.concatenate([part[name] for part in parts]) for name in LOG_COLUMNS}
+
+def select_rows(columns, mask):
+    return {name: values[mask] for name, values in columns.items()}
+
+def state_rows(columns):
+    """Return the rows logging cell states, dropping the output port rows."""
+    return select_rows(columns, columns["output"] == 0)
+
+def read_log(path, outputs=False, chunk_bytes=CHUNK_BYTES):
+    """
+    Read a whole Cadmium CSV log into typed columns, parsing about chunk_bytes of rows at a time.
+    Only the cell state rows are kept unless outputs is true.
+    """
+    parts = []
+    with open(path, "rb") as f:
+        for _ in range(LOG_HEADER_LINES):
+            f.readline()
+        pending = b""
+        while True:
+            data = f.read(chunk_bytes)
+            if not data:
+                break
+            # Parse up to the last complete row, the rest goes with the next chunk
+            text, newline, pending = (pending + data).rpartition(b"\n")
+            if newline:
+                columns = parse_log_text(text + newline)
+                parts.append(columns if outputs else state_rows(columns))
+            else:
+                pending = text + pending
+        if pending.strip():
+            columns = parse_log_text(pending)
+            parts.append(columns if outputs else state_rows(columns))
+    return concat_columns(parts)
+
+def row_count(columns):
+    return len(columns["time"])
+
+def group_cells(x, y):
+    """
+    Index the cells of log rows: returns the distinct (x, y) cells (sorted), the cell of every row,
+    and the rows of every cell (cell_rows[cell_offsets[i]:cell_offsets[i + 1]], in row order).
+    """
+    cells, cell = numpy.unique(numpy.stack((x, y), axis=1), axis=0, return_inverse=True)
+    cell = cell.reshape(-1)
+    cell_rows = numpy.argsort(cell, kind="stable")
+    cell_offsets = numpy.searchsorted(cell[cell_rows], numpy.arange(len(cells) + 1))
+    return cells, cell, cell_rows, cell_offsets
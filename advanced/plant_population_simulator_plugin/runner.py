@@ -0,0 +1,97 @@
+import os
+import subprocess
+
+from .results import LOG_HEADER_LINES, concat_columns, empty_columns, parse_log_text
+
+# Log written by main.cpp, relative to the simulator's working directory
+LOG_PATH = os.path.join("log_files", "map_log.csv")
+
+#########################
+# LOG TAILING
+#########################
+
+class LogTail:
+    """Incrementally reads the rows appended to a growing Cadmium log file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.lines_read = 0
+        self.pending = b""
+
+    def read_rows(self):
+        """Return the columns (see results.parse_log_text) of the rows completed since the last call."""
+        if not os.path.exists(self.path):
+            return empty_columns()
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+
+        # Keep the last line back until the simulator has finished writing it
+        lines = (self.pending + data).split(b"\n")
+        self.pending = lines.pop()
+
+        # Skip the header lines at the start of the log
+        skipped = max(0, min(LOG_HEADER_LINES - self.lines_read, len(lines)))
+        self.lines_read += len(lines)
+        lines = lines[skipped:]
+        return parse_log_text(b"\n".join(lines)) if lines else empty_columns()
+
+    def read_remaining(self):
+        """Return the rows left once the simulator has exited, including an unterminated last line."""
+        columns = self.read_rows()
+        if self.pending:
+            self.pending += b"\n"
+            columns = concat_columns([columns, self.read_rows()])
+        return columns
+
+#########################
+# SIMULATION RUNS
+#########################
+
+class SimulationRun:
+    """One asynchronous run of the Cadmium simulator on a scenario file."""
+
+    def __init__(self, executable, scenario_path, sim_time, work_dir):
+        self.executable = executable
+        self.scenario_path = os.path.abspath(scenario_path)
+        self.sim_time = sim_time
+        self.work_dir = work_dir
+        self.log_path = os.path.join(work_dir, LOG_PATH)
+        self.output_path = os.path.join(work_dir, "log_files", "simulator_output.txt")
+        self.process = None
+        self.tail = LogTail(self.log_path)
+
+    def start(self):
+        """Launch the simulator without waiting for it; its log is written under work_dir."""
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        with open(self.output_path, "w") as output:
+            self.process = subprocess.Popen(
+                [self.executable, self.scenario_path, str(self.sim_time)],
+                cwd=self.work_dir,
+                stdout=output,
+                stderr=subprocess.STDOUT
+            )
+        return self
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def returncode(self):
+        return self.process.poll() if self.process else None
+
+    def read_rows(self):
+        """Return the columns of the log rows written since the last call (all remaining ones once the run has ended)."""
+        if self.is_running():
+            return self.tail.read_rows()
+        return self.tail.read_remaining()
+
+    def stop(self):
+        """Terminate the simulator if it is still running."""
+        if self.is_running():
+            self.process.terminate()
+            self.process.wait()
@@ -0,0 +1,456 @@
+import json
+import math
+import mmap
+import re
+
+import numpy
+from affine import Affine
+
+#########################
+# CONSTANTS
+#########################
+
+FUELS = {
+    1: 10,   # temperate or sub-polar needleleaf forest -> FM10
+    2: 13,   # sub-polar taiga -> FM13
+    5: 9,    # temperate or sub-polar broadleaf deciduous forest -> FM9
+    6: 8,    # forest foliage temperate or sub-polar -> FM8
+    8: 141,  # temperate or sub-polar shrubland -> SH1
+    10: 101, # temperate or sub-polar grassland -> GR1
+    11: 93,  # sub-polar or polar shrubland-lichen-moss -> NB3
+    12: 103, # sub-polar or polar grassland-lichen-moss -> GR3
+    13: 99,  # sub-polar or polar barren-lichen-moss -> NB9
+    14: 94,  # wetland -> NB4
+    15: 93,  # cropland -> NB3
+    16: 99,  # barren lands -> NB9
+    17: 91,  # urban -> NB1
+    18: 98,  # water -> NB8
+    19: 92,  # snow and ice -> NB2
+}
+
+# Number of cells formatted at a time when streaming a scenario
+CHUNK_SIZE = 8192
+
+# Von Neumann neighbourhood as (column, row) offsets, in the order the cells are linked
+NEIGHBORHOOD = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+# Hexagonal neighbourhood as (column, row) offsets of the cells of even and odd rows. The odd rows
+# are shifted east by half a cell, so their neighbours above and below are one column further east
+HEX_NEIGHBORHOOD = (
+    ((1, 0), (-1, 0), (-1, -1), (0, -1), (-1, 1), (0, 1)),
+    ((1, 0), (-1, 0), (0, -1), (1, -1), (0, 1), (1, 1)),
+)
+
+# Distance between the rows of hexagonal cells, as a fraction of the distance between cells
+HEX_ROW_SPACING = math.sqrt(3) / 2
+
+# Smallest distance between hexagonal cells, in map units: their names are truncated map coordinates,
+# and the half-cell shift of the odd rows must not truncate onto the cell next to it
+HEX_MIN_SPACING = 2
+
+# Neighbour offset tables of every cell layout, indexed by [row parity, neighbour]
+NEIGHBORHOODS = {
+    "square": numpy.array([NEIGHBORHOOD, NEIGHBORHOOD]),
+    "hex": numpy.array(HEX_NEIGHBORHOOD),
+}
+LAYOUTS = tuple(NEIGHBORHOODS)
+
+# Elevation resampling policies of the cells, by name, and the rasterio Resampling they read with
+ELEVATION_RESAMPLING = {"nearest": "nearest", "mean": "average", "min": "min", "max": "max"}
+
+# Fields of plantPopulationState read from the scenario (resources first, as in the JSON)
+RESOURCE_FIELDS = ("water", "sunlight", "nitrogen", "potassium")
+STATE_FIELDS = RESOURCE_FIELDS + ("soil_type", "elevation", "tree_height", "tree_type")
+
+# treeSpecies values (plantPopulationState.hpp) and the species initial regions can be seeded with
+TREE_SPECIES = {"None": 0, "Locust": 1, "Pine": 2, "Oak": 3, "Water": 4}
+SEEDABLE_SPECIES = ("Locust", "Pine", "Oak")
+
+# soilType values (plantPopulationState.hpp)
+SOIL_TYPES = {"Dry": 0, "Clay": 1, "Water": 2}
+
+# Landcover class of water (see FUELS): its cells are Water cells, in tree and soil type
+WATER_LANDCOVER = 18
+
+# Clay content (percent) of clay soils, and of clay loams when they have little sand (USDA textures)
+CLAY_PERCENT = 40
+CLAY_LOAM_PERCENT = 27
+CLAY_LOAM_MAX_SAND = 45
+
+#########################
+# CELL GRID
+#########################
+
+class CellGrid:
+    """Valid simulation cells of a sampled raster grid, stored as flat arrays in row-major order."""
+
+    def __init__(self, shape, valid, rows, cols, x, y, layers, neighbors, transform, step, resolution, layout="square"):
+        self.shape = shape              # (rows, cols) of the sampled grid
+        self.valid = valid              # bool mask over the sampled grid
+        self.rows = rows                # sampled-grid row of every cell
+        self.cols = cols                # sampled-grid column of every cell
+        self.x = x                      # truncated map x coordinate of every cell
+        self.y = y                      # truncated map y coordinate of every cell
+        self.layers = layers            # state field -> per-cell values overriding the default state
+        self.neighbors = neighbors      # (cells, 4 or 6) indices into the cell arrays, -1 when absent
+        self.transform = transform      # affine transform of the source raster pixels
+        self.step = step                # source pixels between two sampled cells
+        self.resolution = resolution    # neighbour distance written to the scenario
+        self.layout = layout            # "square" or "hex" (see LAYOUTS)
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def elevation(self):
+        return self.layers["elevation"]
+
+    @property
+    def tree_type(self):
+        return self.layers["tree_type"]
+
+    def names(self):
+        """Return the Cadmium cell id ("x_y") of every cell."""
+        return [f"{x}_{y}" for x, y in zip(self.x.tolist(), self.y.tolist())]
+
+    def link_count(self):
+        """Return the number of directed neighbour links in the grid."""
+        return int(numpy.count_nonzero(self.neighbors >= 0))
+
+def valid_cell_mask(dtm_data, landcover_data):
+    """Return the mask of pixels with a known landcover class and a non-negative elevation."""
+    landcover_class = numpy.trunc(numpy.where(numpy.isfinite(landcover_data), landcover_data, -1))
+    known_landcover = numpy.isin(landcover_class, list(FUELS.keys()))
+    return known_landcover & numpy.isfinite(dtm_data) & (dtm_data >= 0)
+
+def sample_rows(rows, stride, layout="square"):
+    """Return the array rows sampled for the given rows of a sampled grid (counted from the first row of the arrays)."""
+    rows = numpy.asarray(rows)
+    if layout == "hex":
+        return numpy.floor(rows * (stride * HEX_ROW_SPACING)).astype(numpy.int64)
+    return rows * stride
+
+def sample_columns(rows, cols, stride, layout="square"):
+    """Return the array columns sampled for the cells at the given rows and columns of a sampled grid."""
+    if layout == "hex":
+        return cols * stride + rows % 2 * (stride // 2)
+    return cols * stride
+
+def sampled_shape(shape, stride, layout="square", first_row=0):
+    """
+    Return the (rows, cols) of the sampled grid of arrays of the given shape, whose first row is the
+    sampled row first_row.
+    """
+    height, width = shape
+    if layout == "hex":
+        offset = sample_rows(first_row, stride, layout)
+        candidates = first_row + numpy.arange(int(height / (stride * HEX_ROW_SPACING)) + 2)
+        rows = numpy.count_nonzero(sample_rows(candidates, stride, layout) - offset < height)
+        return int(rows), -(-width // stride)
+    return -(-height // stride), -(-width // stride)
+
+def grid_from_mask(valid, layers, transform, step, resolution, first_row=0, layout="square"):
+    """
+    Create the cell grid of the valid cells of a sampled grid, with their map coordinates and the links
+    of the layout's neighbourhood (see NEIGHBORHOODS).
+    The layers are given over the whole sampled grid and only kept for the valid cells.
+    first_row is the row of the transform's grid the mask starts at, when it is a band of a larger grid.
+    Hexagonal cells are step pixels apart within a row, and their rows HEX_ROW_SPACING * step pixels apart.
+    """
+    # Row-major positions of the valid cells in the sampled grid
+    rows, cols = numpy.nonzero(valid)
+    parity = (rows + first_row) % 2
+
+    # Map coordinates of the underlying raster pixels, or of the hexagon centres
+    if layout == "hex":
+        if abs(transform.a) * step < HEX_MIN_SPACING:
+            raise ValueError(f"Hexagonal cells must be at least {HEX_MIN_SPACING} map units apart to get distinct names")
+        x, y = transform * ((cols + parity / 2) * step, (rows + first_row) * (step * HEX_ROW_SPACING))
+    else:
+        x, y = transform * (cols * step, (rows + first_row) * step)
+    x = numpy.trunc(x).astype(numpy.int64)
+    y = numpy.trunc(y).astype(numpy.int64)
+
+    # Index of every valid cell in the sampled grid, -1 elsewhere (padded by one for the edges)
+    index = numpy.full((valid.shape[0] + 2, valid.shape[1] + 2), -1, dtype=numpy.int64)
+    index[1:-1, 1:-1][valid] = numpy.arange(len(rows))
+
+    # Offsets of the neighbours of every cell, from the table of its row parity
+    offsets = NEIGHBORHOODS[layout][parity]
+    neighbors = index[rows[:, None] + 1 + offsets[:, :, 1], cols[:, None] + 1 + offsets[:, :, 0]]
+
+    cell_layers = {field: numpy.asarray(values)[rows, cols] for field, values in layers.items()}
+    return CellGrid(valid.shape, valid, rows, cols, x, y, cell_layers, neighbors, transform, step, resolution, layout)
+
+def classify_soil(sand, clay):
+    """
+    Classify sand and clay percentages into soilType values: Clay for clay textures (CLAY_PERCENT
+    clay or more) and clay loams (CLAY_LOAM_PERCENT clay or more with at most CLAY_LOAM_MAX_SAND
+    sand), Dry elsewhere, including where the percentages are unknown (NaN).
+    """
+    is_clay = (clay >= CLAY_PERCENT) | ((clay >= CLAY_LOAM_PERCENT) & (sand <= CLAY_LOAM_MAX_SAND))
+    return numpy.where(is_clay, SOIL_TYPES["Clay"], SOIL_TYPES["Dry"]).astype(numpy.uint8)
+
+def build_cell_grid(dtm_data, landcover_data, initial_species_data, transform, resolution, stride=None, first_row=0,
+                    layers=None, layout="square"):
+    """
+    Sample the rasters every `resolution` pixels and compute cells and neighbour links as whole arrays.
+    initial_species_data holds the treeSpecies seeded in every pixel (0 for none), and layers maps
+    other state fields (such as soil_type, Dry when not given) to arrays over the same pixels.
+    Water landcover pixels are Water cells.
+    stride is the number of array elements between samples; it defaults to resolution and is 1 for
+    rasters already read at the cell size (see rasters.extract_region).
+    first_row is the sampled row the arrays start at when they are a band of the rasters (see tiles).
+    With the "hex" layout, the cells are hexagons whose odd rows are shifted east by half a cell, and
+    each cell samples the array element its coordinates fall in (see sample_rows and sample_columns).
+    """
+    stride = resolution if stride is None else stride
+    height, width = initial_species_data.shape if initial_species_data is not None else dtm_data.shape
+
+    if layout == "hex":
+        if stride < 2:
+            raise ValueError("Hexagonal cells need rasters read at least at half the cell size")
+        rows, cols = sampled_shape((height, width), stride, layout, first_row)
+        grid_rows = first_row + numpy.arange(rows)[:, None]
+        element_rows = sample_rows(grid_rows, stride, layout) - sample_rows(first_row, stride, layout)
+        element_cols = sample_columns(grid_rows, numpy.arange(cols), stride, layout)
+        # The last cell of the odd rows can fall beyond the arrays
+        inside = element_cols < width
+        element_cols = numpy.minimum(element_cols, width - 1)
+
+        def sample(data):
+            return data[element_rows, element_cols]
+    else:
+        inside = True
+
+        def sample(data):
+            return data[:height:stride, :width:stride]
+
+    dtm_sampled = sample(dtm_data)
+    land_sampled = sample(landcover_data)
+    valid = valid_cell_mask(dtm_sampled, land_sampled) & inside
+
+    sampled = {field: sample(data).astype(numpy.int64) for field, data in (layers or {}).items()}
+    sampled["elevation"] = numpy.where(valid, dtm_sampled, 0).astype(numpy.int64)
+    if initial_species_data is not None:
+        sampled["tree_type"] = sample(initial_species_data).astype(numpy.int64)
+    else:
+        sampled["tree_type"] = numpy.zeros(valid.shape, dtype=numpy.int64)
+    if "soil_type" not in sampled:
+        sampled["soil_type"] = numpy.zeros(valid.shape, dtype=numpy.int64)
+
+    # Water cells, whatever the soil and the species seeded there
+    water = numpy.trunc(land_sampled) == WATER_LANDCOVER
+    sampled["tree_type"][water] = TREE_SPECIES["Water"]
+    sampled["soil_type"][water] = SOIL_TYPES["Water"]
+
+    return grid_from_mask(valid, sampled, transform, resolution, resolution, first_row, layout)
+
+#########################
+# SCENARIO OUTPUT
+#########################
+
+def cell_state(water=0, sunlight=0, nitrogen=0, potassium=0, soil_type=0, elevation=0, tree_height=0, tree_type=0):
+    """Return the initial plantPopulationState JSON object of a cell."""
+    return {
+        "current_resources" : {
+            "water" : water,
+            "sunlight" : sunlight,
+            "nitrogen" : nitrogen,
+            "potassium" : potassium
+        },
+        "soil_type": soil_type,
+        "elevation": elevation,
+        "tree_height" : tree_height,
+        "tree_type" : tree_type
+    }
+
+def state_fields(state):
+    """Flatten a plantPopulationState JSON object into its STATE_FIELDS values."""
+    fields = {field: state["current_resources"][field] for field in RESOURCE_FIELDS}
+    fields.update({field: state[field] for field in STATE_FIELDS if field not in RESOURCE_FIELDS})
+    return fields
+
+def default_cell():
+    """Return the "default" cell entry shared by every scenario."""
+    return {
+        "delay": "inertial",
+        "model": "plant_population",
+        "state": cell_state()
+    }
+
+def iter_cells(grid, default=None, chunk_size=CHUNK_SIZE, first=0, last=None):
+    """
+    Yield (cell name, state, neighbourhood) for every cell of the grid in row-major order,
+    or for the cells first:last only.
+    """
+    base = state_fields((default or default_cell())["state"])
+    last = len(grid) if last is None else last
+    for start in range(first, last, chunk_size):
+        stop = min(start + chunk_size, last)
+        x = grid.x[start:stop].tolist()
+        y = grid.y[start:stop].tolist()
+        layers = {field: values[start:stop].tolist() for field, values in grid.layers.items()}
+        neighbors = grid.neighbors[start:stop]
+        present = (neighbors >= 0).tolist()
+        neighbor_x = grid.x[neighbors].tolist()
+        neighbor_y = grid.y[neighbors].tolist()
+        for i in range(stop - start):
+            fields = dict(base)
+            fields.update({field: values[i] for field, values in layers.items()})
+            neighborhood = {
+                f"{nx}_{ny}": grid.resolution
+                for nx, ny, p in zip(neighbor_x[i], neighbor_y[i], present[i]) if p
+            }
+            yield f"{x[i]}_{y[i]}", cell_state(**fields), neighborhood
+
+def build_scenario(dtm_data, landcover_data, initial_species_data, transform, resolution, layout="square"):
+    """Build the asymmetric Cell-DEVS scenario dictionary from the aligned rasters."""
+    grid = build_cell_grid(dtm_data, landcover_data, initial_species_data, transform, resolution, layout=layout)
+    data = {"cells": {"default": default_cell()}}
+    for name, state, neighborhood in iter_cells(grid):
+        data["cells"][name] = {"state": state, "neighborhood": neighborhood}
+    return data
+
+def encode_entry(key, value, indent=None, depth=2):
+    """Return the text of a "key": value entry of a scenario written with indent, nested depth levels deep."""
+    text = json.dumps(key) + ": " + json.dumps(value, indent=indent)
+    if indent is None:
+        return text
+    return " " * (indent * depth) + text.replace("\n", "\n" + " " * (indent * depth))
+
+def scenario_delimiters(indent=None):
+    """Return the text opening the cells of a scenario written with indent, the separator between cells and the closing text."""
+    if indent is None:
+        return '{"cells": {', ", ", "}}"
+    pad = " " * indent
+    return "{\n" + pad + '"cells": {\n', ",\n", "\n" + pad + "}\n}"
+
+def write_cells(f, grid, indent=None, default=None, first=0, last=None, progress=None):
+    """
+    Write the entries of the cells first:last of a grid to an open scenario file, each preceded by
+    the separator (they always follow the default cell). progress is called with the fraction of
+    these cells written after every chunk.
+    """
+    separator = scenario_delimiters(indent)[1]
+    last = len(grid) if last is None else last
+    for i, (name, state, neighborhood) in enumerate(iter_cells(grid, default, first=first, last=last), 1):
+        f.write(separator)
+        f.write(encode_entry(name, {"state": state, "neighborhood": neighborhood}, indent))
+        if progress and i % CHUNK_SIZE == 0:
+            progress(i / (last - first))
+
+def write_scenario(grid, file_path, indent=None, default=None, progress=None):
+    """
+    Stream the scenario of a cell grid to a JSON file, one cell entry at a time.
+    The output matches json.dump of build_scenario with the same indent, without
+    holding the scenario in memory. progress is called with the fraction of cells
+    written after every chunk.
+    """
+    open_cells, _, close_cells = scenario_delimiters(indent)
+    default = default or default_cell()
+    with open(file_path, "w") as f:
+        f.write(open_cells)
+        f.write(encode_entry("default", default, indent))
+        write_cells(f, grid, indent, default, progress=progress)
+        f.write(close_cells)
+
+# Text preceding the tree_type value of a cell state, whatever the indent
+TREE_TYPE_KEY = re.compile(rb'"tree_type": ')
+
+def tree_type_offsets(file_path):
+    """
+    Return the byte offsets of the tree_type values of the cells of a scenario file, in file order
+    (the default cell excluded). treeSpecies values have a single digit, so they can be patched in place.
+    """
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as text:
+        offsets = numpy.fromiter((match.end() for match in TREE_TYPE_KEY.finditer(text)), dtype=numpy.int64)
+    return offsets[1:]
+
+def patch_tree_types(file_path, offsets, tree_type):
+    """Overwrite the tree_type of the cells at the given byte offsets (see tree_type_offsets) of a scenario file."""
+    with open(file_path, "r+b") as f:
+        for offset, value in zip(offsets.tolist(), tree_type.tolist()):
+            f.seek(offset)
+            f.write(b"%d" % value)
+
+def read_scenario(file_path):
+    """
+    Read a scenario JSON file written by write_scenario (or any scenario of cells on a regular
+    "x_y" grid linked to their von Neumann neighbours) back into a cell grid and its default cell.
+    """
+    with open(file_path, "r") as f:
+        cells = json.load(f)["cells"]
+    default = cells.pop("default", default_cell())
+
+    coordinates = numpy.array([name.split("_") for name in cells], dtype=numpy.int64).reshape(-1, 2)
+    if len(coordinates) == 0:
+        raise ValueError(f"{file_path} has no cells")
+
+    # Recover the integer grid the cell names were sampled on
+    spacing = []
+    for axis in range(2):
+        steps = numpy.diff(numpy.unique(coordinates[:, axis]))
+        spacing.append(int(steps.min()) if len(steps) else 1)
+    min_x, max_y = coordinates[:, 0].min(), coordinates[:, 1].max()
+    cols, col_rest = numpy.divmod(coordinates[:, 0] - min_x, spacing[0])
+    rows, row_rest = numpy.divmod(max_y - coordinates[:, 1], spacing[1])
+    if col_rest.any() or row_rest.any():
+        raise ValueError(f"The cells of {file_path} are not on a regular grid")
+
+    valid = numpy.zeros((rows.max() + 1, cols.max() + 1), dtype=bool)
+    valid[rows, cols] = True
+    if numpy.count_nonzero(valid) != len(coordinates):
+        raise ValueError(f"{file_path} has several cells with the same name")
+
+    base = state_fields(default["state"])
+    layers = {}
+    for field in STATE_FIELDS:
+        values = numpy.zeros(valid.shape, dtype=numpy.int64)
+        values[rows, cols] = [state_fields(cell["state"])[field] for cell in cells.values()]
+        if (values[rows, cols] != base[field]).any():
+            layers[field] = values
+
+    distances = {distance for cell in cells.values() for distance in cell.get("neighborhood", {}).values()}
+    if len(distances) > 1:
+        raise ValueError(f"The neighbours of {file_path} are at different distances")
+    resolution = distances.pop() if distances else 1
+
+    transform = Affine(spacing[0], 0, min_x, 0, -spacing[1], max_y)
+    grid = grid_from_mask(valid, layers, transform, 1, resolution)
+
+    # The scenario must only link cells to their von Neumann neighbours
+    names = grid.names()
+    entries = list(cells.values())
+    for i, position in enumerate(numpy.lexsort((cols, rows)).tolist()):
+        expected = {names[n] for n in grid.neighbors[i] if n >= 0}
+        if set(entries[position].get("neighborhood", {})) != expected:
+            raise ValueError(f"Cell {names[i]} of {file_path} is not linked to its von Neumann neighbours")
+
+    return grid, default
+
+def read_grid_scenario(file_path):
+    """
+    Read a grid Cell-DEVS scenario (such as basic/config) into a cell grid and its default cell.
+    Cells "(x,y)" of a "shape" [width, height] scenario get the map coordinates x and y, and the
+    states of the "cell_map" groups override the default state.
+    """
+    with open(file_path, "r") as f:
+        data = json.load(f)
+    width, height = data["scenario"]["shape"]
+    if data["scenario"].get("wrapped"):
+        raise ValueError(f"{file_path} is a wrapped grid, which cell grids do not support")
+    cells = data["cells"]
+    default = cells["default"]
+
+    base = state_fields(default["state"])
+    layers = {field: numpy.full((height, width), value, dtype=numpy.int64) for field, value in base.items()}
+    for name, group in cells.items():
+        if name == "default" or "state" not in group:
+            continue
+        x, y = numpy.array(group.get("cell_map", []), dtype=numpy.int64).reshape(-1, 2).T
+        for field, value in state_fields(group["state"]).items():
+            layers[field][y, x] = value
+
+    valid = numpy.ones((height, width), dtype=bool)
+    return grid_from_mask(valid, layers, Affine.identity(), 1, 1), default
@@ -0,0 +1,134 @@
+"""
+Binary results store.
+
+A store is a directory of .npy files converted once from a Cadmium CSV log and memory-mapped on
+open. It holds the cell state rows ordered by time (one file per column of results.LOG_COLUMNS
+plus the cell index of every row), a time index (the distinct times and the first row of each)
+and a cell index (the rows of every cell, in time order), so a time step or the history of one
+cell is read without scanning the log.
+"""
+import json
+import os
+
+import numpy
+
+from .results import LOG_COLUMNS, group_cells, read_log
+
+STORE_VERSION = 1
+
+# Suffix of the store converted from a log file
+STORE_SUFFIX = ".store"
+
+def store_path_for(log_path):
+    return log_path + STORE_SUFFIX
+
+def log_signature(log_path):
+    """Size and modification time of a log, to detect stores converted from an older log."""
+    stat = os.stat(log_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+def build_store(log_path, store_path=None):
+    """Convert a Cadmium CSV log into a results store and return the opened store."""
+    store_path = store_path or store_path_for(log_path)
+    columns = read_log(log_path)
+    return write_store(columns, store_path, {"log": log_signature(log_path)})
+
+def write_store(columns, store_path, meta):
+    """
+    Write log columns (see results.LOG_COLUMNS) as a results store, with the given entries in its
+    meta.json, and return the opened store.
+    """
+    os.makedirs(store_path, exist_ok=True)
+
+    # The log is written in time order; a stable sort keeps the order of the rows of a time step
+    order = numpy.argsort(columns["time"], kind="stable")
+    columns = {name: values[order] for name, values in columns.items()}
+
+    # Cell index: distinct (x, y) cells, the cell of every row and the rows of every cell
+    cells, cell, cell_rows, cell_offsets = group_cells(columns["x"], columns["y"])
+
+    # Time index: distinct times and the first row of each
+    times, time_offsets = numpy.unique(columns["time"], return_index=True)
+    time_offsets = numpy.append(time_offsets, len(columns["time"]))
+
+    arrays = dict(columns)
+    arrays.update({
+        "cell": cell,
+        "cells": cells,
+        "cell_rows": cell_rows,
+        "cell_offsets": cell_offsets,
+        "times": times,
+        "time_offsets": time_offsets,
+    })
+    for name, values in arrays.items():
+        numpy.save(os.path.join(store_path, name + ".npy"), values)
+
+    meta = dict(meta, version=STORE_VERSION, rows=len(columns["time"]))
+    with open(os.path.join(store_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return ResultsStore(store_path)
+
+def open_store(log_path):
+    """Open the store of a log, converting the log first when it has no store or a stale one."""
+    store_path = store_path_for(log_path)
+    meta_path = os.path.join(store_path, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if meta.get("version") == STORE_VERSION and meta.get("log") == log_signature(log_path):
+            return ResultsStore(store_path)
+    return build_store(log_path, store_path)
+
+class ResultsStore:
+    """Memory-mapped view of a results store."""
+
+    def __init__(self, store_path):
+        self.path = store_path
+
+        def load(name):
+            return numpy.load(os.path.join(store_path, name + ".npy"), mmap_mode="r")
+
+        self.columns = {name: load(name) for name in LOG_COLUMNS}
+        self.cell = load("cell")
+        self.cells = load("cells")
+        self.cell_rows = load("cell_rows")
+        self.cell_offsets = load("cell_offsets")
+        self.times = load("times")
+        self.time_offsets = load("time_offsets")
+
+    def __len__(self):
+        return len(self.cell)
+
+    def all_rows(self):
+        """Return every row, as columns in time order."""
+        return {name: numpy.asarray(values) for name, values in self.columns.items()}
+
+    def step(self, index):
+        """Return the rows of the index-th distinct time (see times), as columns."""
+        start, stop = self.time_offsets[index], self.time_offsets[index + 1]
+        return {name: numpy.asarray(values[start:stop]) for name, values in self.columns.items()}
+
+    def time_step(self, time):
+        """Return the rows logged at a time, as columns (empty when nothing was logged then)."""
+        i = numpy.searchsorted(self.times, time)
+        if i == len(self.times) or self.times[i] != time:
+            return {name: numpy.asarray(values[:0]) for name, values in self.columns.items()}
+        return self.step(i)
+
+    def cell_index(self, x, y):
+        """Return the index of the cell at (x, y), or None when it never appears in the log."""
+        i = numpy.searchsorted(self.cells[:, 0], x, side="left")
+        stop = numpy.searchsorted(self.cells[:, 0], x, side="right")
+        j = i + numpy.searchsorted(self.cells[i:stop, 1], y)
+        if j < stop and self.cells[j, 1] == y:
+            return int(j)
+        return None
+
+    def cell_history(self, x, y):
+        """Return the rows of the cell at (x, y) in time order, as columns."""
+        index = self.cell_index(x, y)
+        if index is None:
+            rows = numpy.empty(0, dtype=numpy.int64)
+        else:
+            rows = self.cell_rows[self.cell_offsets[index]:self.cell_offsets[index + 1]]
+        return {name: numpy.asarray(values[rows]) for name, values in self.columns.items()}
@@ -0,0 +1,175 @@
+"""
+Parameter sweeps: prepare and simulate the same region for every combination of a parameter grid.
+
+Every run gets its own directory (named after a hash of its parameters and inputs) holding its
+scenario, the simulator log and a summary.json written once the simulation has succeeded, so an
+interrupted sweep resumes by skipping the runs that already have a summary. Failed simulations
+get a failed.json instead and are retried. The summaries are collected into summary.csv in the
+sweep directory.
+"""
+import csv
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy
+
+from .cache import DiskCache, source_identity
+from .engine import LOCUST, NONE, OAK, PINE, WATER
+from .pipeline import prepare_scenario
+from .results import read_log, row_count
+from .runner import SimulationRun
+from .timeline import CellTimeline
+
+# Columns of summary.csv, in order
+SUMMARY_FIELDS = (
+    "run", "resolution", "sim_time", "seeding", "returncode", "prepare_seconds", "run_seconds",
+    "log_rows", "cells", "final_time", "empty", "locust", "pine", "oak", "water", "mean_tree_height", "error"
+)
+
+# Input rasters of a run (see pipeline.prepare_scenario), part of its identity
+SOURCE_PATHS = ("dtm", "land", "sand", "clay")
+
+SPECIES = (("empty", NONE), ("locust", LOCUST), ("pine", PINE), ("oak", OAK), ("water", WATER))
+
+def parameter_grid(resolutions, sim_times, seedings=None):
+    """
+    Return every combination of resolutions, sim times and initial seedings as run parameters.
+    seedings maps a label to a list of (GeoJSON polygon, treeSpecies) pairs (see pipeline.prepare_scenario).
+    """
+    seedings = seedings or {"none": []}
+    return [
+        {"resolution": resolution, "sim_time": sim_time, "seeding": label, "seeding_regions": regions}
+        for resolution, sim_time, (label, regions) in itertools.product(resolutions, sim_times, seedings.items())
+    ]
+
+def run_key(params, paths, region, executable, geometry_crs=None):
+    """
+    Return the directory name of a run: a hash of everything that changes its result, its parameters,
+    its region and the CRS of the geometries, and the identity of its input rasters and simulator.
+    """
+    identity = {key: params[key] for key in ("resolution", "sim_time", "seeding_regions")}
+    executable_path = shutil.which(executable) or executable
+    identity.update({
+        "region": region,
+        "geometry_crs": geometry_crs,
+        "sources": {name: source_identity(paths[name]) for name in SOURCE_PATHS if paths.get(name)},
+        "executable": source_identity(executable_path) if os.path.exists(executable_path) else executable,
+    })
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:16]
+
+def summarize_log(log_path):
+    """Return the number of rows, cells, the last time and the final population of a simulation log."""
+    columns = read_log(log_path)
+    summary = {"log_rows": row_count(columns), "cells": 0, "final_time": None, "mean_tree_height": None}
+    summary.update({name: 0 for name, _ in SPECIES})
+    if not row_count(columns):
+        return summary
+
+    timeline = CellTimeline.from_columns(columns)
+    final_time = timeline.times[-1]
+    present, state = timeline.state_at(final_time)
+    tree_type = state["tree_type"][present]
+    height = state["tree_height"][present]
+    trees = (tree_type != NONE) & (tree_type != WATER)
+
+    summary.update({"cells": len(timeline), "final_time": float(final_time)})
+    summary.update({name: int(numpy.count_nonzero(tree_type == species)) for name, species in SPECIES})
+    if trees.any():
+        summary["mean_tree_height"] = float(height[trees].mean())
+    return summary
+
+def run_one(params, paths, region, executable, run_dir, geometry_crs=None, cache_dir=None):
+    """
+    Prepare the scenario of one run in run_dir (reusing the stages cached in cache_dir, if any),
+    simulate it and write its summary.json, or its failed.json when the simulator fails.
+    """
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)  # Leftovers of an interrupted run
+    os.makedirs(run_dir)
+    run_paths = dict(paths, json=os.path.join(run_dir, "map.json"))
+    run_paths.pop("compact", None)
+
+    start = time.perf_counter()
+    cache = DiskCache(cache_dir) if cache_dir else None
+    prepare_scenario(run_paths, region, params["seeding_regions"], geometry_crs, params["resolution"], cache=cache)
+    prepare_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    run = SimulationRun(executable, run_paths["json"], params["sim_time"], run_dir).start()
+    returncode = run.process.wait()
+    run_seconds = time.perf_counter() - start
+
+    summary = {
+        "run": os.path.basename(run_dir),
+        "resolution": params["resolution"],
+        "sim_time": params["sim_time"],
+        "seeding": params["seeding"],
+        "returncode": returncode,
+        "prepare_seconds": round(prepare_seconds, 3),
+        "run_seconds": round(run_seconds, 3),
+    }
+    if os.path.exists(run.log_path):
+        summary.update(summarize_log(run.log_path))
+
+    # The summary marks the run as done, so it is written last and atomically, and only on success
+    name = "summary.json" if returncode == 0 else "failed.json"
+    partial_path = os.path.join(run_dir, name + ".partial")
+    with open(partial_path, "w") as f:
+        json.dump(summary, f, indent=4)
+    os.replace(partial_path, os.path.join(run_dir, name))
+    return summary
+
+def read_summary(run_dir):
+    """Return the summary of a run done successfully, None for runs not done or failed (see run_one)."""
+    path = os.path.join(run_dir, "summary.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+def run_sweep(paths, region, runs, executable, sweep_dir, workers=None, geometry_crs=None, progress=None,
+              cache_dir=None):
+    """
+    Prepare and simulate every run of a parameter grid (see parameter_grid) over a pool of at most
+    `workers` processes, each run in its own directory under sweep_dir (see run_key). Runs with a
+    summary are skipped, failed ones are run again. progress(done, total, summary) is called as runs
+    complete. Writes summary.csv and returns the summaries in the order of the runs. With a cache_dir,
+    the runs share the cached preparation stages (see cache.DiskCache).
+    """
+    os.makedirs(sweep_dir, exist_ok=True)
+    run_dirs = [os.path.join(sweep_dir, run_key(params, paths, region, executable, geometry_crs)) for params in runs]
+    summaries = [read_summary(run_dir) for run_dir in run_dirs]
+    pending = [i for i, summary in enumerate(summaries) if summary is None]
+    done = len(runs) - len(pending)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(run_one, runs[i], paths, region, executable, run_dirs[i], geometry_crs, cache_dir): i
+                for i in pending
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    summaries[i] = future.result()
+                except Exception as e:
+                    # Failed runs have no summary.json and are retried by the next sweep
+                    summaries[i] = {"run": os.path.basename(run_dirs[i]), "error": str(e)}
+                    summaries[i].update({key: runs[i][key] for key in ("resolution", "sim_time", "seeding")})
+                done += 1
+                if progress:
+                    progress(done, len(runs), summaries[i])
+
+    write_summary_table(summaries, os.path.join(sweep_dir, "summary.csv"))
+    return summaries
+
+def write_summary_table(summaries, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(summaries)
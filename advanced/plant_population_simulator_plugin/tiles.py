@@ -0,0 +1,109 @@
+"""
+Tiled, parallel scenario generation for large extents.
+
+The sampled grid is split into bands of rows (tiles) that a pool of processes turns into cells and
+scenario text. Every tile is built with a halo of one row above and below it, so the neighbour links
+of its edge cells are the ones of the whole grid, but only the cells of its own rows are written.
+The cells of a tile are a row-major range of the cells of the grid, so appending the fragments of
+the tiles in order gives the same file as write_scenario.
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from .scenario import (build_cell_grid, default_cell, encode_entry, sample_rows, sampled_shape, scenario_delimiters,
+                       write_cells)
+
+# Sampled rows of a tile
+TILE_ROWS = 128
+
+# Rows read beyond each edge of a tile, the reach of the von Neumann and hexagonal neighbourhoods
+HALO = 1
+
+def tile_bounds(rows, tile_rows=TILE_ROWS):
+    """Return the (first row, end row) of every tile of a sampled grid with the given number of rows."""
+    return [(start, min(start + tile_rows, rows)) for start in range(0, rows, tile_rows)]
+
+def write_tile(task):
+    """
+    Build the cells of one tile from its rows and halo, and write their scenario entries to a
+    fragment file. Runs in a worker process; returns the number of cells and neighbour links written.
+    """
+    arrays, layers, transform, resolution, stride, first_row, start, stop, indent, default, layout, path = task
+    grid = build_cell_grid(*arrays, transform, resolution, stride, first_row, layers, layout)
+
+    # Cells are in row-major order, the ones of the tile's own rows are a contiguous range
+    first, last = numpy.searchsorted(grid.rows, [start - first_row, stop - first_row])
+    with open(path, "w") as f:
+        write_cells(f, grid, indent, default, first, last)
+    return int(last - first), int(numpy.count_nonzero(grid.neighbors[first:last] >= 0))
+
+def tile_band(first_row, end_row, rows, height, stride, layout="square"):
+    """Return the slice of array rows sampled by the sampled rows first_row:end_row of a grid of `rows` rows."""
+    return slice(int(sample_rows(first_row, stride, layout)),
+                 int(sample_rows(end_row, stride, layout)) if end_row < rows else height)
+
+def halo_tiles(rows, tile_rows=TILE_ROWS):
+    """Yield the (first row, end row) of the rows of every tile with its halo, and its own (start, stop) rows."""
+    for start, stop in tile_bounds(rows, tile_rows):
+        yield (max(start - HALO, 0), min(stop + HALO, rows)), (start, stop)
+
+def write_fragments(file_path, write, tasks, workers=None, indent=None, default=None, progress=None):
+    """
+    Write a scenario to a JSON file from the fragments of its tiles, written to temporary files by
+    write(task + (fragment path,)) in a pool of at most `workers` processes (in this process for one
+    worker). The fragments are appended in the order of the tasks as soon as the tiles before them
+    are done, and progress is called with the fraction of tiles written. Returns the number of cells
+    and neighbour links written.
+    """
+    default = default or default_cell()
+    open_cells, _, close_cells = scenario_delimiters(indent)
+
+    fragments = tempfile.mkdtemp(prefix=".tiles-", dir=os.path.dirname(os.path.abspath(file_path)))
+    paths = [os.path.join(fragments, f"{i}.json") for i in range(len(tasks))]
+    tasks = [task + (path,) for task, path in zip(tasks, paths)]
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        results = executor.map(write, tasks) if executor else map(write, tasks)
+        cells, links = 0, 0
+        with open(file_path, "w") as f:
+            f.write(open_cells)
+            f.write(encode_entry("default", default, indent))
+            for i, (path, (tile_cells, tile_links)) in enumerate(zip(paths, results), 1):
+                cells, links = cells + tile_cells, links + tile_links
+                with open(path, "r") as fragment:
+                    shutil.copyfileobj(fragment, f)
+                os.remove(path)
+                if progress:
+                    progress(i / len(tasks))
+            f.write(close_cells)
+        return cells, links
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        shutil.rmtree(fragments, ignore_errors=True)
+
+def write_tiled_scenario(dtm_data, landcover_data, initial_species_data, transform, resolution, file_path,
+                         stride=None, workers=None, tile_rows=TILE_ROWS, indent=None, default=None, progress=None,
+                         layers=None, layout="square"):
+    """
+    Write the scenario of the rasters and state field layers, with cells of the given layout (see
+    scenario.build_cell_grid), to a JSON file, generating its tiles in a pool of at most `workers`
+    processes (see write_fragments). The output is the same as write_scenario of the whole cell grid.
+    Returns the number of cells and neighbour links written.
+    """
+    stride = resolution if stride is None else stride
+    height, width = initial_species_data.shape if initial_species_data is not None else dtm_data.shape
+    rows = sampled_shape((height, width), stride, layout)[0]
+    default = default or default_cell()
+
+    tasks = []
+    for (first_row, end_row), (start, stop) in halo_tiles(rows, tile_rows):
+        band = tile_band(first_row, end_row, rows, height, stride, layout)
+        arrays = [None if data is None else data[band, :width] for data in (dtm_data, landcover_data, initial_species_data)]
+        band_layers = {field: data[band, :width] for field, data in (layers or {}).items()}
+        tasks.append((arrays, band_layers, transform, resolution, stride, first_row, start, stop, indent, default, layout))
+    return write_fragments(file_path, write_tile, tasks, workers, indent, default, progress)
@@ -0,0 +1,65 @@
+"""
+Per-cell change timelines of a simulation.
+
+The Cadmium logger only writes the cells whose state changed, so a result is kept as the distinct
+cells plus, for every cell, the times and values of its changes. The state of the whole grid at a
+time is reconstructed from it, so what is displayed grows with the number of cells, not of log rows.
+"""
+import numpy
+
+from .results import group_cells
+
+# State values kept in a timeline unless others are requested
+TIMELINE_FIELDS = ("tree_height", "tree_type")
+
+class CellTimeline:
+    """
+    Changes of every cell in (cell, time) order: the changes of cell i are the entries
+    offsets[i]:offsets[i + 1] of change_times and of every array of values.
+    """
+
+    def __init__(self, cells, offsets, change_times, values):
+        self.cells = numpy.asarray(cells)
+        self.offsets = numpy.asarray(offsets)
+        self.change_times = numpy.asarray(change_times)
+        self.values = {name: numpy.asarray(column) for name, column in values.items()}
+        self.times = numpy.unique(self.change_times)
+
+        # Sorted search keys: the cell of a change, then the rank of its time
+        cell = numpy.repeat(numpy.arange(len(self.cells)), numpy.diff(self.offsets))
+        self.keys = cell * len(self.times) + numpy.searchsorted(self.times, self.change_times)
+
+    @classmethod
+    def from_columns(cls, columns, fields=TIMELINE_FIELDS):
+        """Build the timeline of parsed log columns (see results.read_log) holding cell state rows."""
+        order = numpy.argsort(columns["time"], kind="stable")
+        columns = {name: columns[name][order] for name in ("time", "x", "y") + tuple(fields)}
+        cells, _, cell_rows, cell_offsets = group_cells(columns["x"], columns["y"])
+        values = {name: columns[name][cell_rows] for name in fields}
+        return cls(cells, cell_offsets, columns["time"][cell_rows], values)
+
+    @classmethod
+    def from_store(cls, store, fields=TIMELINE_FIELDS):
+        """Build the timeline of a results store (see store.ResultsStore), using its cell index."""
+        rows = numpy.asarray(store.cell_rows)
+        values = {name: store.columns[name][rows] for name in fields}
+        return cls(store.cells, store.cell_offsets, store.columns["time"][rows], values)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def change_count(self):
+        return len(self.change_times)
+
+    def state_at(self, time):
+        """
+        Return the state of every cell at a time: a mask of the cells logged at or before it and,
+        for every field, the value of the last change of each cell (0 for the cells not logged yet).
+        """
+        rank = numpy.searchsorted(self.times, time, side="right") - 1
+        queries = numpy.arange(len(self.cells)) * len(self.times) + rank
+        last = numpy.searchsorted(self.keys, queries, side="right") - 1
+        present = last >= self.offsets[:-1]
+        last = numpy.where(present, last, 0)
+        state = {name: numpy.where(present, column[last], 0) for name, column in self.values.items()}
+        return present, state
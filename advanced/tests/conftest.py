@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+# The plugin package is imported from the source tree, like the benchmarks do
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Tiny synthetic region: 1 m pixels, so a resolution of a few metres gives a grid of a few hundred cells
+SIZE = 96
+WEST, NORTH = 500000.0, 5000000.0
+CRS = "EPSG:32618"
+
+def polygon(*points):
+    return {"type": "Polygon", "coordinates": [list(points) + [points[0]]]}
+
+def square(x, y, size):
+    return polygon((x, y), (x + size, y), (x + size, y + size), (x, y + size))
+
+# Region of the scenarios, not aligned on the cells, and the seedings of the incremental preparations
+REGION = polygon((WEST + 3, NORTH - 5), (WEST + 90, NORTH - 11), (WEST + 85, NORTH - 93), (WEST + 7, NORTH - 88))
+SEEDINGS = (
+    [(square(WEST + 10, NORTH - 50, 30), 2), (square(WEST + 55, NORTH - 80, 20), 1)],
+    [(square(WEST + 10, NORTH - 50, 36), 2), (square(WEST + 55, NORTH - 80, 20), 1)],
+    [(square(WEST + 55, NORTH - 80, 20), 1), (square(WEST + 10, NORTH - 50, 30), 3)],
+    [],
+    [(square(WEST + 10, NORTH - 50, 30), 2), (square(WEST + 55, NORTH - 80, 20), 1)],
+)
+
+def write_raster(path, data, nodata=None):
+    profile = {"driver": "GTiff", "width": SIZE, "height": SIZE, "count": 1, "dtype": data.dtype.name,
+               "crs": CRS, "transform": from_origin(WEST, NORTH, 1, 1), "nodata": nodata}
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data, 1)
+    return str(path)
+
+@pytest.fixture(scope="session")
+def paths(tmp_path_factory):
+    """Source rasters of the synthetic region: a sloped DTM with holes, mixed landcover with water, and soil."""
+    directory = tmp_path_factory.mktemp("rasters")
+    rng = numpy.random.default_rng(7)
+    rows, cols = numpy.mgrid[0:SIZE, 0:SIZE]
+    dtm = (100 + rows * 0.5 + cols * 0.25 + rng.normal(0, 1, (SIZE, SIZE))).astype(numpy.float32)
+    dtm[40:44, 60:70] = -9999
+    landcover = rng.choice(numpy.array([1, 5, 10, 15, 18, 0], dtype=numpy.uint8), (SIZE, SIZE),
+                           p=[0.3, 0.2, 0.2, 0.15, 0.1, 0.05])
+    landcover[60:75, 20:40] = 18
+    return {
+        "dtm": write_raster(directory / "dtm.tif", dtm, -9999),
+        "land": write_raster(directory / "land.tif", landcover),
+        "sand": write_raster(directory / "sand.tif", rng.uniform(0, 100, (SIZE, SIZE)).astype(numpy.float32)),
+        "clay": write_raster(directory / "clay.tif", rng.uniform(0, 60, (SIZE, SIZE)).astype(numpy.float32)),
+    }
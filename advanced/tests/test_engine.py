@@ -0,0 +1,24 @@
+import os
+
+import pytest
+from conftest import ROOT
+
+from plant_population_simulator_plugin.engine import compare_with_log, load_scenario, scenario_model, simulate
+from plant_population_simulator_plugin.results import read_log
+
+# Scenario, log and model of the shipped simulations
+SHIPPED = [
+    (os.path.join(ROOT, "config", "map.json"), os.path.join(ROOT, "log_file", "map_log.csv"), "advanced"),
+    (os.path.join(ROOT, "..", "basic", "config", "plant_population_config.json"),
+     os.path.join(ROOT, "..", "basic", "log_files", "grid_log.csv"), "basic"),
+]
+
+@pytest.mark.parametrize("config_path, log_path, model", SHIPPED)
+def test_engine_matches_the_shipped_logs(config_path, log_path, model):
+    assert scenario_model(config_path) == model
+    grid, default = load_scenario(config_path)
+    columns = read_log(log_path, outputs=True)
+    history = simulate(grid, default, int(columns["time"].max()), model)
+
+    mismatches = compare_with_log(grid, history, columns)
+    assert [t for t, step in enumerate(mismatches) if any(step.values())] == []
@@ -0,0 +1,77 @@
+import filecmp
+import json
+
+import numpy
+import pytest
+from conftest import NORTH, REGION, SEEDINGS, WEST, square
+
+from plant_population_simulator_plugin.cache import DiskCache
+from plant_population_simulator_plugin.pipeline import prepare_scenario
+from plant_population_simulator_plugin.scenario import TREE_SPECIES, patch_tree_types, tree_type_offsets
+
+LAYOUTS = ("square", "hex")
+
+# Metres between cells, so the region has a few hundred cells
+RESOLUTION = 4
+
+def prepare(paths, output, seedings=SEEDINGS[0], layout="square", **options):
+    return prepare_scenario(dict(paths, json=str(output)), REGION, seedings, None, RESOLUTION, layout=layout,
+                            **options)
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_tiled_and_block_scenarios_match_the_untiled_one(paths, tmp_path, layout):
+    prepare(paths, tmp_path / "untiled.json", layout=layout)
+    prepare(paths, tmp_path / "tiled.json", layout=layout, workers=2, tile_rows=3)
+    timer = prepare(paths, tmp_path / "blocks.json", layout=layout, memory_budget=64 * 2**10)
+
+    assert timer.counts["write"]["blocks"] > 1
+    assert filecmp.cmp(tmp_path / "untiled.json", tmp_path / "tiled.json", shallow=False)
+    assert filecmp.cmp(tmp_path / "untiled.json", tmp_path / "blocks.json", shallow=False)
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_patched_scenarios_match_full_rebuilds(paths, tmp_path, layout):
+    cache = DiskCache(str(tmp_path / "cache"))
+    patched = 0
+    for i, seedings in enumerate(SEEDINGS):
+        timer = prepare(paths, tmp_path / "patched.json", seedings, layout, cache=cache)
+        prepare(paths, tmp_path / "full.json", seedings, layout)
+        assert filecmp.cmp(tmp_path / "patched.json", tmp_path / "full.json", shallow=False), f"seedings {i}"
+        patched += "patched_cells" in timer.counts.get("cells", {})
+
+    # The first preparation builds the base, the last one is cached, the others patch the base
+    assert patched == len(SEEDINGS) - 2
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_tree_type_offsets_point_at_the_tree_type_of_every_cell(paths, tmp_path, layout):
+    path = tmp_path / "scenario.json"
+    prepare(paths, path, layout=layout)
+    with open(path, "r") as f:
+        cells = json.load(f)["cells"]
+    del cells["default"]
+    text = path.read_bytes()
+    offsets = tree_type_offsets(path)
+
+    tree_type = numpy.array([int(text[offset:offset + 1]) for offset in offsets.tolist()])
+    assert tree_type.tolist() == [cell["state"]["tree_type"] for cell in cells.values()]
+
+    # Patching every cell to Oak and back leaves the file unchanged
+    patch_tree_types(path, offsets, numpy.full(len(offsets), TREE_SPECIES["Oak"]))
+    with open(path, "r") as f:
+        patched = json.load(f)["cells"]
+    del patched["default"]
+    assert {cell["state"]["tree_type"] for cell in patched.values()} == {TREE_SPECIES["Oak"]}
+    patch_tree_types(path, offsets, tree_type)
+    assert path.read_bytes() == text
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_seedings_added_off_the_grid_patch_nothing(paths, tmp_path, layout):
+    cache = DiskCache(str(tmp_path / "cache"))
+    prepare(paths, tmp_path / "base.json", SEEDINGS[0], layout, cache=cache)
+    for outside in (square(WEST + 200, NORTH - 50, 20), square(WEST - 80, NORTH + 40, 20)):
+        seedings = SEEDINGS[0] + [(outside, 3)]
+        timer = prepare(paths, tmp_path / "patched.json", seedings, layout, cache=cache)
+        prepare(paths, tmp_path / "full.json", seedings, layout)
+
+        assert timer.counts["cells"]["patched_cells"] == 0
+        assert filecmp.cmp(tmp_path / "patched.json", tmp_path / "full.json", shallow=False)
+        assert filecmp.cmp(tmp_path / "patched.json", tmp_path / "base.json", shallow=False)